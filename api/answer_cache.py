@@ -0,0 +1,131 @@
+import hashlib
+import time
+from collections import OrderedDict
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from config import (
+    ANSWER_MODEL,
+    ANSWER_TEMPERATURE,
+    ANSWER_CACHE_ENABLED,
+    ANSWER_CACHE_THRESHOLD,
+    ANSWER_CACHE_MAX_ENTRIES,
+    ANSWER_CACHE_TTL,
+)
+from metrics import ANSWER_CACHE_REQUESTS, ANSWER_CACHE_SIMILARITY
+from utils import content_hash
+
+REPLAY_CHUNK_CHARS = 64   # cached answers go out in pieces this size, like a model stream
+
+
+def context_fingerprint(ctx: str) -> str:
+    """Same snippets in the same order (so citations [n] still line up), same model settings."""
+    return hashlib.sha256(f"{ANSWER_MODEL}\x00{ANSWER_TEMPERATURE}\x00{ctx}".encode("utf-8")).hexdigest()
+
+
+def _unit(vec: List[float]) -> np.ndarray:
+    v = np.asarray(vec, dtype=np.float32)
+    return v / (np.linalg.norm(v) or 1.0)
+
+
+class AnswerCache:
+    """
+    Final answers keyed by (tenant, context fingerprint), each with the
+    embedding of the question that produced it. A new question is a hit when
+    it packed exactly the same context and its embedding is within
+    `threshold` cosine of a cached question's. Requiring the same context
+    means an ingest that changes retrieval results can never replay an old
+    answer; the TTL bounds how long a wording-sensitive answer lives.
+    Per-worker, LRU-bounded by entry count.
+    """
+
+    def __init__(self, max_entries: int, threshold: float, ttl: float):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.ttl = ttl
+        # (tenant, fingerprint, question hash) -> (stored_at, unit question vector, answer)
+        self._lru: "OrderedDict[Tuple[str, str, bytes], Tuple[float, np.ndarray, str]]" = OrderedDict()
+        # (tenant, fingerprint) -> question hashes cached for that context
+        self._by_context: Dict[Tuple[str, str], Dict[bytes, None]] = {}
+        self.hits = 0
+        self.below_threshold = 0
+        self.no_match = 0
+        self.stores = 0
+        self.evictions = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.below_threshold + self.no_match
+        return {
+            "hits": self.hits,
+            "below_threshold": self.below_threshold,
+            "no_match": self.no_match,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "entries": len(self._lru),
+            "contexts": len(self._by_context),
+            "max_entries": self.max_entries,
+            "threshold": self.threshold,
+            "ttl": self.ttl,
+        }
+
+    def _drop(self, key: Tuple[str, str, bytes]):
+        del self._lru[key]
+        ctx_key = key[:2]
+        members = self._by_context.get(ctx_key)
+        if members is not None:
+            members.pop(key[2], None)
+            if not members:
+                del self._by_context[ctx_key]
+
+    def lookup(self, tenant_id: str, fingerprint: str, q_emb: List[float]) -> Optional[str]:
+        now = time.monotonic()
+        keys = []
+        for qh in list(self._by_context.get((tenant_id, fingerprint), ())):
+            key = (tenant_id, fingerprint, qh)
+            if now - self._lru[key][0] > self.ttl:
+                self._drop(key)
+            else:
+                keys.append(key)
+        if not keys:
+            self.no_match += 1
+            ANSWER_CACHE_REQUESTS.inc(result="no_match")
+            return None
+
+        sims = np.stack([self._lru[k][1] for k in keys]) @ _unit(q_emb)
+        best = int(np.argmax(sims))
+        sim = float(sims[best])
+        if sim < self.threshold:
+            self.below_threshold += 1
+            ANSWER_CACHE_REQUESTS.inc(result="below_threshold")
+            ANSWER_CACHE_SIMILARITY.observe(sim, result="below_threshold")
+            return None
+        self._lru.move_to_end(keys[best])
+        self.hits += 1
+        ANSWER_CACHE_REQUESTS.inc(result="hit")
+        ANSWER_CACHE_SIMILARITY.observe(sim, result="hit")
+        return self._lru[keys[best]][2]
+
+    def store(self, tenant_id: str, fingerprint: str, q: str, q_emb: List[float], answer: str):
+        if not answer.strip():
+            return
+        qh = content_hash(q, ANSWER_MODEL)
+        key = (tenant_id, fingerprint, qh)
+        self._lru[key] = (time.monotonic(), _unit(q_emb), answer)
+        self._lru.move_to_end(key)
+        self._by_context.setdefault((tenant_id, fingerprint), {})[qh] = None
+        self.stores += 1
+        while len(self._lru) > self.max_entries:
+            self._drop(next(iter(self._lru)))
+            self.evictions += 1
+
+
+async def replay(answer: str) -> AsyncIterator[str]:
+    for i in range(0, len(answer), REPLAY_CHUNK_CHARS):
+        yield answer[i:i + REPLAY_CHUNK_CHARS]
+
+
+answer_cache: Optional[AnswerCache] = (
+    AnswerCache(ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_THRESHOLD, ANSWER_CACHE_TTL) if ANSWER_CACHE_ENABLED else None
+)
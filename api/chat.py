@@ -1,143 +1,96 @@
-import re
-from typing import List
+import asyncio
+import time
 
-import psycopg2
 from fastapi import APIRouter, HTTPException
 from fastapi.responses import StreamingResponse
 from openai import AsyncOpenAI
 
+from answer_cache import answer_cache, context_fingerprint, replay
 from config import (
     OPENAI_API_KEY,
-    EMBED_MODEL,
     ANSWER_MODEL,
     ANSWER_TEMPERATURE,
-    MAX_CONTEXT_CHARS,
+    MAX_CONTEXT_TOKENS,
+    RETRIEVAL_MODE,
+    RERANKER,
+    RERANK_TOP_K,
 )
-from db import DB_CONN
-from utils import build_context_snippets
+from context import pack_context
+from db import connection, to_db_vector
+from embeddings import embed_question
+from indexes import SEARCH_PROFILES, apply_search_profile
+from metrics import CHAT_CONTEXT_TOKENS, CHAT_REQUESTS, CHAT_SECONDS
+from rerank import get_scorer
+from retrieval import TOP_K, format_stats, retrieve, retrieve_parallel
+from retrieval_cache import retrieval_cache
 
 router = APIRouter()
 client = AsyncOpenAI(api_key=OPENAI_API_KEY)
 
 
-def rr_fusion_many(results_lists, k: int = 40):
-    scores = {}
-    for results in results_lists:
-        for rank, row in enumerate(results, start=1):
-            rid = row[0]
-            scores[rid] = scores.get(rid, 0.0) + 1.0 / (k + rank)
-    return sorted(scores.items(), key=lambda x: x[1], reverse=True)
-
-
-def to_vector_literal(vec: List[float]) -> str:
-    # pgvector literal: "[0.12,0.34,...]"
-    return "[" + ",".join(f"{x:.6f}" for x in vec) + "]"
-
-
 @router.post("/chat/stream")
 async def chat_stream(payload: dict):
     q = payload.get("q")
     tenant_id = payload.get("tenant_id")
+    profile = payload.get("profile")  # ANN recall/latency: fast | balanced | accurate
 
     if not q or not tenant_id:
         raise HTTPException(status_code=400, detail="Missing q or tenant_id")
-
+    if profile is not None and profile not in SEARCH_PROFILES:
+        raise HTTPException(status_code=400, detail=f"Unknown profile; use one of {sorted(SEARCH_PROFILES)}")
+
+    started = time.perf_counter()
+    # a reranked top-k is precise enough to send fewer snippets
+    top_k = RERANK_TOP_K if get_scorer() is not None else TOP_K
+    q_emb = None
+    retrieval_stats = "cached"
+    degraded = False
     try:
-        # 1) embed query
-        emb_resp = await client.embeddings.create(model=EMBED_MODEL, input=[q])
-        q_emb = emb_resp.data[0].embedding
-        q_vec = to_vector_literal(q_emb)
-
-        # numeric-aware LIKE variant (helps for pricing queries)
-        num_norm_q = re.sub(r"[^0-9a-zA-Z %$]", " ", q or "")
-        num_norm_q = re.sub(r"\s+", " ", num_norm_q).strip()
-
-        # 2) retrieve (trigram + dense + ILIKEs)
-        conn = psycopg2.connect(**DB_CONN)
-        cur = conn.cursor()
-
-        # trigram similarity on text
-        cur.execute(
-            """
-            SELECT id, content
-            FROM documents
-            WHERE tenant_id = %s
-            ORDER BY similarity(content, %s) DESC
-            LIMIT 15
-            """,
-            (tenant_id, q),
-        )
-        trigram_hits = cur.fetchall()
-
-        # dense ANN
-        cur.execute(
-            f"""
-            SELECT id, content
-            FROM documents
-            WHERE tenant_id = %s
-            ORDER BY embedding <-> %s::vector
-            LIMIT 15
-            """,
-            (tenant_id, q_vec),
-        )
-        dense_hits = cur.fetchall()
-
-        # ILIKE exact-ish
-        like_q = f"%{q.strip()}%"
-        cur.execute(
-            """
-            SELECT id, content
-            FROM documents
-            WHERE tenant_id = %s AND content ILIKE %s
-            LIMIT 20
-            """,
-            (tenant_id, like_q),
-        )
-        ilike_hits = cur.fetchall()
-
-        # numeric-aware ILIKE
-        like_q2 = f"%{num_norm_q}%"
-        cur.execute(
-            """
-            SELECT id, content
-            FROM documents
-            WHERE tenant_id = %s AND content ILIKE %s
-            LIMIT 20
-            """,
-            (tenant_id, like_q2),
-        )
-        ilike_numeric_hits = cur.fetchall()
-
-        cur.close()
-        conn.close()
-
-        fused = rr_fusion_many(
-            [trigram_hits, dense_hits, ilike_hits, ilike_numeric_hits], k=40
-        )
-        id_to_text = {
-            rid: text
-            for rid, text in trigram_hits + dense_hits + ilike_hits + ilike_numeric_hits
-        }
-
-        # take top 12 unique
-        top_ids, seen = [], set()
-        for rid, _ in fused:
-            if rid in seen:
-                continue
-            seen.add(rid)
-            top_ids.append(rid)
-            if len(top_ids) == 12:
-                break
-
-        snippets = [{"id": rid, "content": id_to_text[rid]} for rid in top_ids]
+        async def fetch_snippets():
+            nonlocal q_emb, retrieval_stats, degraded
+            if RETRIEVAL_MODE == "parallel":
+                # 1+2) lexical generators run while the query embeds; dense follows the vector
+                emb_task = asyncio.create_task(embed_question(q))
+                try:
+                    snippets, stats = await retrieve_parallel(tenant_id, q, emb_task, profile, top_k)
+                finally:
+                    if not emb_task.done():
+                        emb_task.cancel()
+                if emb_task.done() and not emb_task.cancelled() and emb_task.exception() is None:
+                    q_emb = emb_task.result()
+                retrieval_stats = format_stats(stats)
+                # a generator, the query embedding or the rerank fell short: serve it, don't cache it
+                degraded = any(s["status"] != "ok" for s in stats.values())
+                return snippets
+
+            # 1) embed query
+            q_emb = await embed_question(q)
+            q_vec = to_db_vector(q_emb)
+
+            # 2) retrieve (trigram + dense + full text, RRF-fused, optionally reranked)
+            async with connection() as conn, conn.cursor() as cur:
+                await apply_search_profile(conn, tenant_id, profile)
+                retrieval_stats = RETRIEVAL_MODE
+                return await retrieve(cur, tenant_id, q, q_vec, top_k)
+
+        # a repeat question against an unchanged corpus skips both steps
+        with CHAT_SECONDS.time(phase="retrieve"):
+            snippets = await retrieval_cache.get_or_retrieve(
+                tenant_id, q, (profile, RETRIEVAL_MODE, top_k, RERANKER), fetch_snippets,
+                keep=lambda: not degraded,
+            )
 
         if not snippets:
+            CHAT_REQUESTS.inc(status="no_context")
             async def nohit():
                 yield "I don’t know. No relevant context found.".encode("utf-8")
-            return StreamingResponse(nohit(), media_type="text/plain; charset=utf-8")
+            return StreamingResponse(
+                nohit(), media_type="text/plain; charset=utf-8", headers={"X-Retrieval-Stats": retrieval_stats},
+            )
 
         # 3) build grounded prompt
-        ctx = build_context_snippets(snippets, max_chars=MAX_CONTEXT_CHARS)
+        ctx, packing = pack_context(snippets, MAX_CONTEXT_TOKENS)
+        CHAT_CONTEXT_TOKENS.observe(packing["tokens"])
         system = (
             "You are a helpful assistant. Answer concisely using ONLY the provided context snippets. "
             "If the answer is not in the context, say you don't know. Include no made-up facts."
@@ -151,6 +104,20 @@ async def chat_stream(payload: dict):
             "- Keep the answer to 10-15 sentences unless asked otherwise."
         )
 
+        # 4) a near-duplicate question over the same snippets replays its stored answer
+        fingerprint = None
+        if answer_cache is not None:
+            if q_emb is None:   # retrieval came from the cache (the embedding cache still has it) or dense failed
+                q_emb = await embed_question(q)
+            fingerprint = context_fingerprint(ctx)
+            cached = answer_cache.lookup(tenant_id, fingerprint, q_emb)
+            if cached is not None:
+                CHAT_REQUESTS.inc(status="cached")
+                return StreamingResponse(
+                    replay(cached), media_type="text/plain; charset=utf-8",
+                    headers={"X-Answer-Cache": "hit", "X-Retrieval-Stats": retrieval_stats},
+                )
+
         async def llm_stream():
             stream = await client.chat.completions.create(
                 model=ANSWER_MODEL,
@@ -161,14 +128,31 @@ async def chat_stream(payload: dict):
                     {"role": "user", "content": user},
                 ],
             )
-            async for chunk in stream:
-                delta = chunk.choices[0].delta
-                if delta and delta.content:
-                    yield delta.content
-
-        return StreamingResponse(llm_stream(), media_type="text/plain; charset=utf-8")
+            first = True
+            parts = []
+            try:
+                async for chunk in stream:
+                    delta = chunk.choices[0].delta
+                    if delta and delta.content:
+                        if first:
+                            CHAT_SECONDS.observe(time.perf_counter() - started, phase="ttft")
+                            first = False
+                        parts.append(delta.content)
+                        yield delta.content
+            except BaseException:
+                CHAT_REQUESTS.inc(status="stream_error")
+                raise
+            CHAT_SECONDS.observe(time.perf_counter() - started, phase="stream")
+            CHAT_REQUESTS.inc(status="ok")
+            if fingerprint is not None:
+                answer_cache.store(tenant_id, fingerprint, q, q_emb, "".join(parts))
+
+        return StreamingResponse(
+            llm_stream(), media_type="text/plain; charset=utf-8", headers={"X-Retrieval-Stats": retrieval_stats},
+        )
 
     except HTTPException:
         raise
     except Exception as e:
+        CHAT_REQUESTS.inc(status="error")
         raise HTTPException(status_code=500, detail=f"Chat failed: {e}")
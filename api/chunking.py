@@ -0,0 +1,151 @@
+# api/chunking.py
+# CPU-bound part of ingest (cleaning, section split, micro-chunks, simhash).
+# Runs in worker processes, so it must stay importable without the web app.
+import multiprocessing
+import re
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from config import CHUNK_WORKERS
+from utils import clean_text, simple_chunk_words, normalize_numbers, simhash64_many
+
+Source = Tuple[str, str]           # (source_url, loaded_url)
+
+# ---- tuning knobs (safe defaults)
+MIN_MICRO_BULLET = 30              # min chars to keep a bullet
+MIN_TABLE_ROW   = 20               # min chars to keep a table row
+MIN_PARA        = 60               # min chars for a paragraph chunk
+TOK_WINDOW      = 320              # window size for main paragraphs
+TOK_OVERLAP     = 24               # overlap tokens
+MAX_BULLETS_PER_SECTION   = 12     # cap micro-bullets per section
+MAX_TABLEROWS_PER_SECTION = 20     # cap micro table rows per section
+DEDUPE_HAMMING  = 5                # simhash bits apart to count as near-duplicate
+
+_HEADING_RE    = re.compile(r"^#{1,6}\s")
+_BULLET_RE     = re.compile(r"^\s*([*\-]|•)\s+")
+_TABLE_SEP_RE  = re.compile(r"^\s*\|[-\s|]+\|\s*$")
+_TABLE_EDGE_RE = re.compile(r"^\s*\||\|\s*$")
+_TABLE_CELL_RE = re.compile(r"\s*\|\s*")
+
+def _iter_sections(content: str) -> Iterator[Tuple[str, str]]:
+    """split_markdown_sections for text that is already clean_text()'d."""
+    head, buf, emitted = "", [], False
+    for line in content.splitlines():
+        if _HEADING_RE.match(line):
+            if buf:
+                yield head.strip("# ").strip(), "\n".join(buf).strip()
+                emitted = True
+                buf = []
+            head = line
+        else:
+            buf.append(line)
+    if buf:
+        yield head.strip("# ").strip(), "\n".join(buf).strip()
+    elif not emitted:
+        yield "", content
+
+def _iter_section_chunks(pre: str, body: str) -> Iterator[str]:
+    """
+    Bullets, then table rows, then paragraph windows for one section, from a
+    single scan of its lines. Lines used as micro-chunks are dropped from the
+    paragraph text (by value, like a set filter).
+    """
+    lines = body.splitlines()
+    bullets, rows, drop = [], [], set()
+    want_bullets, want_rows = True, True
+    for ln in lines:
+        if want_bullets:
+            m = _BULLET_RE.match(ln)
+            if m:
+                bullet = ln[m.end():].strip()
+                if len(bullet) >= MIN_MICRO_BULLET:
+                    bullets.append(f"{pre}\n\nBullet: {bullet}".strip())
+                    drop.add(ln)
+                    want_bullets = len(bullets) < MAX_BULLETS_PER_SECTION
+        if want_rows:
+            if _TABLE_SEP_RE.match(ln):
+                drop.add(ln)
+            elif ln.count("|") >= 2:
+                rowtxt = _TABLE_CELL_RE.sub(" | ", _TABLE_EDGE_RE.sub("", ln))
+                if len(rowtxt) >= MIN_TABLE_ROW:
+                    rows.append(f"{pre}\n\nTableRow: {rowtxt}".strip())
+                    drop.add(ln)
+                    want_rows = len(rows) < MAX_TABLEROWS_PER_SECTION
+        elif not want_bullets:
+            break
+    yield from bullets
+    yield from rows
+
+    if drop:
+        body = "\n".join([ln for ln in lines if ln not in drop]).strip()
+    para = f"{pre}\n\n{body}".strip()
+    if len(para) >= MIN_PARA:
+        for ch in simple_chunk_words(para, max_tokens=TOK_WINDOW, overlap=TOK_OVERLAP):
+            if len(ch) >= MIN_PARA:
+                yield ch
+
+def _iter_kizen_chunks_from_df(df: pd.DataFrame) -> Tuple[List[str], List[Optional[Source]]]:
+    """
+    Cleaned, section-aware chunks from a dataframe batch, plus the
+    (source_url, loaded_url) of the row each chunk came from.
+    """
+    is_str = lambda v: isinstance(v, str) and v.strip() != ""
+    out: List[str] = []
+    sources: List[Optional[Source]] = []
+
+    for row in df.to_dict("records"):
+        title = row.get("metadata/title") if is_str(row.get("metadata/title")) else ""
+        url = (row.get("url") if is_str(row.get("url")) else "") or \
+              (row.get("crawl/loadedUrl") if is_str(row.get("crawl/loadedUrl")) else "")
+        md  = row.get("markdown") if is_str(row.get("markdown")) else ""
+        txt = row.get("text") if is_str(row.get("text")) else ""
+        content = clean_text(md if md else txt)
+        if not content:
+            continue
+
+        loaded = row.get("crawl/loadedUrl") if is_str(row.get("crawl/loadedUrl")) else ""
+        source = (url, loaded or url) if url else None
+
+        doc_pre = []
+        if title: doc_pre.append(f"Title: {title}")
+        if url:   doc_pre.append(f"URL: {url}")
+        n = len(out)
+        for head, body in _iter_sections(content):
+            pre = "\n".join(doc_pre + [f"Section: {head}"] if head else doc_pre)
+            out.extend(_iter_section_chunks(pre, normalize_numbers(body)))
+        sources.extend([source] * (len(out) - n))
+    return out, sources
+
+def chunk_kizen_batch(df: pd.DataFrame) -> Tuple[List[str], np.ndarray, List[Optional[Source]]]:
+    """Chunks, their simhashes and sources; dedupe against the ingest-wide index happens in the parent."""
+    chunks, sources = _iter_kizen_chunks_from_df(df)
+    return chunks, simhash64_many(chunks), sources
+
+def chunk_kizen_batch_timed(df: pd.DataFrame):
+    """chunk_kizen_batch plus the seconds it took in the worker (ingest stage timings)."""
+    t0 = time.perf_counter()
+    out = chunk_kizen_batch(df)
+    return out, time.perf_counter() - t0
+
+_pool: Optional[Executor] = None
+
+def get_chunk_pool() -> Executor:
+    """Process pool for chunking (CHUNK_WORKERS=0 falls back to one thread)."""
+    global _pool
+    if _pool is None:
+        if CHUNK_WORKERS > 0:
+            # spawn: the API process has threads (pool workers, OpenAI client) that fork doesn't copy safely
+            _pool = ProcessPoolExecutor(CHUNK_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        else:
+            _pool = ThreadPoolExecutor(1, thread_name_prefix="chunk")
+    return _pool
+
+def shutdown_chunk_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True, cancel_futures=True)
+        _pool = None
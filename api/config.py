@@ -10,18 +10,96 @@ POSTGRES_PASSWORD = os.environ["POSTGRES_PASSWORD"]
 AWS_REGION = os.environ.get("AWS_REGION", "us-east-1")
 SENTRY_API_DSN = os.environ.get("SENTRY_API_DSN")
 
+# Metrics (GET /metrics is always on; CloudWatch is an optional batched sink)
+CLOUDWATCH_METRICS = os.environ.get("CLOUDWATCH_METRICS", "true").lower() in ("1", "true", "yes")
+CLOUDWATCH_FLUSH_S = float(os.environ.get("CLOUDWATCH_FLUSH_S", "60"))   # seconds between PutMetricData batches
+
 # Embeddings
 EMBED_MODEL = os.environ.get("EMBED_MODEL", "text-embedding-3-small")
 MAX_TOKENS_PER_ITEM = int(os.environ.get("MAX_TOKENS_PER_ITEM", "8000"))      # cap each row
 MAX_TOKENS_PER_BATCH = int(os.environ.get("MAX_TOKENS_PER_BATCH", "240000"))  # < 300k safety
 MAX_ITEMS_PER_BATCH = int(os.environ.get("MAX_ITEMS_PER_BATCH", "128"))
-MAX_CONTEXT_CHARS = int(os.environ.get("MAX_CONTEXT_CHARS", "25000"))  # for retrieval
 EMBED_DIM = int(os.environ.get("EMBED_DIM", "1536"))
 BATCH_SIZE_HARD_LIMIT  = int(os.environ.get("BATCH_SIZE_HARD_LIMIT ", "200"))
+EMBED_TARGET_LATENCY = float(os.environ.get("EMBED_TARGET_LATENCY", "2.0"))  # seconds per request; batches shrink above it
+EMBED_MAX_ATTEMPTS = int(os.environ.get("EMBED_MAX_ATTEMPTS", "5"))          # per request, on 429/5xx/timeouts
 
 # Answering
 ANSWER_MODEL = os.environ.get("ANSWER_MODEL", "gpt-4o-mini")
 ANSWER_TEMPERATURE = float(os.environ.get("ANSWER_TEMPERATURE", "0.5"))
+MAX_CONTEXT_TOKENS = int(os.environ.get("MAX_CONTEXT_TOKENS", "6000"))  # retrieved context packed into the prompt
 
 # Concurrency
 EMBED_CONCURRENCY = int(os.environ.get("EMBED_CONCURRENCY", "3"))
+PANDAS_CHUNKSIZE = int(os.environ.get("PANDAS_CHUNKSIZE", "400"))   # CSV rows per pandas chunk
+EMBED_BATCH = int(os.environ.get("EMBED_BATCH", "128"))             # max texts per embedding request (also capped by tokens; adapts down)
+CHUNK_WORKERS = int(os.environ.get("CHUNK_WORKERS", str(max((os.cpu_count() or 2) - 1, 1))))  # chunking processes; 0 = thread
+
+# Ingest loading
+INGEST_LOAD_MODE = os.environ.get("INGEST_LOAD_MODE", "copy")            # copy | insert
+INGEST_NOTIFY_ROWS = int(os.environ.get("INGEST_NOTIFY_ROWS", "5000"))   # rows between corpus-change notifications (each write commits)
+INGEST_STAGING = os.environ.get("INGEST_STAGING", "false").lower() in ("1", "true", "yes")  # one merge into documents at the end instead of one per write
+INGEST_DEDUP_POLICY = os.environ.get("INGEST_DEDUP_POLICY", "skip")   # skip | upsert chunks already stored (by content hash)
+TOMBSTONE_GRACE_S = float(os.environ.get("TOMBSTONE_GRACE_S", "3600"))   # keep tombstoned chunks this long before purging
+VACUUM_INTERVAL_S = float(os.environ.get("VACUUM_INTERVAL_S", "600"))     # background tombstone purge; 0 = off
+
+# Database pool
+DB_POOL_MIN_SIZE = int(os.environ.get("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.environ.get("DB_POOL_MAX_SIZE", "20"))      # parallel retrieval holds up to 4 per chat
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "30"))       # seconds to wait for a free conn
+DB_POOL_MAX_IDLE = float(os.environ.get("DB_POOL_MAX_IDLE", "300"))    # close idle conns above min_size
+VECTOR_TRANSPORT = os.environ.get("VECTOR_TRANSPORT", "binary")  # binary (float32 wire format) | text (literal fallback)
+
+# ANN index (`python indexes.py status|build`; tenant partitions: `python partitions.py migrate`)
+ANN_INDEX_METHOD = os.environ.get("ANN_INDEX_METHOD", "hnsw")   # hnsw | ivfflat for new indexes and tenant partitions
+ANN_PROFILE = os.environ.get("ANN_PROFILE", "balanced")          # fast | balanced | accurate (ef_search / probes)
+HNSW_M = int(os.environ.get("HNSW_M", "16"))
+HNSW_EF_CONSTRUCTION = int(os.environ.get("HNSW_EF_CONSTRUCTION", "64"))
+ANN_REBUILD_MIN_ROWS = int(os.environ.get("ANN_REBUILD_MIN_ROWS", "10000"))  # below this an exact scan is fine
+ANN_REBUILD_DRIFT = float(os.environ.get("ANN_REBUILD_DRIFT", "2.0"))        # rebuild ivfflat when lists are off by this factor
+
+# Retrieval
+RETRIEVAL_MODE = os.environ.get("RETRIEVAL_MODE", "parallel")  # parallel (overlaps the query embedding) | fused (one statement) | multi
+RETRIEVAL_GENERATOR_TIMEOUT_S = float(os.environ.get("RETRIEVAL_GENERATOR_TIMEOUT_S", "2.0"))  # parallel: fuse without a generator slower than this
+TRIGRAM_WORD_THRESHOLD = float(os.environ.get("TRIGRAM_WORD_THRESHOLD", "0.3"))  # pg_trgm word_similarity cutoff for `q <% content`
+RETRIEVAL_ILIKE = os.environ.get("RETRIEVAL_ILIKE", "false").lower() in ("1", "true", "yes")  # also run the old substring ILIKE scans
+TRIGRAM_LIMIT = int(os.environ.get("TRIGRAM_LIMIT", "15"))   # candidates per generator
+DENSE_LIMIT = int(os.environ.get("DENSE_LIMIT", "15"))       # also the hnsw.ef_search floor
+FTS_LIMIT = int(os.environ.get("FTS_LIMIT", "20"))
+ILIKE_LIMIT = int(os.environ.get("ILIKE_LIMIT", "20"))
+RRF_K = int(os.environ.get("RRF_K", "40"))                   # reciprocal-rank constant
+TOP_K = int(os.environ.get("TOP_K", "12"))                   # snippets handed to the prompt builder (RERANK_TOP_K when reranking)
+
+# Reranking (optional, between fusion and context packing; see rerank.py)
+RERANKER = os.environ.get("RERANKER", "")                               # empty = off | cosine | onnx
+RERANK_POOL = int(os.environ.get("RERANK_POOL", "50"))                  # fused candidates the reranker scores
+RERANK_TOP_K = int(os.environ.get("RERANK_TOP_K", "8"))                 # snippets kept after reranking
+RERANK_BUDGET_MS = float(os.environ.get("RERANK_BUDGET_MS", "150"))     # content scorers: batches still running are skipped
+RERANK_FUSED_WEIGHT = float(os.environ.get("RERANK_FUSED_WEIGHT", "0.5"))  # share of the fused (RRF) score in the final one
+RERANK_THREADS = int(os.environ.get("RERANK_THREADS", "2"))
+RERANK_BATCH = int(os.environ.get("RERANK_BATCH", "16"))                # (question, chunk) pairs per model call
+RERANK_ONNX_MODEL = os.environ.get("RERANK_ONNX_MODEL", "")             # cross-encoder .onnx for RERANKER=onnx
+RERANK_ONNX_TOKENIZER = os.environ.get("RERANK_ONNX_TOKENIZER", "")     # its tokenizer.json
+RERANK_MAX_LENGTH = int(os.environ.get("RERANK_MAX_LENGTH", "256"))     # tokens per pair
+
+# Query-embedding cache
+EMBED_CACHE_MAX_BYTES = int(os.environ.get("EMBED_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+EMBED_CACHE_TTL = float(os.environ.get("EMBED_CACHE_TTL", "86400"))   # seconds
+EMBED_CACHE_PATH = os.environ.get("EMBED_CACHE_PATH", "")             # SQLite file shared across workers; empty = off
+
+# Retrieval result cache (per worker; ingests invalidate it via LISTEN/NOTIFY)
+RETRIEVAL_CACHE_MAX_ENTRIES = int(os.environ.get("RETRIEVAL_CACHE_MAX_ENTRIES", "2048"))  # 0 = off
+RETRIEVAL_CACHE_TTL = float(os.environ.get("RETRIEVAL_CACHE_TTL", "300"))   # seconds fresh within a corpus generation
+RETRIEVAL_CACHE_SWR = float(os.environ.get("RETRIEVAL_CACHE_SWR", "0"))     # extra seconds served stale while refreshing
+
+# Semantic answer cache (opt-in; replays a stored answer for a near-duplicate question over the same snippets)
+ANSWER_CACHE_ENABLED = os.environ.get("ANSWER_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+ANSWER_CACHE_THRESHOLD = float(os.environ.get("ANSWER_CACHE_THRESHOLD", "0.95"))  # min cosine to a cached question
+ANSWER_CACHE_MAX_ENTRIES = int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", "4096"))
+ANSWER_CACHE_TTL = float(os.environ.get("ANSWER_CACHE_TTL", "3600"))             # seconds
+
+# csv_url fetch
+FETCH_CONNECT_TIMEOUT = float(os.environ.get("FETCH_CONNECT_TIMEOUT", "10"))
+FETCH_READ_TIMEOUT = float(os.environ.get("FETCH_READ_TIMEOUT", "60"))     # per read, not whole download
+FETCH_MAX_CONNECTIONS = int(os.environ.get("FETCH_MAX_CONNECTIONS", "20"))
+FETCH_RESUME_ATTEMPTS = int(os.environ.get("FETCH_RESUME_ATTEMPTS", "3"))  # Range retries after a dropped download
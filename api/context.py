@@ -0,0 +1,227 @@
+"""
+Context assembly: retrieved snippets -> the numbered context block of the prompt.
+
+Kizen chunks repeat their page's `Title:/URL:/Section:` preamble, and the
+paragraph windows of simple_chunk_words overlap their neighbours by
+TOK_OVERLAP words. The packer parses the preamble off, merges windows of
+the same source that overlap (or contain one another), prints each
+source's title/URL and each section once, and then picks the set of
+pieces with the highest total retrieval score that fits the token budget
+(a 0/1 knapsack where a source's header is paid once, for its first
+piece), instead of stopping at the first snippet that doesn't fit.
+"""
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from utils import count_tokens, safe_truncate
+
+MIN_MERGE_OVERLAP = 8     # words a window's tail must share with the next window's head to be stitched
+_CITE_TOKENS = 3          # "[12] "
+
+_MICRO_RE = re.compile(
+    r"^(?:(?:Title: (?P<title>[^\n]*)\n)?(?:URL: (?P<url>[^\n]*)\n)?(?:Section: (?P<section>[^\n]*)\n)?\n)?"
+    r"(?P<body>(?:Bullet|TableRow): .*)\Z",
+    re.S,
+)
+# paragraph windows are whitespace-joined, so the preamble is flattened onto one line
+_WINDOW_RE = re.compile(r"^(?:Title: (?P<title>.*?) )?URL: (?P<url>\S+)(?: (?P<body>.*))?\Z", re.S)
+
+
+@dataclass
+class _Piece:
+    source: str
+    title: str
+    section: str
+    text: str
+    value: float
+    rank: int
+    window: bool                       # a paragraph window (mergeable) rather than a bullet / table row
+    words: List[str] = field(default_factory=list)
+
+
+def _parse(snip, rank: int) -> Optional[_Piece]:
+    text = (snip.get("content") if isinstance(snip, dict) else str(snip)) or ""
+    text = text.strip()
+    if not text:
+        return None
+    score = snip.get("score") if isinstance(snip, dict) else None
+    value = float(score) if score is not None else 1.0 / (rank + 1)
+    source = (snip.get("source_url") if isinstance(snip, dict) else None) or ""
+    title, section, window = "", "", False
+
+    m = _MICRO_RE.match(text)
+    if m is not None:
+        title, section, text = m["title"] or "", m["section"] or "", m["body"]
+        source = source or m["url"] or ""
+    else:
+        window = True
+        m = _WINDOW_RE.match(text)
+        if m is not None and (not source or m["url"] == source):
+            title, source, text = m["title"] or "", m["url"], m["body"] or ""
+    if not text.strip():
+        return None
+    return _Piece(source, title, section, text.strip(), value, rank, window, text.split())
+
+
+def _peel_sections(pieces: List[_Piece]):
+    """A source's first window starts with its flattened "Section: <heading>"; peel it off when a
+    bullet or table row of the same source names that heading."""
+    known: Dict[str, List[str]] = {}
+    for p in pieces:
+        if not p.window and p.section:
+            known.setdefault(p.source, []).append(p.section)
+    for p in pieces:
+        if p.window and not p.section and p.text.startswith("Section: "):
+            for section in sorted(known.get(p.source, ()), key=len, reverse=True):
+                head = f"Section: {section} "
+                if p.text.startswith(head):
+                    p.section, p.text = section, p.text[len(head):]
+                    p.words = p.text.split()
+                    break
+
+
+def _stitch(a: List[str], b: List[str]) -> Optional[List[str]]:
+    """a + b without the words a's tail shares with b's head, if they share at least MIN_MERGE_OVERLAP."""
+    for k in range(min(len(a), len(b)), MIN_MERGE_OVERLAP - 1, -1):
+        if a[-k:] == b[:k]:
+            return a + b[k:]
+    return None
+
+
+def _merge(pieces: List[_Piece]) -> List[_Piece]:
+    """Drop exact duplicates and contained windows; stitch overlapping windows of one source."""
+    out: List[_Piece] = []
+    for p in pieces:
+        for q in out:
+            if q.source != p.source:
+                continue
+            if p.text == q.text or (p.window and q.window and p.text in q.text):
+                q.value += p.value
+                q.rank = min(q.rank, p.rank)
+                break
+            if p.window and q.window:
+                if q.text in p.text:
+                    merged = p.words
+                else:
+                    merged = _stitch(q.words, p.words) or _stitch(p.words, q.words)
+                if merged is not None:
+                    q.words, q.text = merged, " ".join(merged)
+                    q.value += p.value
+                    q.rank = min(q.rank, p.rank)
+                    q.title, q.section = q.title or p.title, q.section or p.section
+                    break
+        else:
+            out.append(p)
+    if len(out) < len(pieces):
+        return _merge(out)   # a stitch can make two earlier pieces overlap
+    return out
+
+
+def _header(source: str, title: str) -> List[str]:
+    lines = []
+    if title:
+        lines.append(f"Title: {title}")
+    if source:
+        lines.append(f"URL: {source}")
+    return lines
+
+
+def _render(pieces: List[_Piece]) -> str:
+    """Pieces grouped by source (best-ranked first), one header per source and per section, numbered [1], [2], ..."""
+    groups: Dict[str, List[_Piece]] = {}
+    for p in sorted(pieces, key=lambda p: p.rank):
+        groups.setdefault(p.source or f"\x00{p.rank}", []).append(p)
+    blocks, n = [], 0
+    for members in groups.values():
+        title = next((p.title for p in members if p.title), "")
+        lines = _header(members[0].source, title)
+        sections: Dict[str, List[_Piece]] = {"": []}   # pieces without a section go right under the header
+        for p in members:
+            sections.setdefault(p.section, []).append(p)
+        for section, ps in sections.items():
+            if section:
+                lines.append(f"Section: {section}")
+            for p in ps:
+                n += 1
+                lines.append(f"[{n}] {p.text}")
+        blocks.append("\n".join(lines))
+    return "\n\n".join(blocks) + "\n" if blocks else ""
+
+
+def _knapsack(pieces: List[_Piece], budget: int) -> List[_Piece]:
+    """
+    Highest total value within `budget` tokens. Pieces of one source form a
+    group whose header tokens are paid once if any of them is taken.
+    """
+    groups: Dict[str, List[int]] = {}
+    for i, p in enumerate(pieces):
+        groups.setdefault(p.source or f"\x00{i}", []).append(i)
+    costs = [count_tokens(p.text) + _CITE_TOKENS + (count_tokens(f"Section: {p.section}") if p.section else 0)
+             for p in pieces]
+
+    neg = -np.inf
+    best = np.zeros(budget + 1)
+    trace = []   # per group: (opened mask, [(piece index, taken mask)])
+    for members in groups.values():
+        head = count_tokens("\n".join(_header(pieces[members[0]].source, pieces[members[0]].title))) + 2
+        opened = np.full(budget + 1, neg)
+        if head <= budget:
+            opened[head:] = best[:budget + 1 - head]
+        steps = []
+        for i in members:
+            c, v = costs[i], pieces[i].value
+            taken = np.zeros(budget + 1, dtype=bool)
+            if c <= budget:
+                cand = np.full(budget + 1, neg)
+                cand[c:] = opened[:budget + 1 - c] + v
+                taken = cand > opened
+                opened = np.where(taken, cand, opened)
+            steps.append((i, taken))
+        use = opened > best
+        trace.append((use, head, steps))
+        best = np.where(use, opened, best)
+
+    chosen, c = [], int(np.argmax(best))
+    for use, head, steps in reversed(trace):
+        if not use[c]:
+            continue
+        for i, taken in reversed(steps):
+            if taken[c]:
+                chosen.append(pieces[i])
+                c -= costs[i]
+        c -= head
+    return chosen
+
+
+def pack_context(snippets: List[Dict], max_tokens: int) -> Tuple[str, dict]:
+    """Context block for the prompt, at most `max_tokens` tokens, plus packing stats."""
+    parsed = [p for p in (_parse(s, r) for r, s in enumerate(snippets)) if p is not None]
+    _peel_sections(parsed)
+    pieces = _merge(parsed)
+    chosen = _knapsack(pieces, max_tokens) if pieces else []
+
+    # the knapsack charges every piece its section line; spend what that over-reserved
+    for p in sorted((p for p in pieces if p not in chosen), key=lambda p: p.value, reverse=True):
+        if count_tokens(_render(chosen + [p])) <= max_tokens:
+            chosen.append(p)
+
+    # token counts aren't exactly additive across the joins; trim if the render came out over
+    ctx = _render(chosen)
+    while chosen and count_tokens(ctx) > max_tokens:
+        chosen.remove(min(chosen, key=lambda p: p.value / max(len(p.words), 1)))
+        ctx = _render(chosen)
+    if not chosen and pieces:
+        # not even the best piece fits: send a truncated one rather than nothing
+        top = min(pieces, key=lambda p: p.rank)
+        ctx = safe_truncate(_render([top]), max_tokens)
+
+    tokens = count_tokens(ctx)
+    return ctx, {
+        "snippets": len(snippets),
+        "pieces": len(pieces),
+        "packed": len(chosen) or (1 if ctx else 0),
+        "tokens": tokens,
+    }
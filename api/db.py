@@ -1,6 +1,21 @@
-import psycopg2
-from psycopg2.extras import execute_values
-from config import POSTGRES_HOST, POSTGRES_PORT, POSTGRES_DB, POSTGRES_USER, POSTGRES_PASSWORD
+import asyncio
+import time
+import uuid
+from typing import Optional
+
+import numpy as np
+from pgvector.psycopg import register_vector_async
+from psycopg.conninfo import make_conninfo
+from psycopg_pool import AsyncConnectionPool
+
+from config import (
+    POSTGRES_HOST, POSTGRES_PORT, POSTGRES_DB, POSTGRES_USER, POSTGRES_PASSWORD,
+    DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_POOL_TIMEOUT, DB_POOL_MAX_IDLE,
+    VECTOR_TRANSPORT, TRIGRAM_WORD_THRESHOLD,
+    INGEST_LOAD_MODE, INGEST_NOTIFY_ROWS, INGEST_STAGING, INGEST_DEDUP_POLICY,
+    TOMBSTONE_GRACE_S, VACUUM_INTERVAL_S,
+)
+from partitions import ensure_tenant_partition
 
 DB_CONN = {
     "host": POSTGRES_HOST,
@@ -10,42 +25,526 @@ DB_CONN = {
     "password": POSTGRES_PASSWORD
 }
 
+# One pool per worker process; opened/closed by the app lifespan in main.py.
+# Connections are recycled after DB_POOL_MAX_IDLE seconds idle (above min_size)
+# and after psycopg_pool's default max_lifetime (an hour); ones a restarted
+# Postgres broke are discarded when they come back to the pool.
+pool: Optional[AsyncConnectionPool] = None
+
+# session settings every retrieval connection needs: the trigram generator's
+# `q <% content` is only indexable as an operator, which reads its cutoff from a GUC
+SESSION_OPTIONS = f"-c pg_trgm.word_similarity_threshold={TRIGRAM_WORD_THRESHOLD}"
+
+async def _configure(conn):
+    # teach the connection pgvector's binary format for float32 ndarrays
+    await register_vector_async(conn)
+    await conn.commit()
+
+async def open_pool():
+    global pool
+    if pool is not None and not pool.closed:
+        return
+    pool = AsyncConnectionPool(
+        make_conninfo(**DB_CONN, options=SESSION_OPTIONS),
+        min_size=DB_POOL_MIN_SIZE,
+        max_size=max(DB_POOL_MAX_SIZE, DB_POOL_MIN_SIZE),
+        timeout=DB_POOL_TIMEOUT,
+        max_idle=DB_POOL_MAX_IDLE,
+        # no per-checkout ping (a round trip on every retrieval statement): broken
+        # connections are dropped when returned, idle/old ones recycled by max_idle
+        # and max_lifetime, and /health/db reports connectivity
+        configure=_configure if VECTOR_TRANSPORT == "binary" else None,
+        name="documents",
+        open=False,
+    )
+    # don't block startup on the DB; connections are filled in the background
+    await pool.open(wait=False)
+
+async def close_pool():
+    if pool is not None:
+        await pool.close()
+
+def connection():
+    """`async with connection() as conn:` — commits on success, rolls back on error."""
+    if pool is None:
+        raise RuntimeError("DB pool is not open")
+    return pool.connection()
+
+def pool_stats() -> dict:
+    """Current pool size/usage; `saturation` is the fraction of max_size checked out."""
+    if pool is None:
+        return {}
+    s = pool.get_stats()
+    size = s.get("pool_size", 0)
+    available = s.get("pool_available", 0)
+    return {
+        "min_size": pool.min_size,
+        "max_size": pool.max_size,
+        "size": size,
+        "available": available,
+        "in_use": size - available,
+        "waiting": s.get("requests_waiting", 0),
+        "saturation": round((size - available) / pool.max_size, 3) if pool.max_size else 0.0,
+        "errors": s.get("connections_errors", 0),
+        "timeouts": s.get("requests_errors", 0),
+    }
+
+async def check_health(timeout: float = 2.0) -> dict:
+    """Round-trip a trivial query through the pool."""
+    try:
+        async with asyncio.timeout(timeout):
+            async with connection() as conn:
+                await conn.execute("SELECT 1")
+        ok, detail = True, None
+    except Exception as e:
+        ok, detail = False, str(e) or e.__class__.__name__
+    return {"ok": ok, "detail": detail, "pool": pool_stats()}
+
 def _vec_literal(v):
     # pgvector format: [0.12,0.34,...]
     return "[" + ",".join(f"{x:.6f}" for x in v) + "]"
 
-def insert_documents(tenant_id, texts, embeddings):
-    rows = [(tenant_id, t, _vec_literal(e)) for t, e in zip(texts, embeddings)]
-    conn = psycopg2.connect(**DB_CONN)
-    cur = conn.cursor()
-    # cast the 3rd placeholder to vector
-    execute_values(
-        cur,
-        "INSERT INTO documents (tenant_id, content, embedding) VALUES %s",
-        rows,
-        template="(%s, %s, %s::vector)"
-    )
-    conn.commit()
-    cur.close()
-    conn.close()
+def to_db_vector(v):
+    """
+    Embedding as a query parameter for `%s::vector`.
+    binary: float32 ndarray, sent in pgvector's binary format (4 bytes/dim).
+    text:   "[0.123456,...]" literal that Postgres re-parses (~10 bytes/dim).
+    """
+    if VECTOR_TRANSPORT == "binary":
+        return np.asarray(v, dtype=np.float32)
+    return _vec_literal(v)
+
+def to_db_vectors(vs) -> list:
+    if VECTOR_TRANSPORT == "binary":
+        # one float32 matrix for the batch instead of a conversion per row
+        return list(np.asarray(vs, dtype=np.float32))
+    return [_vec_literal(v) for v in vs]
 
-# api/db.py (add at bottom)
-from psycopg2.extras import execute_values
+# ---- corpus generations
+# Every commit that changes a tenant's documents bumps the tenant's
+# generation, here and (via NOTIFY, delivered with the commit) in every other
+# worker, so result caches can key on it. Generations only mean something
+# while the listener is connected; a reconnect starts a new epoch, since
+# notifications may have been missed in between.
+CORPUS_CHANNEL = "corpus_changed"
+_generations: dict = {}
+_epoch = 0
+_listening = False
 
+def corpus_generation(tenant_id: str) -> Optional[tuple]:
+    """(epoch, generation) for the tenant, or None while changes from other workers can't be seen."""
+    if not _listening:
+        return None
+    return _epoch, _generations.get(tenant_id, 0)
 
-def insert_documents_on_conn(conn, tenant_id, texts, embeddings):
+def bump_generation(tenant_id: str):
+    _generations[tenant_id] = _generations.get(tenant_id, 0) + 1
+
+async def commit_corpus_change(conn, tenant_id: str):
+    """Commit a change to the tenant's documents and tell every worker about it."""
+    await conn.execute("SELECT pg_notify(%s, %s)", (CORPUS_CHANNEL, tenant_id))
+    await conn.commit()
+    bump_generation(tenant_id)   # no window for this worker; the NOTIFY covers the others
+
+async def corpus_listener_loop():
+    """LISTEN for corpus changes from all workers; started by the app lifespan."""
+    global _epoch, _listening
+    from psycopg import AsyncConnection
+
+    backoff = 1.0
+    while True:
+        try:
+            async with await AsyncConnection.connect(make_conninfo(**DB_CONN), autocommit=True) as conn:
+                await conn.execute(f"LISTEN {CORPUS_CHANNEL}")
+                _epoch += 1
+                _generations.clear()
+                _listening = True
+                backoff = 1.0
+                async for n in conn.notifies():
+                    bump_generation(n.payload)
+        except Exception as e:
+            print(f"[WARN] corpus listener: {e}; reconnecting in {backoff:.0f}s")
+        finally:
+            _listening = False
+        await asyncio.sleep(backoff)
+        backoff = min(backoff * 2, 30.0)
+
+_DOC_COLUMNS = "tenant_id, content, embedding, content_hash, source_url, loaded_url, doc_version"
+
+# new rows only; a chunk already stored for the tenant (same content_hash) is left alone
+_ON_HASH_CONFLICT = "ON CONFLICT (tenant_id, content_hash) WHERE content_hash IS NOT NULL DO NOTHING"
+
+async def known_content_hashes(conn, tenant_id, hashes) -> set:
+    """Subset of `hashes` already stored for the tenant (one indexed lookup)."""
+    if not hashes:
+        return set()
+    async with conn.cursor() as cur:
+        await cur.execute(
+            "SELECT content_hash FROM documents WHERE tenant_id = %s AND content_hash = ANY(%s)",
+            (tenant_id, list(hashes)),
+        )
+        return {bytes(h) for h, in await cur.fetchall()}
+
+async def insert_documents(tenant_id, texts, embeddings, hashes=None):
+    async with connection() as conn:
+        await ensure_tenant_partition(conn, tenant_id)
+        await insert_documents_on_conn(conn, tenant_id, texts, embeddings, hashes)
+
+
+async def insert_documents_on_conn(conn, tenant_id, texts, embeddings, hashes=None):
     if not texts:
         return
-    rows = [(tenant_id,
-             t,
-             "[" + ",".join(f"{x:.6f}" for x in e) + "]") for t, e in zip(texts, embeddings)]
-    with conn.cursor() as cur:
-        execute_values(
-            cur,
-            "INSERT INTO documents (tenant_id, content, embedding) VALUES %s",
+    hashes = hashes or [None] * len(texts)
+    rows = [(tenant_id, t, e, h) for t, e, h in zip(texts, to_db_vectors(embeddings), hashes)]
+    async with conn.cursor() as cur:
+        # psycopg3 pipelines executemany, so this is one round trip per batch
+        await cur.executemany(
+            "INSERT INTO documents (tenant_id, content, embedding, content_hash) "
+            f"VALUES (%s, %s, %s::vector, %s) {_ON_HASH_CONFLICT}",
             rows,
-            template="(%s, %s, %s::vector)",
-            page_size=1000,
         )
-    conn.commit()
+    await commit_corpus_change(conn, tenant_id)
+
+
+class DocumentLoader:
+    """
+    Bulk writer for one ingest, on one pooled connection.
+
+    mode="copy" streams rows with COPY (binary format when vectors go over the
+    wire as float32, text otherwise) into a temp table and merges them into
+    documents after each write, so rows whose content_hash is already stored
+    are skipped instead of failing the COPY; mode="insert" uses executemany.
+    Every call commits before it returns, so the connection never sits idle
+    in a transaction while the workers wait on the embeddings API (no pinned
+    snapshot, no uncommitted unique keys blocking other ingests, nothing for
+    CREATE INDEX CONCURRENTLY to wait on); other workers are told about the
+    change (commit_corpus_change) every `notify_rows`. Writes into documents
+    are therefore committed one batch at a time; only with `staging` do rows
+    stay in the temp (so unlogged) table for finish() to merge in one
+    statement and commit once.
+
+    known_hashes() is the bulk lookup behind the dedupe `policy`: "skip"
+    leaves chunks that are already stored untouched, "upsert" rewrites their
+    content via touch() and keeps the stored vector.
+
+    Each loader takes a new doc_version. see() records every chunk the
+    ingest produced for a source URL, and finish() reconciles: stored chunks
+    of those pages that weren't produced again are tombstoned (with
+    `full_crawl`, those of every page not in this ingest too), tombstoned
+    chunks that reappeared are revived. Pages with chunks that failed to
+    embed (incomplete()) are left alone. From open() to close() the loader
+    holds the tenant's ingest lock (shared), which purge_tombstones() won't
+    purge under: a tombstoned chunk counted as known isn't re-embedded, and
+    only finish() brings it back.
+
+        async with DocumentLoader(tenant_id) as loader:
+            known = await loader.known_hashes(hashes)
+            await loader.see(hashes, sources)
+            await loader.write(texts, vectors, hashes, sources)   # safe to call from several workers
+            await loader.finish()
+    """
+
+    def __init__(
+        self,
+        tenant_id: str,
+        mode: str = INGEST_LOAD_MODE,
+        notify_rows: int = INGEST_NOTIFY_ROWS,
+        staging: bool = INGEST_STAGING,
+        policy: str = INGEST_DEDUP_POLICY,
+        full_crawl: bool = False,
+    ):
+        self.tenant_id = tenant_id
+        self.mode = mode
+        self.notify_rows = max(notify_rows, 1)
+        self.staging = staging
+        self.policy = policy
+        self.full_crawl = full_crawl
+        suffix = uuid.uuid4().hex[:12]
+        use_temp = staging or mode == "copy"
+        self.table = f"documents_stage_{suffix}" if use_temp else "documents"
+        self.seen_table = f"documents_seen_{suffix}"
+        self.version: Optional[int] = None
+        self.partition_created: Optional[str] = None
+        self.rows_written = 0
+        self.rows_reused = 0
+        self.tombstoned = 0
+        self.revived = 0
+        self._seen = 0
+        self._incomplete: set = set()
+        self._unnotified = 0
+        self._lock = asyncio.Lock()
+        self._cm = None
+        self._conn = None
+        self._t0 = 0.0
+
+    async def open(self):
+        self._cm = connection()
+        self._conn = await self._cm.__aenter__()
+        self.partition_created = await ensure_tenant_partition(self._conn, self.tenant_id)
+        # session-level: held across the per-call commits until close()
+        await self._conn.execute(
+            "SELECT pg_advisory_lock_shared(hashtext('documents_ingest'), hashtext(%s))", (self.tenant_id,)
+        )
+        async with self._conn.cursor() as cur:
+            await cur.execute("SELECT nextval('documents_version_seq')")
+            self.version = (await cur.fetchone())[0]
+        if self.table != "documents":
+            await self._conn.execute(
+                f"CREATE TEMP TABLE {self.table} "
+                "(tenant_id TEXT NOT NULL, content TEXT NOT NULL, embedding vector, content_hash BYTEA, "
+                "source_url TEXT, loaded_url TEXT, doc_version BIGINT)"
+            )
+        await self._conn.execute(
+            f"CREATE TEMP TABLE {self.seen_table} "
+            "(content_hash BYTEA NOT NULL, source_url TEXT NOT NULL, loaded_url TEXT)"
+        )
+        await self._conn.commit()
+        self._t0 = time.perf_counter()
+        return self
+
+    async def close(self, exc: Optional[BaseException] = None):
+        """
+        Drop the loader's temp tables and release the ingest lock and the
+        connection. Rows already written stay (every write committed); with
+        `staging`, rows finish() never merged go with the temp table.
+        """
+        if self._cm is None:
+            return
+        try:
+            if self.version is not None:
+                await self._conn.rollback()
+                await self._conn.execute(f"DROP TABLE IF EXISTS {self.seen_table}")
+                if self.table != "documents":
+                    await self._conn.execute(f"DROP TABLE IF EXISTS {self.table}")
+            await self._conn.execute(
+                "SELECT pg_advisory_unlock_shared(hashtext('documents_ingest'), hashtext(%s))", (self.tenant_id,)
+            )
+        finally:
+            cm, self._cm, self._conn = self._cm, None, None
+            await cm.__aexit__(type(exc) if exc else None, exc, None)
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close(exc)
+
+    @property
+    def rows_per_s(self) -> float:
+        elapsed = time.perf_counter() - self._t0
+        return round(self.rows_written / elapsed, 1) if elapsed > 0 else 0.0
+
+    async def _copy(self, rows):
+        binary = VECTOR_TRANSPORT == "binary"
+        stmt = f"COPY {self.table} ({_DOC_COLUMNS}) FROM STDIN"
+        async with self._conn.cursor() as cur:
+            async with cur.copy(stmt + (" (FORMAT BINARY)" if binary else "")) as copy:
+                if binary:
+                    copy.set_types(["text", "text", "vector", "bytea", "text", "text", "int8"])
+                for row in rows:
+                    await copy.write_row(row)
+
+    async def _insert(self, rows):
+        conflict = _ON_HASH_CONFLICT if self.table == "documents" else ""
+        async with self._conn.cursor() as cur:
+            await cur.executemany(
+                f"INSERT INTO {self.table} ({_DOC_COLUMNS}) "
+                f"VALUES (%s, %s, %s::vector, %s, %s, %s, %s) {conflict}",
+                rows,
+            )
+
+    async def _merge(self):
+        await self._conn.execute(
+            f"INSERT INTO documents ({_DOC_COLUMNS}) "
+            f"SELECT {_DOC_COLUMNS} FROM {self.table} {_ON_HASH_CONFLICT}"
+        )
+        await self._conn.execute(f"TRUNCATE {self.table}")
+
+    async def _count(self, n: int):
+        self._unnotified += n
+        if self._unnotified >= self.notify_rows:
+            await commit_corpus_change(self._conn, self.tenant_id)
+            self._unnotified = 0
+        else:
+            await self._conn.commit()
+
+    async def known_hashes(self, hashes) -> set:
+        # on the loader's connection, so rows this ingest already wrote count too
+        async with self._lock:
+            known = await known_content_hashes(self._conn, self.tenant_id, hashes)
+            await self._conn.commit()   # read-only; ends the transaction the lookup opened
+        return known
+
+    async def see(self, hashes, sources):
+        """Record chunks this ingest produced, per source URL, for finish() to diff against."""
+        rows = [(h, src[0], src[1]) for h, src in zip(hashes, sources) if src]
+        if not rows:
+            return
+        async with self._lock:
+            async with self._conn.cursor() as cur:
+                async with cur.copy(
+                    f"COPY {self.seen_table} (content_hash, source_url, loaded_url) FROM STDIN (FORMAT BINARY)"
+                ) as copy:
+                    copy.set_types(["bytea", "text", "text"])
+                    for row in rows:
+                        await copy.write_row(row)
+            await self._conn.commit()
+            self._seen += len(rows)
+
+    def incomplete(self, sources):
+        """Sources with chunks that didn't make it in; finish() won't tombstone their old chunks."""
+        self._incomplete.update(src[0] for src in sources if src)
+
+    async def touch(self, texts, hashes, sources=None) -> int:
+        """Upsert policy for already-stored chunks: refresh content and source, keep the vector."""
+        if not texts:
+            return 0
+        sources = sources or [None] * len(texts)
+        async with self._lock:
+            async with self._conn.cursor() as cur:
+                await cur.execute(
+                    """
+                    UPDATE documents d
+                    SET content = v.content, source_url = v.source_url, loaded_url = v.loaded_url,
+                        doc_version = %s, deleted_at = NULL
+                    FROM unnest(%s::bytea[], %s::text[], %s::text[], %s::text[])
+                         AS v(content_hash, content, source_url, loaded_url)
+                    WHERE d.tenant_id = %s AND d.content_hash = v.content_hash
+                      AND d.content IS DISTINCT FROM v.content
+                    """,
+                    (
+                        self.version, list(hashes), list(texts),
+                        [src[0] if src else None for src in sources],
+                        [src[1] if src else None for src in sources],
+                        self.tenant_id,
+                    ),
+                )
+            await self._count(len(texts))
+        return len(texts)
+
+    async def write(self, texts, embeddings, hashes=None, sources=None) -> int:
+        if not texts:
+            return 0
+        hashes = hashes or [None] * len(texts)
+        sources = sources or [None] * len(texts)
+        rows = [
+            (self.tenant_id, t, e, h, src[0] if src else None, src[1] if src else None, self.version)
+            for t, e, h, src in zip(texts, to_db_vectors(embeddings), hashes, sources)
+        ]
+        async with self._lock:
+            if self.mode == "copy":
+                await self._copy(rows)
+            else:
+                await self._insert(rows)
+            if self.table != "documents" and not self.staging:
+                await self._merge()
+            self.rows_written += len(rows)
+            await self._count(len(rows))
+        return len(rows)
+
+    async def _reconcile(self):
+        params = {
+            "tenant_id": self.tenant_id, "version": self.version,
+            "full_crawl": self.full_crawl, "incomplete": list(self._incomplete),
+        }
+        async with self._conn.cursor() as cur:
+            await cur.execute(f"ANALYZE {self.seen_table}")
+            # tombstoned chunks that this crawl produced again
+            await cur.execute(
+                f"""
+                UPDATE documents d
+                SET deleted_at = NULL, doc_version = %(version)s,
+                    source_url = s.source_url, loaded_url = s.loaded_url
+                FROM {self.seen_table} s
+                WHERE d.tenant_id = %(tenant_id)s AND d.content_hash = s.content_hash
+                  AND d.deleted_at IS NOT NULL
+                """,
+                params,
+            )
+            self.revived = cur.rowcount
+            # live chunks of re-crawled pages (any page, for a full crawl) this crawl didn't produce
+            await cur.execute(
+                f"""
+                UPDATE documents d SET deleted_at = now()
+                WHERE d.tenant_id = %(tenant_id)s AND d.deleted_at IS NULL
+                  AND d.source_url IS NOT NULL
+                  AND (%(full_crawl)s OR d.source_url IN (SELECT source_url FROM {self.seen_table}))
+                  AND d.source_url <> ALL(%(incomplete)s::text[])
+                  AND NOT EXISTS (SELECT 1 FROM {self.seen_table} s WHERE s.content_hash = d.content_hash)
+                """,
+                params,
+            )
+            self.tombstoned = cur.rowcount
+
+    async def finish(self) -> int:
+        """
+        Commit what's pending; when staging, merge into documents; then
+        tombstone/revive against what this ingest saw. Returns rows loaded.
+        """
+        async with self._lock:
+            if self.staging:
+                await self._merge()
+                self.staging = False
+            if self._seen:
+                await self._reconcile()
+            await self._conn.execute(f"DROP TABLE {self.seen_table}")
+            if self.table != "documents":
+                await self._conn.execute(f"DROP TABLE {self.table}")
+                self.table = "documents"
+            await commit_corpus_change(self._conn, self.tenant_id)
+            self.version = None   # nothing left to clean up in close()
+            self._unnotified = 0
+        return self.rows_written
+
+
+async def purge_tombstones(grace_s: float = TOMBSTONE_GRACE_S, batch: int = 5000) -> int:
+    """
+    Delete chunks tombstoned more than grace_s ago, in short batches, per
+    tenant. Tenants with an ingest running (DocumentLoader holds their
+    ingest lock) are skipped until the next round. Returns rows deleted.
+    """
+    async with connection() as conn:
+        cur = await conn.execute(
+            "SELECT DISTINCT tenant_id FROM documents WHERE deleted_at < now() - make_interval(secs => %s)",
+            (grace_s,),
+        )
+        tenants = [t for t, in await cur.fetchall()]
+    total = 0
+    for tenant_id in tenants:
+        while True:
+            async with connection() as conn:
+                cur = await conn.execute(
+                    "SELECT pg_try_advisory_xact_lock(hashtext('documents_ingest'), hashtext(%s))", (tenant_id,)
+                )
+                if not (await cur.fetchone())[0]:
+                    break
+                cur = await conn.execute(
+                    """
+                    DELETE FROM documents WHERE tenant_id = %s AND id IN (
+                        SELECT id FROM documents
+                        WHERE tenant_id = %s AND deleted_at < now() - make_interval(secs => %s)
+                        LIMIT %s
+                    )
+                    """,
+                    (tenant_id, tenant_id, grace_s, batch),
+                )
+                n = cur.rowcount
+            total += n
+            if n < batch:
+                break
+    return total
+
 
+async def tombstone_vacuum_loop(interval_s: float = VACUUM_INTERVAL_S):
+    """
+    Background purge, started by the app lifespan. Autovacuum then reclaims
+    the space, so table and index size track live content.
+    """
+    while True:
+        await asyncio.sleep(interval_s)
+        try:
+            n = await purge_tombstones()
+            if n:
+                print(f"[vacuum] purged {n} tombstoned chunks")
+        except Exception as e:
+            print(f"[WARN] tombstone vacuum failed: {e}")
@@ -1,17 +1,50 @@
-import psycopg2
+from typing import Optional
+
 from fastapi import APIRouter
-from db import DB_CONN
+from answer_cache import answer_cache
+from db import connection
+from embed_cache import embedding_cache
+from indexes import index_status
+from partitions import partition_name
+from retrieval_cache import retrieval_cache
 
 router = APIRouter()
 
 @router.get("/debug/tenant/{tenant_id}")
-def tenant_debug(tenant_id: str):
-    conn = psycopg2.connect(**DB_CONN)
-    cur = conn.cursor()
-    cur.execute("SELECT count(*) FROM documents WHERE tenant_id=%s", (tenant_id,))
-    count = cur.fetchone()[0]
-    cur.execute("SELECT id, left(content, 200) FROM documents WHERE tenant_id=%s LIMIT 5", (tenant_id,))
-    sample = cur.fetchall()
-    cur.close()
-    conn.close()
-    return {"tenant_id": tenant_id, "count": count, "sample": sample}
+async def tenant_debug(tenant_id: str):
+    async with connection() as conn, conn.cursor() as cur:
+        await cur.execute(
+            "SELECT count(*) FILTER (WHERE deleted_at IS NULL), count(*) FILTER (WHERE deleted_at IS NOT NULL), "
+            "count(DISTINCT source_url) FILTER (WHERE deleted_at IS NULL), max(doc_version) "
+            "FROM documents WHERE tenant_id=%s",
+            (tenant_id,),
+        )
+        count, tombstoned, sources, version = await cur.fetchone()
+        await cur.execute("SELECT to_regclass(%s)::text", (partition_name(tenant_id),))
+        partition = (await cur.fetchone())[0]
+        await cur.execute(
+            "SELECT id, left(content, 200) FROM documents WHERE tenant_id=%s AND deleted_at IS NULL LIMIT 5",
+            (tenant_id,),
+        )
+        sample = await cur.fetchall()
+    return {
+        "tenant_id": tenant_id, "count": count, "tombstoned": tombstoned,
+        "sources": sources, "version": version, "partition": partition, "sample": sample,
+    }
+
+@router.get("/debug/embed-cache")
+def embed_cache_debug():
+    return embedding_cache.stats()
+
+@router.get("/debug/retrieval-cache")
+def retrieval_cache_debug():
+    return retrieval_cache.stats()
+
+@router.get("/debug/answer-cache")
+def answer_cache_debug():
+    return answer_cache.stats() if answer_cache is not None else {"enabled": False}
+
+@router.get("/debug/index")
+async def index_debug(tenant_id: Optional[str] = None):
+    async with connection() as conn:
+        return {"tables": await index_status(conn, tenant_id)}
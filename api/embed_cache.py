@@ -0,0 +1,184 @@
+import asyncio
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from config import EMBED_CACHE_MAX_BYTES, EMBED_CACHE_TTL, EMBED_CACHE_PATH
+from utils import content_hash
+
+
+def cache_key(model: str, text: str) -> str:
+    # same digest as documents.content_hash
+    return content_hash(text, model).hex()
+
+
+def _pack(vec: List[float]) -> bytes:
+    # float32 is what pgvector stores anyway; 4x smaller than a list of floats
+    return array("f", vec).tobytes()
+
+
+def _unpack(blob: bytes) -> List[float]:
+    a = array("f")
+    a.frombytes(blob)
+    return a.tolist()
+
+
+class _SharedTier:
+    """SQLite file shared by every uvicorn worker on the host (WAL, so readers don't block)."""
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5.0, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vec BLOB NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._puts = 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT vec FROM embeddings WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+        return row[0] if row else None
+
+    def put(self, key: str, blob: bytes, expires_at: float):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO embeddings (key, vec, expires_at) VALUES (?, ?, ?)",
+                (key, blob, expires_at),
+            )
+            self._puts += 1
+            if self._puts % 1000 == 0:
+                self._conn.execute("DELETE FROM embeddings WHERE expires_at <= ?", (time.time(),))
+
+
+class EmbeddingCache:
+    """
+    Two-tier query-embedding cache keyed on (model, normalized text).
+    Tier 1: in-process LRU bounded by bytes, with TTL.
+    Tier 2 (optional): SQLite file readable by all workers.
+    Concurrent misses for the same key share one upstream call.
+    """
+
+    def __init__(self, max_bytes: int, ttl: float, shared_path: Optional[str] = None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lru: "OrderedDict[str, tuple[float, bytes]]" = OrderedDict()
+        self._bytes = 0
+        self._shared = _SharedTier(shared_path) if shared_path else None
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.shared_hits + self.misses
+        return {
+            "hits": self.hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round((self.hits + self.shared_hits) / lookups, 3) if lookups else 0.0,
+            "entries": len(self._lru),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "shared": self._shared is not None,
+        }
+
+    def _mem_get(self, key: str) -> Optional[bytes]:
+        item = self._lru.get(key)
+        if item is None:
+            return None
+        expires_at, blob = item
+        if expires_at <= time.time():
+            self._mem_drop(key)
+            return None
+        self._lru.move_to_end(key)
+        return blob
+
+    def _mem_drop(self, key: str):
+        _, blob = self._lru.pop(key)
+        self._bytes -= len(blob)
+
+    def _mem_put(self, key: str, blob: bytes, expires_at: float):
+        if len(blob) > self.max_bytes:
+            return
+        if key in self._lru:
+            self._mem_drop(key)
+        self._lru[key] = (expires_at, blob)
+        self._bytes += len(blob)
+        while self._bytes > self.max_bytes:
+            old, _ = next(iter(self._lru.items()))
+            self._mem_drop(old)
+            self.evictions += 1
+
+    async def _lookup(self, key: str) -> Optional[bytes]:
+        blob = self._mem_get(key)
+        if blob is not None:
+            self.hits += 1
+            return blob
+        if self._shared is not None:
+            try:
+                blob = await asyncio.to_thread(self._shared.get, key)
+            except sqlite3.Error as e:
+                print(f"[WARN] embedding cache read failed: {e}")
+                blob = None
+            if blob is not None:
+                self.shared_hits += 1
+                self._mem_put(key, blob, time.time() + self.ttl)
+                return blob
+        return None
+
+    async def _store(self, key: str, blob: bytes):
+        expires_at = time.time() + self.ttl
+        self._mem_put(key, blob, expires_at)
+        if self._shared is not None:
+            try:
+                await asyncio.to_thread(self._shared.put, key, blob, expires_at)
+            except sqlite3.Error as e:
+                print(f"[WARN] embedding cache write failed: {e}")
+
+    async def get_or_embed(
+        self,
+        model: str,
+        text: str,
+        embed: Callable[[str], Awaitable[List[float]]],
+    ) -> List[float]:
+        key = cache_key(model, text)
+        blob = await self._lookup(key)
+        if blob is not None:
+            return _unpack(blob)
+
+        pending = self._inflight.get(key)
+        if pending is not None:
+            self.hits += 1
+            return _unpack(await asyncio.shield(pending))
+
+        self.misses += 1
+        # the call runs in a task of the cache's own, so cancelling the request
+        # that started it (chat does, in parallel mode) doesn't cancel it for the
+        # others waiting on the same text
+        task = asyncio.create_task(self._embed_and_store(key, text, embed))
+        self._inflight[key] = task
+        task.add_done_callback(lambda t: self._finished(key, t))
+        return _unpack(await asyncio.shield(task))
+
+    async def _embed_and_store(self, key: str, text: str, embed: Callable[[str], Awaitable[List[float]]]) -> bytes:
+        blob = _pack(await embed(text))
+        await self._store(key, blob)
+        return blob
+
+    def _finished(self, key: str, task: "asyncio.Task[bytes]"):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # mark retrieved: every waiter may have gone before it failed
+
+
+embedding_cache = EmbeddingCache(EMBED_CACHE_MAX_BYTES, EMBED_CACHE_TTL, EMBED_CACHE_PATH or None)
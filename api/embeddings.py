@@ -1,84 +1,274 @@
 import asyncio
-from typing import List, Callable, Awaitable, Optional
+import collections
+import contextlib
+import random
+import re
+import time
+from typing import Any, AsyncIterator, List, Callable, Awaitable, Optional, Tuple
+
+import openai
 from fastapi import HTTPException
 from openai import AsyncOpenAI
-from psycopg2 import OperationalError
 
 from config import (
     OPENAI_API_KEY, EMBED_MODEL,
-    MAX_TOKENS_PER_BATCH, MAX_ITEMS_PER_BATCH,
-    EMBED_CONCURRENCY,
+    MAX_TOKENS_PER_BATCH, MAX_ITEMS_PER_BATCH, MAX_TOKENS_PER_ITEM, BATCH_SIZE_HARD_LIMIT,
+    EMBED_CONCURRENCY, EMBED_TARGET_LATENCY, EMBED_MAX_ATTEMPTS,
 )
-from utils import count_tokens, safe_truncate
-from db import insert_documents  # your bulk insert helper (tenant_id, texts, vectors)
+from utils import content_hash, truncate_many
+from embed_cache import embedding_cache
+from metrics import EMBED_SECONDS
+from db import connection, insert_documents, known_content_hashes  # bulk insert helper (tenant_id, texts, vectors, hashes)
 
 client = AsyncOpenAI(api_key=OPENAI_API_KEY)
 
-async def embed_question(q: str) -> list[float]:
-    resp = await client.embeddings.create(model=EMBED_MODEL, input=[q])
+async def _embed_one(q: str) -> list[float]:
+    with EMBED_SECONDS.time(kind="query"):
+        resp = await client.embeddings.create(model=EMBED_MODEL, input=[q])
     return resp.data[0].embedding
 
-def _prepare_rows(rows: List[str]) -> List[str]:
-    """Strip, dedupe, and truncate overly-long rows to per-item token cap."""
-    seen = set()
-    cleaned: List[str] = []
-    for r in rows:
-        t = (r or "").strip()
-        if not t:
-            continue
-        t = safe_truncate(t)  # enforce per-item cap
-        if t in seen:
-            continue
-        seen.add(t)
-        cleaned.append(t)
-    return cleaned
-
-def _make_batches(rows: List[str]) -> List[List[str]]:
-    """Create batches that respect per-request token and item caps."""
-    batches: List[List[str]] = []
-    cur: List[str] = []
-    cur_tokens = 0
-
-    for r in rows:
-        tok = count_tokens(r)
-        # if adding this row would exceed either cap, flush current
-        if cur and (cur_tokens + tok > MAX_TOKENS_PER_BATCH or len(cur) >= MAX_ITEMS_PER_BATCH):
-            batches.append(cur)
-            cur, cur_tokens = [], 0
-        cur.append(r)
-        cur_tokens += tok
-
-    if cur:
-        batches.append(cur)
-    return batches
+async def embed_question(q: str) -> list[float]:
+    """Query embedding, served from the embedding cache when we've seen q before."""
+    return await embedding_cache.get_or_embed(EMBED_MODEL, q, _embed_one)
+
+Item = Tuple[str, int, Any]       # (text, token count, caller's metadata)
+Batch = List[Item]
+
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNIT = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+def _parse_duration(v: Optional[str]) -> Optional[float]:
+    """OpenAI reset headers look like "1s", "6m0s", "20ms"."""
+    if not v:
+        return None
+    parts = _DURATION_RE.findall(v)
+    if not parts:
+        return None
+    return sum(float(n) * _DURATION_UNIT[u] for n, u in parts)
+
+def _retry_after(e: openai.APIStatusError) -> Optional[float]:
+    h = e.response.headers
+    with contextlib.suppress(TypeError, ValueError):
+        if h.get("retry-after-ms"):
+            return float(h["retry-after-ms"]) / 1000.0
+        if h.get("retry-after"):
+            return float(h["retry-after"])
+    return None
+
+class EmbeddingBatcher:
+    """
+    Token-aware embedding requests that size themselves, shared by the
+    streaming ingest and embed_and_store.
+
+    pack()/pack_stream() cut texts into batches under the current item and
+    token targets. embed() sends one batch (split again if the targets shrank
+    after it was packed) and returns what succeeded plus what was dropped:
+      - 429 / 5xx / connection errors: only the failed request is retried,
+        after Retry-After or exponential backoff, up to EMBED_MAX_ATTEMPTS
+      - 400: the request is bisected until the offending item is isolated
+    Targets are scaled AIMD-style: halved on 429 or when a request takes
+    longer than EMBED_TARGET_LATENCY, grown back slowly while requests are
+    fast. When x-ratelimit-remaining-tokens says the next request won't fit,
+    every caller waits for x-ratelimit-reset-tokens.
+    """
+
+    def __init__(
+        self,
+        model: str = EMBED_MODEL,
+        max_items: int = MAX_ITEMS_PER_BATCH,
+        max_tokens: int = MAX_TOKENS_PER_BATCH,
+        target_latency: float = EMBED_TARGET_LATENCY,
+        max_attempts: int = EMBED_MAX_ATTEMPTS,
+    ):
+        self.model = model
+        self.max_items = max(1, min(max_items, BATCH_SIZE_HARD_LIMIT))
+        self.max_tokens = max(max_tokens, MAX_TOKENS_PER_ITEM)
+        self.target_latency = target_latency
+        self.max_attempts = max(max_attempts, 1)
+        self.scale = 1.0
+        self._resume_at = 0.0
+        # retries are ours, so the SDK's own 429/5xx retry loop is off
+        self._client = client.with_options(max_retries=0)
+        self.requests = 0
+        self.retries = 0
+        self.throttled = 0
+        self.dropped = 0
+
+    # ---- sizing
+    @property
+    def target_items(self) -> int:
+        return max(1, int(self.max_items * self.scale))
+
+    @property
+    def target_tokens(self) -> int:
+        return max(MAX_TOKENS_PER_ITEM, int(self.max_tokens * self.scale))
+
+    def _shrink(self):
+        self.scale = max(self.scale / 2, 1.0 / self.max_items)
+
+    def _grow(self):
+        self.scale = min(1.0, self.scale + 0.1)
+
+    def stats(self) -> dict:
+        return {
+            "target_items": self.target_items, "target_tokens": self.target_tokens,
+            "requests": self.requests, "retries": self.retries,
+            "throttled": self.throttled, "dropped": self.dropped,
+        }
+
+    # ---- packing
+    def _fits(self, items: int, tokens: int, tok: int) -> bool:
+        return items < self.target_items and tokens + tok <= self.target_tokens
+
+    def _split(self, batch: Batch) -> List[Batch]:
+        parts, cur, cur_tok = [], [], 0
+        for item in batch:
+            tok = item[1]
+            if cur and not self._fits(len(cur), cur_tok, tok):
+                parts.append(cur)
+                cur, cur_tok = [], 0
+            cur.append(item)
+            cur_tok += tok
+        if cur:
+            parts.append(cur)
+        return parts
+
+    def pack(self, rows: List[str]) -> List[Batch]:
+        """Strip, dedupe, truncate to MAX_TOKENS_PER_ITEM and cut into batches."""
+        seen = set()
+        cleaned: List[str] = []
+        for r in rows:
+            t = (r or "").strip()
+            if t and t not in seen:
+                seen.add(t)
+                cleaned.append(t)
+        return self._split([(t, tok, None) for t, tok in truncate_many(cleaned)])
+
+    async def pack_stream(self, rows: AsyncIterator[Tuple[str, Any]]) -> AsyncIterator[Batch]:
+        """pack() for a stream of (text, metadata); a batch is yielded as soon as the next row wouldn't fit."""
+        cur, cur_tok = [], 0
+        async for r, meta in rows:
+            t = (r or "").strip()
+            if not t:
+                continue
+            (t, tok), = truncate_many([t])
+            if cur and not self._fits(len(cur), cur_tok, tok):
+                yield cur
+                cur, cur_tok = [], 0
+            cur.append((t, tok, meta))
+            cur_tok += tok
+        if cur:
+            yield cur
+
+    # ---- requests
+    def _observe(self, headers, latency: float, tokens: int):
+        EMBED_SECONDS.observe(latency, kind="ingest")
+        if latency > self.target_latency:
+            self._shrink()
+        elif latency < self.target_latency / 2:
+            self._grow()
+        with contextlib.suppress(TypeError, ValueError):
+            remaining = int(headers.get("x-ratelimit-remaining-tokens"))
+            reset = _parse_duration(headers.get("x-ratelimit-reset-tokens"))
+            if remaining < min(tokens, self.target_tokens) and reset:
+                self._resume_at = max(self._resume_at, time.monotonic() + reset)
+
+    async def _request(self, part: Batch) -> List[List[float]]:
+        delay = self._resume_at - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tokens = sum(item[1] for item in part)
+        self.requests += 1
+        t0 = time.perf_counter()
+        raw = await self._client.embeddings.with_raw_response.create(
+            model=self.model, input=[item[0] for item in part],
+        )
+        resp = raw.parse()
+        self._observe(raw.headers, time.perf_counter() - t0, tokens)
+        return [d.embedding for d in sorted(resp.data, key=lambda d: d.index)]
+
+    def _backoff(self, attempt: int, hint: Optional[float] = None) -> float:
+        if hint is not None:
+            return hint
+        return min(30.0, 0.5 * 2 ** attempt) * (0.5 + random.random())
+
+    async def embed(self, batch: Batch) -> Tuple[Batch, List[List[float]], List[Tuple[str, str]]]:
+        """Returns (embedded items, their vectors, [(dropped text, reason)])."""
+        done: Batch = []
+        vectors: List[List[float]] = []
+        dropped: List[Tuple[str, str]] = []
+        pending = collections.deque((part, 1) for part in self._split(batch))
+
+        def give_up(part: Batch, reason: str):
+            dropped.extend((item[0], reason) for item in part)
+            self.dropped += len(part)
+
+        while pending:
+            part, attempt = pending.popleft()
+            try:
+                vecs = await self._request(part)
+            except openai.BadRequestError as e:
+                if len(part) == 1:
+                    give_up(part, f"400: {e.message}")
+                else:
+                    mid = len(part) // 2
+                    pending.extendleft([(part[mid:], attempt), (part[:mid], attempt)])
+                continue
+            except (openai.RateLimitError, openai.InternalServerError, openai.APIConnectionError) as e:
+                status = getattr(e, "status_code", None) or e.__class__.__name__
+                if attempt >= self.max_attempts:
+                    give_up(part, f"{status} after {attempt} attempts")
+                    continue
+                self.retries += 1
+                hint = None
+                if isinstance(e, openai.RateLimitError):
+                    self.throttled += 1
+                    self._shrink()
+                    hint = _retry_after(e)
+                wait = self._backoff(attempt, hint)
+                self._resume_at = max(self._resume_at, time.monotonic() + wait)
+                # re-split: the targets may have just shrunk
+                pending.extendleft(reversed([(p, attempt + 1) for p in self._split(part)]))
+                continue
+            done.extend(part)
+            vectors.extend(vecs)
+        return done, vectors, dropped
 
 async def embed_and_store(
     rows: List[str],
     tenant_id: str,
     progress_cb: Optional[Callable[[int, int], Awaitable[None]]] = None,
+    batcher: Optional[EmbeddingBatcher] = None,
 ) -> None:
     """
-    Embeds rows in bounded parallel batches and inserts them.
+    Embeds rows in bounded parallel batches and inserts them; rows the
+    tenant already has (same content hash) are skipped.
     Continues on per-batch errors, reports progress.
     """
     # 0) sanitize + batch
-    rows = _prepare_rows(rows)
-    if not rows:
+    batcher = batcher or EmbeddingBatcher()
+    batches = batcher.pack(rows)
+    if not batches:
         return
-    batches = _make_batches(rows)
     total = len(batches)
     done = 0
 
     sem = asyncio.Semaphore(EMBED_CONCURRENCY)
     errors: List[str] = []
 
-    async def process_one(idx: int, batch: List[str]):
+    async def process_one(idx: int, batch: Batch):
         nonlocal done
         async with sem:
             try:
-                resp = await client.embeddings.create(model=EMBED_MODEL, input=batch)
-                vectors = [d.embedding for d in resp.data]
-                insert_documents(tenant_id, batch, vectors)  # your bulk insert
+                hashes = {item[0]: content_hash(item[0], batcher.model) for item in batch}
+                async with connection() as conn:
+                    known = await known_content_hashes(conn, tenant_id, hashes.values())
+                batch = [item for item in batch if hashes[item[0]] not in known]
+                items, vectors, dropped = await batcher.embed(batch) if batch else ([], [], [])
+                if dropped:
+                    errors.append(f"batch {idx+1}: {len(dropped)} rows dropped ({dropped[0][1]})")
+                texts = [item[0] for item in items]
+                await insert_documents(tenant_id, texts, vectors, [hashes[t] for t in texts])  # your bulk insert
             except Exception as e:
                 # accumulate error and continue; do NOT crash the stream
                 errors.append(f"batch {idx+1}: {e}")
@@ -0,0 +1,159 @@
+import asyncio
+from typing import Optional
+
+import httpx
+
+from config import (
+    FETCH_CONNECT_TIMEOUT, FETCH_READ_TIMEOUT, FETCH_MAX_CONNECTIONS, FETCH_RESUME_ATTEMPTS,
+)
+
+# ---- download knobs
+PREFETCH_CHUNKS = 64         # network reads buffered ahead of the parser (<= 64 KiB each)
+
+# One pooled client per worker process; opened/closed by the app lifespan in main.py.
+client: Optional[httpx.AsyncClient] = None
+
+_EOF = object()
+
+
+async def open_client():
+    global client
+    if client is not None and not client.is_closed:
+        return
+    client = httpx.AsyncClient(
+        timeout=httpx.Timeout(FETCH_READ_TIMEOUT, connect=FETCH_CONNECT_TIMEOUT),
+        limits=httpx.Limits(max_connections=FETCH_MAX_CONNECTIONS, max_keepalive_connections=FETCH_MAX_CONNECTIONS),
+        follow_redirects=True,
+    )
+
+
+async def close_client():
+    if client is not None:
+        await client.aclose()
+
+
+class RemoteCSV:
+    """
+    Streaming download exposed as a blocking binary file object.
+
+    open() checks the response status on the event loop; the body is then
+    pumped into a bounded queue by a background task while parser threads
+    call read(). If the connection drops mid-body and the server supports
+    byte ranges, the download resumes with `Range`/`If-Range` from the last
+    byte received.
+
+        remote = RemoteCSV(url)
+        await remote.open()                  # raises httpx.HTTPError
+        await asyncio.to_thread(remote.read, 65536)   # never on the loop thread
+        await remote.aclose()
+    """
+
+    def __init__(self, url: str, resume_attempts: int = FETCH_RESUME_ATTEMPTS):
+        self.url = url
+        self.resume_attempts = resume_attempts
+        self.received = 0
+        self.resumes = 0
+        self._resp: Optional[httpx.Response] = None
+        self._validator: Optional[str] = None
+        self._resumable = False
+        self._q: "asyncio.Queue" = asyncio.Queue(maxsize=PREFETCH_CHUNKS)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._pump_task: Optional[asyncio.Task] = None
+        self._buf = bytearray()
+        self._eof = False
+
+    async def _request(self, headers: Optional[dict] = None) -> httpx.Response:
+        if client is None or client.is_closed:
+            raise RuntimeError("HTTP client is not open")
+        # identity encoding keeps byte offsets valid for Range requests
+        req = client.build_request("GET", self.url, headers={"Accept-Encoding": "identity", **(headers or {})})
+        return await client.send(req, stream=True)
+
+    async def open(self):
+        resp = await self._request()
+        if resp.status_code != 200:
+            await resp.aclose()
+            raise httpx.HTTPStatusError(
+                f"unexpected status {resp.status_code}", request=resp.request, response=resp
+            )
+        self._resp = resp
+        self._validator = resp.headers.get("etag") or resp.headers.get("last-modified")
+        self._resumable = (
+            resp.headers.get("accept-ranges", "").lower() == "bytes"
+            and resp.headers.get("content-encoding", "identity").lower() == "identity"
+        )
+        self._loop = asyncio.get_running_loop()
+        self._pump_task = asyncio.create_task(self._pump())
+        return self
+
+    async def _resume(self) -> httpx.Response:
+        headers = {"Range": f"bytes={self.received}-"}
+        if self._validator:
+            headers["If-Range"] = self._validator
+        resp = await self._request(headers)
+        if resp.status_code != 206:
+            # 200 means the resource changed (If-Range) or ranges were ignored
+            await resp.aclose()
+            raise httpx.HTTPStatusError(
+                f"resume at byte {self.received} got status {resp.status_code}",
+                request=resp.request, response=resp,
+            )
+        return resp
+
+    async def _pump(self):
+        try:
+            while True:
+                try:
+                    # unsized reads: every byte handed to the parser is counted, so a resume
+                    # starts exactly where the stream broke
+                    async for chunk in self._resp.aiter_bytes():
+                        await self._q.put(chunk)
+                        self.received += len(chunk)
+                    break
+                except httpx.TransportError as e:
+                    await self._resp.aclose()
+                    if not self._resumable or self.resumes >= self.resume_attempts:
+                        raise
+                    self.resumes += 1
+                    print(f"[WARN] {self.url}: {e!r} after {self.received} bytes; resuming ({self.resumes})")
+                    self._resp = await self._resume()
+            await self._q.put(_EOF)
+        except BaseException as e:
+            # make room so a blocked reader always sees the failure
+            while self._q.full():
+                self._q.get_nowait()
+            self._q.put_nowait(e if isinstance(e, Exception) else EOFError("download cancelled"))
+            if not isinstance(e, Exception):
+                raise
+        finally:
+            await self._resp.aclose()
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, n: int = -1) -> bytes:
+        """Blocking read for worker threads; calling it on the event loop thread deadlocks."""
+        while not self._eof and (n is None or n < 0 or len(self._buf) < n):
+            item = asyncio.run_coroutine_threadsafe(self._q.get(), self._loop).result()
+            if item is _EOF:
+                self._eof = True
+            elif isinstance(item, BaseException):
+                self._eof = True
+                raise item
+            else:
+                self._buf += item
+        if n is None or n < 0:
+            n = len(self._buf)
+        out = bytes(self._buf[:n])
+        del self._buf[:n]
+        return out
+
+    async def aclose(self):
+        if self._pump_task is not None and not self._pump_task.done():
+            self._pump_task.cancel()
+            try:
+                await self._pump_task
+            except asyncio.CancelledError:
+                pass
+        elif self._resp is not None:
+            await self._resp.aclose()
@@ -0,0 +1,319 @@
+# api/indexes.py
+# ANN index management for documents.embedding: build HNSW or ivfflat (with
+# `lists` sized from the rows actually there), rebuild an ivfflat index once
+# the table has outgrown its lists, and set hnsw.ef_search / ivfflat.probes
+# per query from a latency/recall profile.
+#
+#     python indexes.py status
+#     python indexes.py build [--method hnsw|ivfflat] [--table documents]
+import argparse
+import asyncio
+import math
+import time
+from typing import Dict, List, Optional
+
+from psycopg import sql
+
+from config import (
+    ANN_INDEX_METHOD, ANN_PROFILE, HNSW_M, HNSW_EF_CONSTRUCTION,
+    ANN_REBUILD_MIN_ROWS, ANN_REBUILD_DRIFT, DENSE_LIMIT,
+)
+
+# ---- per-query search profiles
+# ef_search is the HNSW candidate list (>= the dense LIMIT or rows go missing);
+# probes scale with sqrt(lists), pgvector's recall/latency sweet spot.
+SEARCH_PROFILES = {
+    "fast":     {"ef_search": 20,  "probes_factor": 0.5},
+    "balanced": {"ef_search": 40,  "probes_factor": 1.0},
+    "accurate": {"ef_search": 120, "probes_factor": 3.0},
+}
+STATE_TTL_S = 60.0     # how long a table's index description is trusted for query settings
+
+# tenant_id -> (expires_at, table, index or None)
+_state: Dict[str, tuple] = {}
+# tables with a rebuild running in this process
+_rebuilding: set = set()
+
+
+def recommended_lists(rows: int) -> int:
+    # pgvector's guidance: rows/1000 up to 1M rows, sqrt(rows) beyond
+    if rows <= 1_000_000:
+        return max(1, rows // 1000)
+    return int(math.sqrt(rows))
+
+
+def probes_for(lists: int, profile: str = ANN_PROFILE) -> int:
+    factor = SEARCH_PROFILES[profile]["probes_factor"]
+    return min(lists, max(1, math.ceil(factor * math.sqrt(lists))))
+
+
+async def pgvector_version(conn) -> tuple:
+    cur = await conn.execute("SELECT extversion FROM pg_extension WHERE extname = 'vector'")
+    row = await cur.fetchone()
+    return tuple(int(x) for x in row[0].split(".")[:2]) if row else (0, 0)
+
+
+def _options(reloptions) -> dict:
+    out = {}
+    for opt in reloptions or ():
+        k, _, v = opt.partition("=")
+        out[k] = int(v) if v.isdigit() else v
+    return out
+
+
+async def ann_indexes(conn, table: str) -> List[dict]:
+    """ANN indexes on `table` (hnsw/ivfflat), with their build options and sizes."""
+    cur = await conn.execute(
+        """
+        SELECT i.relname, am.amname, i.reloptions, ix.indisvalid,
+               pg_relation_size(i.oid)
+        FROM pg_index ix
+        JOIN pg_class i ON i.oid = ix.indexrelid
+        JOIN pg_am am ON am.oid = i.relam
+        WHERE ix.indrelid = to_regclass(%s) AND am.amname IN ('hnsw', 'ivfflat')
+        ORDER BY i.relname
+        """,
+        (table,),
+    )
+    out = []
+    for name, method, reloptions, valid, size in await cur.fetchall():
+        opts = _options(reloptions)
+        info = {"name": name, "table": table, "method": method, "valid": valid, "bytes": size}
+        if method == "ivfflat":
+            info["lists"] = opts.get("lists", 100)
+        else:
+            info["m"] = opts.get("m", 16)
+            info["ef_construction"] = opts.get("ef_construction", 64)
+        out.append(info)
+    return out
+
+
+async def _current(conn, table: str) -> Optional[dict]:
+    valid = [i for i in await ann_indexes(conn, table) if i["valid"] and not i["name"].endswith("_rebuild")]
+    return valid[0] if valid else None
+
+
+def is_stale(index: Optional[dict], rows: int) -> bool:
+    """
+    Whether the table needs a (re)build: no ANN index on a table big enough
+    to want one, or an ivfflat index whose lists are off from what the row
+    count calls for by more than ANN_REBUILD_DRIFT. HNSW never goes stale.
+    """
+    if rows < ANN_REBUILD_MIN_ROWS:
+        return False
+    if index is None:
+        return True
+    if index["method"] != "ivfflat":
+        return False
+    want, have = recommended_lists(rows), index["lists"]
+    return have * ANN_REBUILD_DRIFT < want or have > want * ANN_REBUILD_DRIFT
+
+
+async def create_ann_index(
+    conn, table: str, method: str = ANN_INDEX_METHOD, name: Optional[str] = None, concurrently: bool = False,
+) -> str:
+    """
+    ANN index on `table`. hnsw needs no training data, so it suits a table
+    that is still empty; ivfflat (also the fallback on pgvector < 0.5) gets
+    lists sized from the rows already there. `concurrently` needs an
+    autocommit connection. Returns the index name.
+    """
+    if method == "hnsw" and await pgvector_version(conn) < (0, 5):
+        print(f"[WARN] pgvector < 0.5 has no hnsw; building ivfflat on {table}")
+        method = "ivfflat"
+    name = name or f"{table}_embedding"
+    if method == "hnsw":
+        using = sql.SQL("hnsw (embedding vector_l2_ops) WITH (m = {}, ef_construction = {})").format(
+            sql.Literal(HNSW_M), sql.Literal(HNSW_EF_CONSTRUCTION)
+        )
+    else:
+        cur = await conn.execute(sql.SQL("SELECT count(*) FROM {}").format(sql.Identifier(table)))
+        lists = recommended_lists((await cur.fetchone())[0])
+        using = sql.SQL("ivfflat (embedding vector_l2_ops) WITH (lists = {})").format(sql.Literal(lists))
+    await conn.execute(
+        sql.SQL("CREATE INDEX {} IF NOT EXISTS {} ON {} USING {}").format(
+            sql.SQL("CONCURRENTLY") if concurrently else sql.SQL(""),
+            sql.Identifier(name), sql.Identifier(table), using,
+        )
+    )
+    return name
+
+
+async def rebuild_index(conn, table: str, method: Optional[str] = None) -> str:
+    """
+    Build a fresh ANN index next to the current one without blocking writes,
+    then swap it in under the old name. `conn` must be in autocommit mode.
+    """
+    current = await _current(conn, table)
+    method = method or (current["method"] if current else ANN_INDEX_METHOD)
+    if current is None:
+        name = await create_ann_index(conn, table, method, concurrently=True)
+    else:
+        name = current["name"]
+        tmp = f"{name[:55]}_rebuild"
+        # an interrupted CONCURRENTLY build leaves an invalid index behind
+        await conn.execute(sql.SQL("DROP INDEX IF EXISTS {}").format(sql.Identifier(tmp)))
+        await create_ann_index(conn, table, method, name=tmp, concurrently=True)
+        async with conn.transaction():
+            await conn.execute(sql.SQL("DROP INDEX {}").format(sql.Identifier(name)))
+            await conn.execute(sql.SQL("ALTER INDEX {} RENAME TO {}").format(sql.Identifier(tmp), sql.Identifier(name)))
+    invalidate()
+    return name
+
+
+async def search_table(conn, tenant_id: str) -> str:
+    """The table a tenant's dense search actually scans: its partition, or documents."""
+    from partitions import is_partitioned, partition_name
+
+    return partition_name(tenant_id) if await is_partitioned(conn) else "documents"
+
+
+async def _estimated_rows(conn, table: str) -> int:
+    """
+    The planner's row estimate (pg_class.reltuples, kept current by
+    autovacuum/ANALYZE): plenty for a drift check and free, where count(*)
+    scans the table. An exact count only for a table never analyzed.
+    """
+    cur = await conn.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", (table,))
+    rows = (await cur.fetchone())[0]
+    if rows < 0:
+        cur = await conn.execute(sql.SQL("SELECT count(*) FROM {}").format(sql.Identifier(table)))
+        rows = (await cur.fetchone())[0]
+    return rows
+
+
+async def rebuild_if_stale(tenant_id: str):
+    """
+    After an ingest: rebuild (or first build) the ANN index on the tenant's
+    table when is_stale() says so of its estimated rows; the build itself
+    sizes lists from an exact count. Runs on its own autocommit connection;
+    an advisory lock keeps other workers from building the same index.
+    """
+    from psycopg import AsyncConnection
+    from psycopg.conninfo import make_conninfo
+    from db import DB_CONN
+
+    try:
+        async with await AsyncConnection.connect(make_conninfo(**DB_CONN), autocommit=True) as conn:
+            table = await search_table(conn, tenant_id)
+            cur = await conn.execute("SELECT to_regclass(%s) IS NOT NULL", (table,))
+            if table in _rebuilding or not (await cur.fetchone())[0]:
+                return
+            cur = await conn.execute(
+                "SELECT pg_try_advisory_lock(hashtext('documents_ann'), hashtext(%s))", (table,)
+            )
+            if not (await cur.fetchone())[0]:
+                return
+            _rebuilding.add(table)
+            try:
+                rows = await _estimated_rows(conn, table)
+                current = await _current(conn, table)
+                if not is_stale(current, rows):
+                    return
+                t0 = time.perf_counter()
+                name = await rebuild_index(conn, table, current["method"] if current else ANN_INDEX_METHOD)
+                print(f"[INFO] rebuilt {name} on {table} ({rows} rows) in {time.perf_counter() - t0:.1f}s")
+            finally:
+                _rebuilding.discard(table)
+                await conn.execute("SELECT pg_advisory_unlock(hashtext('documents_ann'), hashtext(%s))", (table,))
+    except Exception as e:
+        print(f"[WARN] ANN index rebuild for tenant {tenant_id} failed: {e}")
+
+
+def invalidate(tenant_id: Optional[str] = None):
+    if tenant_id is None:
+        _state.clear()
+    else:
+        _state.pop(tenant_id, None)
+
+
+def search_settings(index: Optional[dict], profile: str = ANN_PROFILE) -> dict:
+    """GUCs for one query against `index` under `profile`; empty for an exact scan."""
+    if index is None:
+        return {}
+    if index["method"] == "hnsw":
+        return {"hnsw.ef_search": max(SEARCH_PROFILES[profile]["ef_search"], DENSE_LIMIT)}
+    return {"ivfflat.probes": probes_for(index["lists"], profile)}
+
+
+async def apply_search_profile(conn, tenant_id: str, profile: Optional[str] = None) -> dict:
+    """
+    SET LOCAL the ANN search parameters for the current transaction, so
+    run it on the connection (and in the transaction) that retrieves.
+    Index state is cached per tenant for STATE_TTL_S.
+    """
+    profile = profile or ANN_PROFILE
+    if profile not in SEARCH_PROFILES:
+        raise ValueError(f"unknown search profile {profile!r}")
+    now = time.monotonic()
+    cached = _state.get(tenant_id)
+    if cached is None or cached[0] <= now:
+        table = await search_table(conn, tenant_id)
+        if len(_state) > 10_000:
+            _state.clear()
+        cached = _state[tenant_id] = (now + STATE_TTL_S, table, await _current(conn, table))
+    settings = search_settings(cached[2], profile)
+    for guc, value in settings.items():
+        await conn.execute("SELECT set_config(%s, %s, true)", (guc, str(value)))
+    return settings
+
+
+async def index_status(conn, tenant_id: Optional[str] = None) -> List[dict]:
+    """One entry per searched table: its ANN indexes, estimated rows and whether a rebuild is due."""
+    from partitions import is_partitioned, list_partitions
+
+    if tenant_id is not None:
+        tables = [await search_table(conn, tenant_id)]
+    elif await is_partitioned(conn):
+        tables = [name for name, *_ in await list_partitions(conn)]
+    else:
+        tables = ["documents"]
+    out = []
+    for table in tables:
+        cur = await conn.execute("SELECT to_regclass(%s) IS NOT NULL", (table,))
+        if not (await cur.fetchone())[0]:
+            out.append({"table": table, "exists": False})
+            continue
+        rows = await _estimated_rows(conn, table)
+        indexes = await ann_indexes(conn, table)
+        current = next((i for i in indexes if i["valid"] and not i["name"].endswith("_rebuild")), None)
+        out.append({
+            "table": table,
+            "exists": True,
+            "rows": rows,
+            "indexes": indexes,
+            "recommended_lists": recommended_lists(rows),
+            "stale": is_stale(current, rows),
+            "rebuilding": table in _rebuilding,
+            "search": {p: search_settings(current, p) for p in SEARCH_PROFILES},
+        })
+    return out
+
+
+async def _main(argv=None):
+    from psycopg import AsyncConnection
+    from psycopg.conninfo import make_conninfo
+    from db import DB_CONN
+
+    ap = argparse.ArgumentParser(description="ANN index management for documents.embedding")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("status", help="show ANN indexes, estimated row counts and whether a rebuild is due")
+    b = sub.add_parser("build", help="(re)build the ANN index without blocking writes")
+    b.add_argument("--method", choices=("hnsw", "ivfflat"), default=None, help="default: keep the current method")
+    b.add_argument("--table", default=None, help="default: documents, or every tenant partition")
+    args = ap.parse_args(argv)
+
+    async with await AsyncConnection.connect(make_conninfo(**DB_CONN), autocommit=True) as conn:
+        if args.cmd == "status":
+            for s in await index_status(conn):
+                print(s)
+            return
+        tables = [args.table] if args.table else [s["table"] for s in await index_status(conn) if s["exists"]]
+        for table in tables:
+            t0 = time.perf_counter()
+            name = await rebuild_index(conn, table, args.method)
+            print(f"{table}: {name} in {time.perf_counter() - t0:.1f}s")
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
@@ -1,187 +1,239 @@
 # api/ingest.py
+import collections
 import contextlib
-import io, csv, zipfile, json, asyncio, re, requests
-from io import StringIO
-from typing import AsyncIterator, List, Tuple, Optional
+import io, csv, itertools, zipfile, json, asyncio, time
+from typing import AsyncIterator, Tuple, Optional
 
+import httpx
 import pandas as pd
-import psycopg2
 from fastapi import APIRouter, UploadFile, File, Form, HTTPException
 from fastapi.responses import StreamingResponse
-from openai import AsyncOpenAI
 
 from config import (
-    OPENAI_API_KEY, EMBED_MODEL,
     EMBED_CONCURRENCY,           # e.g., 8–12
+    CHUNK_WORKERS,
+    PANDAS_CHUNKSIZE,            # CSV rows per pandas chunk
+    EMBED_BATCH,                 # max texts per embedding request
 )
-from utils import (
-    clean_text, split_markdown_sections, simple_chunk_words,
-    dedupe_nearby, normalize_numbers
+from utils import SimHashIndex, content_hash, dedupe_hashed
+from chunking import DEDUPE_HAMMING, Source, chunk_kizen_batch_timed, get_chunk_pool
+from db import DocumentLoader
+from embeddings import Batch, EmbeddingBatcher
+from fetch import RemoteCSV
+from indexes import rebuild_if_stale
+from metrics import (
+    INGEST_ROWS, INGEST_STAGE_SECONDS, push_ingest_metric, track_queues, untrack_queues,
 )
-from db import DB_CONN, insert_documents_on_conn  # add helper below
-from metrics import push_ingest_metric
 
 router = APIRouter()
-client = AsyncOpenAI(api_key=OPENAI_API_KEY)
 
 # ---- tuning knobs (safe defaults)
-PANDAS_CHUNKSIZE = 400            # CSV rows per pandas chunk
-EMBED_BATCH = 128                  # texts per embedding request
-MIN_MICRO_BULLET = 30              # min chars to keep a bullet
-MIN_TABLE_ROW   = 20               # min chars to keep a table row
-MIN_PARA        = 60               # min chars for a paragraph chunk
-TOK_WINDOW      = 320              # window size for main paragraphs
-TOK_OVERLAP     = 24               # overlap tokens
-MAX_BULLETS_PER_SECTION   = 12     # cap micro-bullets per section
-MAX_TABLEROWS_PER_SECTION = 20     # cap micro table rows per section
-
-def _rows_from_generic_csv(csv_bytes: bytes) -> List[str]:
+PANDAS_CHUNKSIZE_FIRST = 400      # smaller first pandas chunk, for a fast first UI update
+CHUNK_INFLIGHT = max(CHUNK_WORKERS, 1) * 2   # pandas batches queued on the chunk pool
+
+HEADER_PROBE_BYTES = 1 << 20      # prefix scanned for the Kizen header row
+GENERIC_ROWS_PER_READ = 2000      # generic-CSV rows parsed per off-loop read
+
+# post-ingest ANN index rebuilds; referenced so they aren't garbage-collected mid-build
+_index_tasks: set = set()
+
+class _PrefixedReader(io.RawIOBase):
+    """Binary stream that replays an already-read prefix, then continues from `raw`."""
+
+    def __init__(self, prefix: bytes, raw):
+        self._prefix = memoryview(prefix)
+        self._raw = raw
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        if self._prefix:
+            n = min(len(b), len(self._prefix))
+            b[:n] = self._prefix[:n]
+            self._prefix = self._prefix[n:]
+            return n
+        data = self._raw.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+def _sniff_header(src) -> Tuple[Optional[int], io.BufferedReader]:
+    """
+    Look for the Kizen header in the first lines of a bounded prefix of `src`.
+    Returns (header line index or None, stream positioned at the start of `src`).
+    """
+    prefix = src.read(HEADER_PROBE_BYTES)
+    # lenient decode: the prefix may end mid-character; the parser is strict later
+    head = prefix.decode("utf-8", errors="ignore")
+    header_idx = None
+    for i, ln in enumerate(head.splitlines()[:10]):
+        if "crawl/loadedUrl" in ln and ("markdown" in ln or "text" in ln):
+            header_idx = i
+            break
+    return header_idx, io.BufferedReader(_PrefixedReader(prefix, src), buffer_size=1 << 16)
+
+@contextlib.contextmanager
+def _timed(timings: Optional[dict], stage: str):
+    """Add the block's wall time to timings[stage] (busy time: concurrent stages overlap)."""
+    t0 = time.perf_counter()
     try:
-        buf = io.StringIO(csv_bytes.decode("utf-8"))
-    except UnicodeDecodeError:
-        raise HTTPException(status_code=400, detail="CSV must be UTF-8")
-    return [" ".join(r) for r in csv.reader(buf) if r]
-
-def _iter_kizen_chunks_from_df(df: pd.DataFrame) -> List[str]:
-    """Yield cleaned, section-aware chunks from a dataframe batch."""
-    is_str = lambda v: isinstance(v, str) and v.strip() != ""
-    out: List[str] = []
-
-    for _, row in df.iterrows():
-        title = row.get("metadata/title") if is_str(row.get("metadata/title")) else ""
-        url = (row.get("url") if is_str(row.get("url")) else "") or \
-              (row.get("crawl/loadedUrl") if is_str(row.get("crawl/loadedUrl")) else "")
-        md  = row.get("markdown") if is_str(row.get("markdown")) else ""
-        txt = row.get("text") if is_str(row.get("text")) else ""
-        content = md if md else txt
-        content = clean_text(content)
-        if not content:
-            continue
-
-        sections = split_markdown_sections(content)
-        for head, body in sections:
-            pre = []
-            if title: pre.append(f"Title: {title}")
-            if url:   pre.append(f"URL: {url}")
-            if head:  pre.append(f"Section: {head}")
-
-            body = normalize_numbers(body or "")
-
-            # bullets -> micro-chunks
-            bullet_lines = []
-            bcount = 0
-            for ln in body.splitlines():
-                if re.match(r"^\s*([*\-]|•)\s+", ln):
-                    bullet = re.sub(r"^\s*([*\-]|•)\s+", "", ln).strip()
-                    if len(bullet) >= MIN_MICRO_BULLET:
-                        out.append(("\n".join(pre) + f"\n\nBullet: {bullet}").strip())
-                        bullet_lines.append(ln)
-                        bcount += 1
-                        if bcount >= MAX_BULLETS_PER_SECTION: break
-
-            # tables -> micro-chunks
-            table_lines = []
-            tcount = 0
-            for ln in body.splitlines():
-                if re.match(r"^\s*\|[-\s|]+\|\s*$", ln):
-                    table_lines.append(ln)
-                    continue
-                if "|" in ln and ln.count("|") >= 2:
-                    rowtxt = re.sub(r"^\s*\||\|\s*$", "", ln)
-                    rowtxt = re.sub(r"\s*\|\s*", " | ", rowtxt)
-                    if len(rowtxt) >= MIN_TABLE_ROW:
-                        out.append(("\n".join(pre) + f"\n\nTableRow: {rowtxt}").strip())
-                        table_lines.append(ln)
-                        tcount += 1
-                        if tcount >= MAX_TABLEROWS_PER_SECTION: break
-
-            # remove micro-lines from body
-            if bullet_lines or table_lines:
-                drop = set(bullet_lines + table_lines)
-                body = "\n".join([ln for ln in body.splitlines() if ln not in drop]).strip()
-
-            # main paragraphs
-            para = ("\n".join(pre) + "\n\n" + (body or "")).strip()
-            if len(para) >= MIN_PARA:
-                for ch in simple_chunk_words(para, max_tokens=TOK_WINDOW, overlap=TOK_OVERLAP):
-                    if len(ch) >= MIN_PARA:
-                        out.append(ch)
-
-    # de-dup similar adjacent chunks
-    out = dedupe_nearby(out, hamming_thresh=5, lookback=1500)
-    return out
+        yield
+    finally:
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - t0
+
+def _next_chunk(reader, size: int) -> Optional[pd.DataFrame]:
+    try:
+        return reader.get_chunk(size)
+    except StopIteration:
+        return None
+
+async def _rows_from_generic_csv(stream) -> AsyncIterator[Tuple[str, None]]:
+    text = io.TextIOWrapper(stream, encoding="utf-8", newline="")
+    rows = (" ".join(r) for r in csv.reader(text) if r)
+    while True:
+        try:
+            batch = await asyncio.to_thread(list, itertools.islice(rows, GENERIC_ROWS_PER_READ))
+        except UnicodeDecodeError:
+            raise HTTPException(status_code=400, detail="CSV must be UTF-8")
+        if not batch:
+            return
+        for row in batch:
+            yield row, None
 
 async def _producer_parse_csv(
-    csv_bytes: bytes,
+    src,
     sse_queue: "asyncio.Queue[str]",
-) -> AsyncIterator[str]:
-    """Stream chunks from CSV in pandas batches."""
-    try:
-        raw = csv_bytes.decode("utf-8")
-    except UnicodeDecodeError:
-        raise HTTPException(status_code=400, detail="CSV must be UTF-8")
-    
+    dedupe_index: Optional[SimHashIndex] = None,
+    timings: Optional[dict] = None,
+) -> AsyncIterator[Tuple[str, Optional[Source]]]:
+    """
+    Stream (chunk, source) pairs from a binary CSV file object in pandas
+    batches; source is (source_url, loaded_url), None for generic CSVs.
+    The file is read incrementally (off the event loop), never held whole.
+    Per-stage seconds (parse, chunk, dedupe) accumulate into `timings`.
+    """
     await sse_queue.put(json.dumps({"phase": "parse", "msg": "Detecting header…"}))
 
     # locate header line
-    header_idx = None
-    for i, ln in enumerate(raw.splitlines()[:10]):
-        if "crawl/loadedUrl" in ln and ("markdown" in ln or "text" in ln):
-            header_idx = i
-            break
+    with _timed(timings, "parse"):
+        header_idx, stream = await asyncio.to_thread(_sniff_header, src)
 
     # Generic fallback
     if header_idx is None:
         await sse_queue.put(json.dumps({"phase":"parse","msg":"Generic CSV detected"}))
-        for row in _rows_from_generic_csv(csv_bytes):
+        async for row in _rows_from_generic_csv(stream):
             yield row
         return
 
     await sse_queue.put(json.dumps({"phase":"parse","msg":"Kizen CSV detected"}))
 
-    # pandas in streaming mode
-    first = True
-    total_produced = 0
-
-    # (optional) a smaller first chunk for faster first UI update
-    PANDAS_CHUNKSIZE_FIRST = 400  # small; fast feedback
-    PANDAS_CHUNKSIZE_MAIN  = PANDAS_CHUNKSIZE  # your normal (e.g., 2000)
+    if dedupe_index is None:
+        dedupe_index = SimHashIndex(hamming_thresh=DEDUPE_HAMMING)
 
-    reader = pd.read_csv(StringIO(raw), skiprows=header_idx, chunksize=PANDAS_CHUNKSIZE_FIRST)
-    for df in reader:
-        chunks = _iter_kizen_chunks_from_df(df)
+    # pandas in streaming mode; each batch is chunked in the process pool.
+    # Up to CHUNK_INFLIGHT batches run ahead of the consumer, results are
+    # yielded in submission order, and nothing new is submitted while the
+    # embed queue is full (the caller stops pulling from this generator).
+    total_produced = 0
+    loop = asyncio.get_running_loop()
+    chunk_pool = get_chunk_pool()
+    inflight: "collections.deque[asyncio.Future]" = collections.deque()
+
+    async def _emit_oldest():
+        nonlocal total_produced
+        (chunks, hashes, sources), chunk_s = await inflight.popleft()
+        if timings is not None:
+            timings["chunk"] = timings.get("chunk", 0.0) + chunk_s
+        with _timed(timings, "dedupe"):
+            chunks = dedupe_hashed(list(zip(chunks, sources)), hashes.tolist(), dedupe_index)
         await sse_queue.put(json.dumps({"phase": "chunk", "produced": len(chunks)}))
         total_produced += len(chunks)
-        for ch in chunks:
+        return chunks
+
+    # the next batch is parsed in a thread while earlier ones are being chunked;
+    # the first one is small so the UI sees chunks quickly
+    size = min(PANDAS_CHUNKSIZE_FIRST, PANDAS_CHUNKSIZE)
+    try:
+        with _timed(timings, "parse"):
+            reader = await asyncio.to_thread(
+                pd.read_csv, stream, skiprows=header_idx, chunksize=PANDAS_CHUNKSIZE, encoding="utf-8",
+            )
+        with reader:
+            while True:
+                with _timed(timings, "parse"):
+                    df = await asyncio.to_thread(_next_chunk, reader, size)
+                if df is None:
+                    break
+                size = PANDAS_CHUNKSIZE
+                inflight.append(loop.run_in_executor(chunk_pool, chunk_kizen_batch_timed, df))
+                if len(inflight) >= CHUNK_INFLIGHT:
+                    for ch in await _emit_oldest():
+                        yield ch
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="CSV must be UTF-8")
+    while inflight:
+        for ch in await _emit_oldest():
             yield ch
-        # swap to larger chunks after the first visible update
-        if first:
-            first = False
-            reader = pd.read_csv(StringIO(raw), skiprows=header_idx, chunksize=PANDAS_CHUNKSIZE_MAIN)
 
     await sse_queue.put(json.dumps({"phase": "chunk", "total_produced": total_produced}))
 
 async def _embed_worker(
     name: str,
-    batch_q: "asyncio.Queue[Optional[List[str]]]",
+    batch_q: "asyncio.Queue[Optional[Batch]]",
     sse_queue: "asyncio.Queue[str]",
-    tenant_id: str,
-    conn: "psycopg2.extensions.connection",
+    loader: DocumentLoader,
+    batcher: EmbeddingBatcher,
+    timings: Optional[dict] = None,
 ):
-    """Consumes text batches, embeds, and inserts using one shared DB conn."""
+    """
+    Consumes token-packed batches, embeds, and hands vectors to the shared bulk loader.
+    Chunks whose content hash the tenant already has are not re-embedded
+    (skipped, or content-refreshed under the "upsert" policy); all of them
+    are reported to the loader's per-source diff.
+    """
     while True:
-        batch: Optional[List[str]] = await batch_q.get()
+        batch: Optional[Batch] = await batch_q.get()
         if batch is None:
             batch_q.task_done()
             break
         try:
-            await sse_queue.put(json.dumps({"phase":"embed","count":len(batch)}))
-            resp = await client.embeddings.create(model=EMBED_MODEL, input=batch)
-            vecs = [d.embedding for d in resp.data]
-            # insert on the same connection (fast)
-            insert_documents_on_conn(conn, tenant_id, batch, vecs)
-            await sse_queue.put(json.dumps({"phase":"insert","count":len(batch)}))
+            with _timed(timings, "dedupe"):
+                hashes = {text: content_hash(text, batcher.model) for text, _, _ in batch}
+                await loader.see([hashes[text] for text, _, _ in batch], [src for _, _, src in batch])
+                known = await loader.known_hashes(hashes.values())
+            fresh = [item for item in batch if hashes[item[0]] not in known]
+            if len(fresh) < len(batch):
+                reused = [item for item in batch if hashes[item[0]] in known]
+                if loader.policy == "upsert":
+                    with _timed(timings, "insert"):
+                        await loader.touch(
+                            [text for text, _, _ in reused], [hashes[text] for text, _, _ in reused],
+                            [src for _, _, src in reused],
+                        )
+                loader.rows_reused += len(reused)
+            await sse_queue.put(json.dumps({
+                "phase":"embed","count":len(fresh),"reused":len(batch) - len(fresh),
+                "batch_target":batcher.target_items,
+            }))
+            if not fresh:
+                continue
+            with _timed(timings, "embed"):
+                items, vecs, dropped = await batcher.embed(fresh)
+            if dropped:
+                lost = {text for text, _ in dropped}
+                loader.incomplete(src for text, _, src in fresh if text in lost)
+                await sse_queue.put(json.dumps({
+                    "status":"error","detail":f"embed: {len(dropped)} chunks dropped ({dropped[0][1]})",
+                }))
+            with _timed(timings, "insert"):
+                n = await loader.write(
+                    [text for text, _, _ in items], vecs,
+                    [hashes[text] for text, _, _ in items], [src for _, _, src in items],
+                )
+            await sse_queue.put(json.dumps({"phase":"insert","count":n,"rows_per_s":loader.rows_per_s}))
         except Exception as e:
+            loader.incomplete(src for _, _, src in batch)
             await sse_queue.put(json.dumps({"status":"error","detail":f"embed/insert: {e}"}))
         finally:
             batch_q.task_done()
@@ -191,24 +243,38 @@ async def ingest_stream(
     tenant_id: str = Form(...),
     file: UploadFile = File(None),
     csv_url: str = Form(None),
+    full_crawl: bool = Form(False),
 ):
+    """
+    Stream-ingest a Kizen export (CSV, ZIP of CSVs or csv_url). Chunks are
+    versioned per source URL: pages in this crawl replace their previous
+    chunks, and with full_crawl pages missing from it are tombstoned too.
+    """
     # --- load bytes
-    rows_iter: Optional[AsyncIterator[str]] = None
+    rows_iter: Optional[AsyncIterator[Tuple[str, Optional[Source]]]] = None
+    remote: Optional[RemoteCSV] = None
+    upload = None
     processed_files = []
 
     if file:
-        content = await file.read()
+        # file.file is the spooled upload (on disk past 1 MB); it is read
+        # incrementally below, never loaded whole
+        upload = file.file
         if file.filename.lower().endswith(".zip"):
             # zip with one or more csvs
-            z = zipfile.ZipFile(io.BytesIO(content))
+            try:
+                z = zipfile.ZipFile(upload)
+            except zipfile.BadZipFile:
+                raise HTTPException(status_code=400, detail="Invalid ZIP file.")
             # concatenate all CSVs into one async generator
             async def _zip_iter():
+                dedupe_index = SimHashIndex(hamming_thresh=DEDUPE_HAMMING)
                 for name in z.namelist():
                     if name.lower().endswith(".csv"):
-                        csv_bytes = z.read(name)
-                        # yield from sub-iter
-                        async for ch in _producer_parse_csv(csv_bytes, sse_queue):
-                            yield ch
+                        # members are decompressed as they are read
+                        with z.open(name) as member:
+                            async for ch in _producer_parse_csv(member, sse_queue, dedupe_index, timings):
+                                yield ch
             rows_iter = _zip_iter()
             processed_files = [n for n in z.namelist() if n.lower().endswith(".csv")]
         elif file.filename.lower().endswith(".csv"):
@@ -218,8 +284,12 @@ async def ingest_stream(
         else:
             raise HTTPException(status_code=400, detail="Unsupported file type.")
     elif csv_url:
-        r = requests.get(csv_url)
-        if r.status_code != 200:
+        # headers are awaited here so a bad URL is still a 400; the body is
+        # pulled in the background and parsed while it downloads
+        remote = RemoteCSV(csv_url)
+        try:
+            await remote.open()
+        except httpx.HTTPError:
             raise HTTPException(status_code=400, detail=f"Failed to fetch: {csv_url}")
         processed_files = [csv_url]
         # defined later after sse_queue creation
@@ -230,20 +300,30 @@ async def ingest_stream(
     # --- SSE stream
     sse_queue: asyncio.Queue[str] = asyncio.Queue()
     stop_event = asyncio.Event()
+    # busy seconds per pipeline stage, reported with the load event
+    timings: dict = {}
 
     async def sse():
+        started = time.perf_counter()
         await sse_queue.put(json.dumps({"status":"starting","files":processed_files}))
-        # init DB connection once
+        # one DB connection for the whole ingest (COPY/insert + periodic commits)
+        loader = DocumentLoader(tenant_id, full_crawl=full_crawl)
         try:
-            conn = psycopg2.connect(**DB_CONN)
+            await loader.open()
         except Exception as e:
-            await sse_queue.put(json.dumps({"status":"error","detail":f"DB connect failed: {e}"}))
-            yield f"data: {json.dumps({'status':'error','detail':str(e)})}\n\n"
+            await loader.close(e)
+            if remote is not None:
+                await remote.aclose()
+            if upload is not None:
+                upload.close()
+            yield f"data: {json.dumps({'status':'error','detail':f'DB connect failed: {e}'})}\n\n"
             return
 
-        batch_q: asyncio.Queue[Optional[List[str]]] = asyncio.Queue(maxsize=EMBED_CONCURRENCY * 2)
+        batch_q: asyncio.Queue[Optional[Batch]] = asyncio.Queue(maxsize=EMBED_CONCURRENCY * 2)
+        batcher = EmbeddingBatcher(max_items=EMBED_BATCH)
+        track_queues(batch=batch_q, sse=sse_queue)
         workers = [
-            asyncio.create_task(_embed_worker(f"w{i+1}", batch_q, sse_queue, tenant_id, conn))
+            asyncio.create_task(_embed_worker(f"w{i+1}", batch_q, sse_queue, loader, batcher, timings))
             for i in range(EMBED_CONCURRENCY)
         ]
 
@@ -253,26 +333,19 @@ async def ingest_stream(
             nonlocal rows_iter
             if rows_iter is None:
                 if file and file.filename.lower().endswith(".csv"):
-                    rows_iter = _producer_parse_csv(content, sse_queue)
+                    rows_iter = _producer_parse_csv(upload, sse_queue, timings=timings)
                 elif csv_url:
-                    rows_iter = _producer_parse_csv(r.content, sse_queue)
+                    rows_iter = _producer_parse_csv(remote, sse_queue, timings=timings)
 
-            # accumulate into EMBED_BATCH
-            buf: List[str] = []
-            produced = 0
+            # pack into token-budgeted batches (sized by the batcher as it goes)
             assert rows_iter is not None
-            async for ch in rows_iter:
-                buf.append(ch)
-                if len(buf) >= EMBED_BATCH:
-                    await batch_q.put(buf)
-                    produced += len(buf)
-                    buf = []
-            if buf:
-                await batch_q.put(buf)
-                produced += len(buf)
-            # tell workers to stop
-            for _ in workers:
-                await batch_q.put(None)  # signal end of batches
+            try:
+                async for batch in batcher.pack_stream(rows_iter):
+                    await batch_q.put(batch)
+            finally:
+                # tell workers to stop, even if parsing failed
+                for _ in workers:
+                    await batch_q.put(None)  # signal end of batches
 
         # producer + streamer
         prod_task = asyncio.create_task(produce_batches())
@@ -281,6 +354,7 @@ async def ingest_stream(
         HEARTBEAT_SEC = 15
         last_send = asyncio.get_event_loop().time()
 
+        failure: Optional[BaseException] = None
         try:
             while True:
                 try:
@@ -296,19 +370,56 @@ async def ingest_stream(
                 # exit when producer is done and queues are empty and workers finished
                 if prod_task.done() and batch_q.empty() and all(w.done() for w in workers):
                     break
-        finally:
-            # wait for workers, close DB
+            # wait for workers, then flush the last commit / staging merge
             await prod_task
             for w in workers:
                 with contextlib.suppress(Exception):
                     await w
-            with contextlib.suppress(Exception):
-                conn.close()
+            version = loader.version
+            with _timed(timings, "finish"):
+                rows = await loader.finish()
+            if rows:
+                # ivfflat lists go stale as a table grows; checked (and rebuilt) off the request
+                t = asyncio.create_task(rebuild_if_stale(tenant_id))
+                _index_tasks.add(t)
+                t.add_done_callback(_index_tasks.discard)
+            await sse_queue.put(json.dumps({
+                "phase": "load", "mode": loader.mode, "rows": rows, "reused": loader.rows_reused,
+                "version": version, "tombstoned": loader.tombstoned, "revived": loader.revived,
+                "partition_created": loader.partition_created,
+                "rows_per_s": loader.rows_per_s,
+                "wall_s": round(time.perf_counter() - started, 3),
+                "stage_s": {k: round(v, 3) for k, v in timings.items()},
+            }))
+            while not sse_queue.empty():
+                yield f"data: {sse_queue.get_nowait()}\n\n"
+            for stage, seconds in timings.items():
+                INGEST_STAGE_SECONDS.observe(seconds, stage=stage)
+            INGEST_ROWS.inc(rows, result="written")
+            INGEST_ROWS.inc(loader.rows_reused, result="reused")
+            INGEST_ROWS.inc(loader.tombstoned, result="tombstoned")
+        except BaseException as e:
+            failure = e
+            raise
+        finally:
+            untrack_queues(batch=batch_q, sse=sse_queue)
+            push_ingest_metric("Failed" if failure is not None else "Complete")
+            for t in (prod_task, *workers):
+                t.cancel()
+            if remote is not None:
+                await remote.aclose()
+            if upload is not None:
+                upload.close()
+            await loader.close(failure)
 
         await sse_queue.put(json.dumps({"status":"complete"}))
         yield f"data: {json.dumps({'status':'complete'})}\n\n"
         stop_event.set()
 
+    if file:
+        # Starlette closes the UploadFile once this handler returns, before the
+        # body below runs; the stream owns the spooled file from here on
+        file.file = io.BytesIO()
     push_ingest_metric("Start")
     return StreamingResponse(
         sse(),
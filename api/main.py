@@ -1,12 +1,47 @@
+import asyncio
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
+
+import db
+import fetch
+import metrics
+from config import RETRIEVAL_CACHE_MAX_ENTRIES, VACUUM_INTERVAL_S
+from chunking import shutdown_chunk_pool
+from rerank import get_scorer, shutdown_rerank_pool
 
 from ingest import router as ingest_router
 from chat import router as chat_router
 from debug import router as debug_router
 from presign import router as presign_router
 
-app = FastAPI(title="Kizen Demo API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await db.open_pool()
+    await fetch.open_client()
+    await asyncio.to_thread(get_scorer)   # load a local reranking model before the first chat
+    vacuum = asyncio.create_task(db.tombstone_vacuum_loop()) if VACUUM_INTERVAL_S > 0 else None
+    # without the listener corpus generations are unknown and the retrieval cache stays bypassed
+    listener = asyncio.create_task(db.corpus_listener_loop()) if RETRIEVAL_CACHE_MAX_ENTRIES > 0 else None
+    if metrics.cloudwatch is not None:
+        metrics.cloudwatch.start()
+    try:
+        yield
+    finally:
+        if vacuum is not None:
+            vacuum.cancel()
+        if listener is not None:
+            listener.cancel()
+        if metrics.cloudwatch is not None:
+            await metrics.cloudwatch.stop()   # ships what is still buffered
+        await fetch.close_client()
+        await db.close_pool()
+        shutdown_chunk_pool()
+        shutdown_rerank_pool()
+
+app = FastAPI(title="Kizen Demo API", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -28,4 +63,13 @@ def health():
 
 @app.get("/api/health")
 def health_api():
-    return {"status": "ok"}
\ No newline at end of file
+    return {"status": "ok"}
+
+@app.get("/metrics")
+def metrics_endpoint():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/api/health/db")
+async def health_db():
+    status = await db.check_health()
+    return JSONResponse(status, status_code=200 if status["ok"] else 503)
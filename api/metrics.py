@@ -1,20 +1,327 @@
-import boto3
-from datetime import datetime
-from config import AWS_REGION
+# api/metrics.py
+# Process-local metrics: counters, gauges and histograms, rendered in the
+# Prometheus text format on GET /metrics (main.py). CloudWatch export is an
+# optional sink: data points are buffered and shipped in batches by a
+# background task, never on the request path.
+import asyncio
+import bisect
+import collections
+import contextlib
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from config import AWS_REGION, CLOUDWATCH_METRICS, CLOUDWATCH_FLUSH_S
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+STAGE_BUCKETS = (0.1, 0.5, 1.0, 5.0, 15.0, 60.0, 300.0, 900.0, 3600.0)
+
+CLOUDWATCH_NAMESPACE = "RAGDemo/Ingestion"
+CLOUDWATCH_BUFFER = 10_000     # data points held while CloudWatch is slow/unreachable; oldest dropped
+CLOUDWATCH_BATCH = 1000        # data points per PutMetricData call (API limit)
+
+Labels = Tuple[str, ...]
+
+
+def _fmt(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if not float(v).is_integer() else str(int(v))
+
+
+def _escape(v: str) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels: dict) -> Labels:
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def _labelstr(self, key: Labels, extra: str = "") -> str:
+        parts = [f'{n}="{_escape(v)}"' for n, v in zip(self.labelnames, key)]
+        if extra:
+            parts.append(extra)
+        return "{" + ",".join(parts) + "}" if parts else ""
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}", *self.samples()]
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, value: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + value
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{self._labelstr(k)} {_fmt(v)}" for k, v in items]
+
+
+class Gauge(_Metric):
+    """Set directly, or computed at scrape time by `callback` -> {label tuple: value}."""
+
+    kind = "gauge"
+
+    def __init__(
+        self, name: str, help: str, labelnames: Iterable[str] = (),
+        callback: Optional[Callable[[], Dict[Labels, float]]] = None,
+    ):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Labels, float] = {}
+        self.callback = callback
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = dict(self._values)
+        if self.callback is not None:
+            try:
+                values.update(self.callback())
+            except Exception as e:
+                print(f"[WARN] metric {self.name} callback failed: {e}")
+        return [f"{self.name}{self._labelstr(k)} {_fmt(v)}" for k, v in values.items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = (), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label tuple -> [per-bucket counts..., +Inf count], sum
+        self._counts: Dict[Labels, List[int]] = {}
+        self._sums: Dict[Labels, float] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._counts.get(key)
+            if counts is None:
+                counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+                self._sums[key] = 0.0
+            counts[i] += 1
+            self._sums[key] += value
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, **labels)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = [(k, list(c), self._sums[k]) for k, c in self._counts.items()]
+        out = []
+        for key, counts, total in items:
+            running = 0
+            for le, n in zip((*self.buckets, float("inf")), counts):
+                running += n
+                le_label = 'le="' + _fmt(le) + '"'
+                out.append(f"{self.name}_bucket{self._labelstr(key, le_label)} {running}")
+            out.append(f"{self.name}_sum{self._labelstr(key)} {_fmt(total)}")
+            out.append(f"{self.name}_count{self._labelstr(key)} {running}")
+        return out
+
+
+REGISTRY: List[_Metric] = []
+
+
+def render() -> str:
+    """Every registered metric in the Prometheus text exposition format (0.0.4)."""
+    return "\n".join(m.render() for m in REGISTRY) + "\n"
+
+
+# ---- the app's metrics
+EMBED_SECONDS = Histogram(
+    "embed_request_seconds", "OpenAI embeddings request latency", ["kind"],
+)
+RETRIEVAL_QUERY_SECONDS = Histogram(
+    "retrieval_query_seconds", "One retrieval statement, execute through fetch", ["generator"],
+)
+RETRIEVAL_GENERATOR_RESULTS = Counter(
+    "retrieval_generator_total", "Parallel retrieval generator outcomes: ok, timeout, error", ["generator", "status"],
+)
+RETRIEVAL_FUSION_SECONDS = Histogram(
+    "retrieval_fusion_seconds", "Reciprocal-rank fusion of candidate lists in Python",
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05),
+)
+RETRIEVAL_CACHE_REQUESTS = Counter(
+    "retrieval_cache_requests_total", "Retrieval result cache lookups by result", ["result"],
+)
+ANSWER_CACHE_REQUESTS = Counter(
+    "answer_cache_requests_total", "Semantic answer cache lookups: hit, below_threshold, no_match (snippets differ)",
+    ["result"],
+)
+ANSWER_CACHE_SIMILARITY = Histogram(
+    "answer_cache_similarity", "Best cosine to a cached question over the same snippets; tune ANSWER_CACHE_THRESHOLD",
+    ["result"], buckets=(0.5, 0.7, 0.8, 0.85, 0.9, 0.92, 0.94, 0.95, 0.96, 0.97, 0.98, 0.99, 1.0),
+)
+RERANK_SECONDS = Histogram(
+    "rerank_seconds", "Reranking the fused pool, per scorer", ["scorer"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.15, 0.25, 0.5, 1.0),
+)
+RERANK_RESULTS = Counter(
+    "rerank_total", "Rerank outcomes: ok, partial (budget hit mid-pool), timeout, error", ["scorer", "status"],
+)
+CHAT_SECONDS = Histogram(
+    "chat_seconds", "Chat request phases: retrieve, time to first token (ttft), whole stream", ["phase"],
+)
+CHAT_CONTEXT_TOKENS = Histogram(
+    "chat_context_tokens", "Tokens of retrieved context packed into each prompt",
+    buckets=(250, 500, 1000, 2000, 3000, 4000, 6000, 8000, 12000),
+)
+CHAT_REQUESTS = Counter("chat_requests_total", "Chat requests by outcome", ["status"])
+INGEST_REQUESTS = Counter("ingest_requests_total", "Ingest requests by status", ["status"])
+INGEST_STAGE_SECONDS = Histogram(
+    "ingest_stage_seconds", "Busy seconds per ingest pipeline stage, one observation per ingest", ["stage"],
+    buckets=STAGE_BUCKETS,
+)
+INGEST_ROWS = Counter("ingest_rows_total", "Chunks handled by ingests", ["result"])
+
+# live ingest queues, summed at scrape time
+_queues: Dict[str, "set"] = {"batch": set(), "sse": set()}
+
+
+def _queue_depths() -> Dict[Labels, float]:
+    return {(name,): sum(q.qsize() for q in qs) for name, qs in _queues.items()}
+
+
+def _ingests_active() -> Dict[Labels, float]:
+    return {(): len(_queues["sse"])}
+
+
+def track_queues(**queues: asyncio.Queue):
+    """Count these queues in ingest_queue_depth (track_queues(batch=q, sse=q)) until untracked."""
+    for name, q in queues.items():
+        _queues[name].add(q)
+
+
+def untrack_queues(**queues: asyncio.Queue):
+    for name, q in queues.items():
+        _queues[name].discard(q)
+
+
+INGEST_QUEUE_DEPTH = Gauge(
+    "ingest_queue_depth", "Items waiting in live ingest queues", ["queue"], callback=_queue_depths,
+)
+INGEST_ACTIVE = Gauge("ingest_active", "Ingests currently streaming", callback=_ingests_active)
+
+
+def _pool_gauge() -> Dict[Labels, float]:
+    from db import pool_stats
+
+    s = pool_stats()
+    return {(k,): s[k] for k in ("size", "available", "in_use", "waiting", "max_size") if k in s}
+
+
+DB_POOL_CONNECTIONS = Gauge(
+    "db_pool_connections", "Postgres pool connections by state", ["state"], callback=_pool_gauge,
+)
+
+
+# ---- CloudWatch sink
+class CloudWatchSink:
+    """
+    Buffers data points and ships them with PutMetricData from a background
+    task, CLOUDWATCH_BATCH at a time, every `interval` seconds. emit() never
+    blocks; if CloudWatch is unreachable the oldest points are dropped.
+    """
+
+    def __init__(self, namespace: str, interval: float, maxlen: int = CLOUDWATCH_BUFFER):
+        self.namespace = namespace
+        self.interval = interval
+        self._buf: "collections.deque[dict]" = collections.deque(maxlen=maxlen)
+        self._client = None
+        self._task: Optional[asyncio.Task] = None
+        self.sent = 0
+        self.failed = 0
+
+    def emit(self, name: str, value: float, unit: str = "Count", **dimensions):
+        self._buf.append({
+            "MetricName": name,
+            "Dimensions": [{"Name": k, "Value": str(v)} for k, v in dimensions.items()],
+            "Timestamp": datetime.now(timezone.utc),
+            "Value": value,
+            "Unit": unit,
+        })
+
+    def _put(self, batch: List[dict]):
+        if self._client is None:
+            import boto3
+
+            self._client = boto3.client("cloudwatch", region_name=AWS_REGION)
+        self._client.put_metric_data(Namespace=self.namespace, MetricData=batch)
+
+    async def flush(self):
+        while self._buf:
+            batch = [self._buf.popleft() for _ in range(min(CLOUDWATCH_BATCH, len(self._buf)))]
+            try:
+                await asyncio.to_thread(self._put, batch)
+                self.sent += len(batch)
+            except Exception as e:
+                self.failed += len(batch)
+                print(f"[WARN] CloudWatch metric flush failed ({len(batch)} points): {e}")
+                # back in front for the next flush; re-extending lets the bounded
+                # deque drop the oldest points if emits filled it meanwhile
+                newer = list(self._buf)
+                self._buf.clear()
+                self._buf.extend(batch)
+                self._buf.extend(newer)
+                return
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+        await self.flush()
+
+
+cloudwatch: Optional[CloudWatchSink] = (
+    CloudWatchSink(CLOUDWATCH_NAMESPACE, CLOUDWATCH_FLUSH_S) if CLOUDWATCH_METRICS else None
+)
 
-cloudwatch = boto3.client("cloudwatch", region_name=AWS_REGION)
 
 def push_ingest_metric(status: str):
-    try:
-        cloudwatch.put_metric_data(
-            Namespace="RAGDemo/Ingestion",
-            MetricData=[{
-                "MetricName": "IngestionCount",
-                "Dimensions": [{"Name": "Status", "Value": status}],
-                "Timestamp": datetime.utcnow(),
-                "Value": 1,
-                "Unit": "Count"
-            }]
-        )
-    except Exception as e:
-        print(f"[WARN] CloudWatch metric failed: {e}")
+    """IngestionCount{Status} in CloudWatch (batched, when enabled) and ingest_requests_total locally."""
+    INGEST_REQUESTS.inc(status=status)
+    if cloudwatch is not None:
+        cloudwatch.emit("IngestionCount", 1, "Count", Status=status)
@@ -0,0 +1,185 @@
+# api/partitions.py
+# Opt-in tenant-partitioned layout for `documents`: LIST partitions, one per
+# tenant, each with its own ANN index, so a tenant's vector search never
+# walks other tenants' lists. The app detects the layout at runtime; switch
+# an existing database with:
+#
+#     python partitions.py migrate [--drop-old]
+#     python partitions.py list
+import argparse
+import asyncio
+import hashlib
+from typing import Optional
+
+from psycopg import sql
+
+from indexes import create_ann_index
+
+# tenants whose partition is known to exist (per process)
+_known: set = set()
+
+
+def partition_name(tenant_id: str) -> str:
+    # tenant ids are arbitrary strings; identifiers are not
+    return "documents_t_" + hashlib.md5(tenant_id.encode("utf-8")).hexdigest()[:16]
+
+
+async def is_partitioned(conn) -> bool:
+    cur = await conn.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('documents')")
+    row = await cur.fetchone()
+    return bool(row) and row[0] == "p"
+
+
+async def _has_extension(conn, name: str) -> bool:
+    cur = await conn.execute("SELECT 1 FROM pg_extension WHERE extname = %s", (name,))
+    return await cur.fetchone() is not None
+
+
+async def _has_column(conn, column: str, table: str = "documents") -> bool:
+    cur = await conn.execute(
+        "SELECT 1 FROM information_schema.columns "
+        "WHERE table_schema = current_schema() AND table_name = %s AND column_name = %s",
+        (table, column),
+    )
+    return await cur.fetchone() is not None
+
+
+async def create_partition(conn, tenant_id: str, parent: str = "documents", ann: bool = True) -> str:
+    """
+    Partition for one tenant plus its ANN index (hnsw by default: it needs
+    no training rows, and the partition starts empty). Other indexes come
+    from the parent.
+    """
+    name = partition_name(tenant_id)
+    await conn.execute(
+        sql.SQL("CREATE TABLE IF NOT EXISTS {} PARTITION OF {} FOR VALUES IN ({})")
+        .format(sql.Identifier(name), sql.Identifier(parent), sql.Literal(tenant_id))
+    )
+    if ann:
+        await create_ann_index(conn, name)
+    return name
+
+
+async def ensure_tenant_partition(conn, tenant_id: str) -> Optional[str]:
+    """
+    Create the tenant's partition on first ingest (no-op for the shared
+    layout). Returns the name of a partition created now, else None.
+    Commits, so the DDL doesn't hold locks for the rest of the ingest.
+    """
+    if tenant_id in _known:
+        return None
+    if not await is_partitioned(conn):
+        return None
+    name = partition_name(tenant_id)
+    created = None
+    cur = await conn.execute("SELECT to_regclass(%s)", (name,))
+    if (await cur.fetchone())[0] is None:
+        # concurrent first ingests for one tenant: one creates, the other waits and no-ops
+        await conn.execute("SELECT pg_advisory_xact_lock(hashtext('documents_partition'), hashtext(%s))", (tenant_id,))
+        await create_partition(conn, tenant_id)
+        created = name
+    await conn.commit()
+    _known.add(tenant_id)
+    return created
+
+
+async def migrate(conn, drop_old: bool = False):
+    """
+    Rebuild `documents` as a LIST-partitioned table, one partition per
+    existing tenant, in one transaction. Writes are blocked while rows are
+    copied (SHARE lock); reads keep hitting the old table until the rename
+    commits. The old table is kept as documents_unpartitioned unless drop_old.
+    """
+    if await is_partitioned(conn):
+        print("documents is already partitioned")
+        return
+    await conn.execute("LOCK TABLE documents IN SHARE MODE")
+    await conn.execute(
+        "CREATE TABLE documents_partitioned (LIKE documents INCLUDING DEFAULTS INCLUDING GENERATED) "
+        "PARTITION BY LIST (tenant_id)"
+    )
+    # indexes on the parent cascade to every partition; the primary key must include the partition key
+    await conn.execute("ALTER TABLE documents_partitioned ADD PRIMARY KEY (tenant_id, id)")
+    await conn.execute(
+        "CREATE UNIQUE INDEX documents_part_tenant_content_hash ON documents_partitioned "
+        "(tenant_id, content_hash) WHERE content_hash IS NOT NULL"
+    )
+    await conn.execute(
+        "CREATE INDEX documents_part_tenant_source ON documents_partitioned "
+        "(tenant_id, source_url) WHERE deleted_at IS NULL"
+    )
+    await conn.execute(
+        "CREATE INDEX documents_part_deleted_at ON documents_partitioned (deleted_at) WHERE deleted_at IS NOT NULL"
+    )
+    if await _has_column(conn, "content_tsv"):
+        await conn.execute("CREATE INDEX documents_part_content_tsv ON documents_partitioned USING gin (content_tsv)")
+    if await _has_extension(conn, "pg_trgm"):
+        await conn.execute(
+            "CREATE INDEX documents_part_content_trgm ON documents_partitioned USING gin (content gin_trgm_ops)"
+        )
+
+    cur = await conn.execute("SELECT tenant_id, count(*) FROM documents GROUP BY tenant_id ORDER BY tenant_id")
+    tenants = await cur.fetchall()
+    # generated columns (content_tsv) are recomputed on insert, not copied
+    cur = await conn.execute(
+        "SELECT string_agg(quote_ident(column_name), ', ' ORDER BY ordinal_position) FROM information_schema.columns "
+        "WHERE table_schema = current_schema() AND table_name = 'documents' AND is_generated = 'NEVER'"
+    )
+    columns = sql.SQL((await cur.fetchone())[0])
+    for tenant_id, n in tenants:
+        name = await create_partition(conn, tenant_id, parent="documents_partitioned", ann=False)
+        await conn.execute(
+            sql.SQL("INSERT INTO {} ({}) SELECT {} FROM documents WHERE tenant_id = %s").format(
+                sql.Identifier(name), columns, columns,
+            ),
+            (tenant_id,),
+        )
+        # build the ANN index after the copy: faster, and ivfflat trains on real rows
+        await create_ann_index(conn, name)
+        print(f"  {tenant_id}: {n} rows -> {name}")
+
+    await conn.execute("ALTER TABLE documents RENAME TO documents_unpartitioned")
+    await conn.execute("ALTER TABLE documents_partitioned RENAME TO documents")
+    await conn.execute("ALTER SEQUENCE documents_id_seq OWNED BY documents.id")
+    if drop_old:
+        await conn.execute("DROP TABLE documents_unpartitioned")
+    await conn.commit()
+    _known.clear()
+    print(f"partitioned documents: {len(tenants)} tenants")
+
+
+async def list_partitions(conn) -> list:
+    cur = await conn.execute(
+        """
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid), c.reltuples::bigint,
+               pg_total_relation_size(c.oid)
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass('documents')
+        ORDER BY c.relname
+        """
+    )
+    return await cur.fetchall()
+
+
+async def _main(argv=None):
+    from psycopg import AsyncConnection
+    from psycopg.conninfo import make_conninfo
+    from db import DB_CONN
+
+    ap = argparse.ArgumentParser(description="Tenant-partitioned layout for documents")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    m = sub.add_parser("migrate", help="convert documents to one LIST partition per tenant")
+    m.add_argument("--drop-old", action="store_true", help="drop the unpartitioned table afterwards")
+    sub.add_parser("list", help="show partitions with row estimates and sizes")
+    args = ap.parse_args(argv)
+
+    async with await AsyncConnection.connect(make_conninfo(**DB_CONN)) as conn:
+        if args.cmd == "migrate":
+            await migrate(conn, drop_old=args.drop_old)
+        else:
+            for name, bound, rows, size in await list_partitions(conn):
+                print(f"{name}  {bound}  ~{rows} rows  {size // 1024} KiB")
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
@@ -0,0 +1,233 @@
+"""
+Optional reranking between fusion and context packing.
+
+With RERANKER set, retrieval fuses a larger pool (RERANK_POOL) and a CPU-only
+scorer reorders it before the top RERANK_TOP_K go to the prompt. The final
+score blends the scorer's (min-max normalized over the pool) with the fused
+RRF score, RERANK_FUSED_WEIGHT for the latter, so lexical evidence isn't
+thrown away. Scorers:
+
+  cosine  each candidate's stored embedding vs the query's, computed by
+          Postgres for the pool's ids (no vectors leave the database)
+  onnx    a local cross-encoder (RERANK_ONNX_MODEL + RERANK_ONNX_TOKENIZER;
+          needs onnxruntime and tokenizers), RERANK_BATCH (question, chunk)
+          pairs at a time in a RERANK_THREADS pool
+
+register_scorer() plugs in others. Content scorers get RERANK_BUDGET_MS:
+batches that haven't finished by then are left unscored and fall back to
+their fused score alone; a scorer that fails leaves the fused order.
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from config import (
+    RERANKER,
+    RERANK_BUDGET_MS,
+    RERANK_FUSED_WEIGHT,
+    RERANK_THREADS,
+    RERANK_BATCH,
+    RERANK_ONNX_MODEL,
+    RERANK_ONNX_TOKENIZER,
+    RERANK_MAX_LENGTH,
+)
+from metrics import RERANK_RESULTS, RERANK_SECONDS
+
+
+class Scorer:
+    """
+    A CPU-only relevance scorer; higher is more relevant. `inputs` is what
+    score() gets for the candidates, in order:
+      "similarity"  cosine of the stored embedding to the query (None where missing)
+      "content"     the chunk texts; called from the rerank thread pool
+    """
+
+    name = ""
+    inputs = "content"
+
+    def score(self, q: str, values: list) -> np.ndarray:
+        raise NotImplementedError
+
+
+class CosineScorer(Scorer):
+    name = "cosine"
+    inputs = "similarity"
+
+    def score(self, q: str, values: list) -> np.ndarray:
+        return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+
+
+class OnnxCrossEncoder(Scorer):
+    """A cross-encoder exported to ONNX (e.g. ms-marco-MiniLM-L-6-v2) and its tokenizer.json."""
+
+    name = "onnx"
+    inputs = "content"
+
+    def __init__(
+        self,
+        model_path: str = RERANK_ONNX_MODEL,
+        tokenizer_path: str = RERANK_ONNX_TOKENIZER,
+        max_length: int = RERANK_MAX_LENGTH,
+    ):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        if not model_path or not tokenizer_path:
+            raise ValueError("RERANK_ONNX_MODEL and RERANK_ONNX_TOKENIZER must both be set")
+        opts = ort.SessionOptions()
+        opts.intra_op_num_threads = 1   # parallelism comes from the rerank thread pool
+        self._session = ort.InferenceSession(model_path, opts, providers=["CPUExecutionProvider"])
+        self._inputs = {i.name for i in self._session.get_inputs()}
+        self._tok = Tokenizer.from_file(tokenizer_path)
+        self._tok.enable_truncation(max_length=max_length)
+        self._tok.enable_padding()
+
+    def score(self, q: str, values: list) -> np.ndarray:
+        enc = self._tok.encode_batch([(q, text) for text in values])
+        feeds = {
+            "input_ids": np.array([e.ids for e in enc], dtype=np.int64),
+            "attention_mask": np.array([e.attention_mask for e in enc], dtype=np.int64),
+        }
+        if "token_type_ids" in self._inputs:
+            feeds["token_type_ids"] = np.array([e.type_ids for e in enc], dtype=np.int64)
+        logits = self._session.run(None, feeds)[0]
+        # one relevance logit, or (irrelevant, relevant)
+        return logits.reshape(len(values), -1)[:, -1].astype(np.float64)
+
+
+SCORERS: Dict[str, Callable[[], Scorer]] = {"cosine": CosineScorer, "onnx": OnnxCrossEncoder}
+
+_scorer: Optional[Scorer] = None
+_failed = False
+_pool: Optional[ThreadPoolExecutor] = None
+
+
+def register_scorer(name: str, factory: Callable[[], Scorer]):
+    """Make RERANKER=<name> build `factory()`."""
+    SCORERS[name] = factory
+
+
+def get_scorer() -> Optional[Scorer]:
+    """The configured scorer, built on first use; None when RERANKER is unset or it can't be built."""
+    global _scorer, _failed
+    if not RERANKER or _failed:
+        return None
+    if _scorer is None or _scorer.name != RERANKER:
+        try:
+            _scorer = SCORERS[RERANKER]()
+            _scorer.name = RERANKER
+        except Exception as e:
+            _failed = True
+            print(f"[WARN] reranker {RERANKER!r} unavailable, using fused order: {e}")
+            return None
+    return _scorer
+
+
+def get_rerank_pool() -> ThreadPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max(RERANK_THREADS, 1), thread_name_prefix="rerank")
+    return _pool
+
+
+def shutdown_rerank_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def _minmax(x: np.ndarray) -> np.ndarray:
+    if x.size == 0:
+        return x
+    span = x.max() - x.min()
+    return (x - x.min()) / span if span > 0 else np.zeros_like(x)
+
+
+async def _similarities(cur, tenant_id: str, q_vec, ids: List[int]) -> Dict[int, float]:
+    # a primary-key lookup of the pool's rows; cheap enough that it isn't cut short
+    await cur.execute(
+        """
+        SELECT id, 1 - (embedding <=> %s::vector)
+        FROM documents
+        WHERE tenant_id = %s AND id = ANY(%s) AND deleted_at IS NULL AND embedding IS NOT NULL
+        """,
+        (q_vec, tenant_id, ids),
+    )
+    return {rid: float(sim) for rid, sim in await cur.fetchall()}
+
+
+async def _score_content(scorer: Scorer, q: str, texts: List[str], deadline: float) -> np.ndarray:
+    """Batches in the thread pool, best fused first; whatever isn't done by `deadline` stays NaN."""
+    loop = asyncio.get_running_loop()
+    scores = np.full(len(texts), np.nan)
+    futures = {
+        loop.run_in_executor(get_rerank_pool(), scorer.score, q, texts[i:i + RERANK_BATCH]): i
+        for i in range(0, len(texts), RERANK_BATCH)
+    }
+    done, pending = await asyncio.wait(futures, timeout=max(deadline - time.perf_counter(), 0.0))
+    for fut in pending:
+        fut.cancel()   # not started yet: skipped; running: finishes in its thread, result ignored
+    for fut in done:
+        if fut.exception() is not None:
+            print(f"[WARN] rerank batch failed: {fut.exception()}")
+            continue
+        i = futures[fut]
+        batch = fut.result()
+        scores[i:i + len(batch)] = batch
+    return scores
+
+
+async def rerank(
+    cur,
+    tenant_id: str,
+    q: str,
+    q_vec,
+    candidates: List[Dict],
+    top_k: int,
+    budget_ms: float = RERANK_BUDGET_MS,
+) -> Tuple[List[Dict], dict]:
+    """
+    Reorder fused candidates ({"id", "score", and "content" for content
+    scorers}) and keep the best `top_k`; "score" becomes the blended score.
+    Returns them and stats: status (ok|partial|timeout|error|off), hits
+    (candidates scored), ms.
+    """
+    scorer = get_scorer()
+    if scorer is None or len(candidates) < 2:
+        return candidates[:top_k], {"status": "off", "hits": 0, "ms": 0.0}
+
+    t0 = time.perf_counter()
+    status = "ok"
+    try:
+        if scorer.inputs == "similarity":
+            if q_vec is None:
+                raise ValueError("no query embedding")
+            sims = await _similarities(cur, tenant_id, q_vec, [c["id"] for c in candidates])
+            scores = scorer.score(q, [sims.get(c["id"]) for c in candidates])
+        else:
+            scores = await _score_content(
+                scorer, q, [c.get("content") or "" for c in candidates], t0 + budget_ms / 1000,
+            )
+    except Exception as e:
+        print(f"[WARN] rerank ({scorer.name}) failed, using fused order: {e}")
+        scores, status = np.full(len(candidates), np.nan), "error"
+
+    scored = ~np.isnan(scores)
+    if status == "ok" and not scored.all():
+        status = "partial" if scored.any() else "timeout"
+    ms = (time.perf_counter() - t0) * 1000
+    RERANK_SECONDS.observe(ms / 1000, scorer=scorer.name)
+    RERANK_RESULTS.inc(scorer=scorer.name, status=status)
+    stats = {"status": status, "hits": int(scored.sum()), "ms": round(ms, 1)}
+    if not scored.any():
+        return candidates[:top_k], stats
+
+    # unscored candidates compete on their fused share alone
+    blended = RERANK_FUSED_WEIGHT * _minmax(np.array([c["score"] for c in candidates], dtype=np.float64))
+    blended[scored] += (1 - RERANK_FUSED_WEIGHT) * _minmax(scores[scored])
+    order = np.argsort(-blended, kind="stable")[:top_k]
+    return [{**candidates[i], "score": float(blended[i])} for i in order], stats
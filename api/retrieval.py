@@ -0,0 +1,370 @@
+import asyncio
+import re
+import time
+from typing import Dict, List, Optional, Tuple
+
+from config import (
+    RETRIEVAL_MODE, RETRIEVAL_GENERATOR_TIMEOUT_S, RETRIEVAL_ILIKE, RERANK_POOL,
+    TRIGRAM_LIMIT, DENSE_LIMIT, FTS_LIMIT, ILIKE_LIMIT, RRF_K, TOP_K,
+)
+from db import connection, to_db_vector
+from indexes import apply_search_profile
+from metrics import RETRIEVAL_FUSION_SECONDS, RETRIEVAL_GENERATOR_RESULTS, RETRIEVAL_QUERY_SECONDS
+from rerank import get_scorer, rerank
+
+FTS_CONFIG = "english"   # must match documents.content_tsv (docker/postgres/init/004_fts.sql)
+
+
+def rr_fusion_many(results_lists, k: int = 40):
+    scores = {}
+    for results in results_lists:
+        for rank, row in enumerate(results, start=1):
+            rid = row[0]
+            scores[rid] = scores.get(rid, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda x: x[1], reverse=True)
+
+
+def numeric_like_query(q: str) -> str:
+    # numeric-aware LIKE variant (helps for pricing queries)
+    s = re.sub(r"[^0-9a-zA-Z %$]", " ", q or "")
+    return re.sub(r"\s+", " ", s).strip()
+
+
+async def retrieve(cur, tenant_id: str, q: str, q_vec, top_k: int = TOP_K) -> List[Dict]:
+    """Hybrid retrieval (trigram + dense + full text), fused with RRF.
+
+    Returns [{"id", "content", "source_url", "score": RRF score}] in fused order. RETRIEVAL_MODE picks
+    between one server-side statement ("fused") and one query per generator
+    with fusion in Python ("multi"); "parallel" doesn't go through here, see
+    retrieve_parallel(). With a reranker configured the top RERANK_POOL are
+    fused instead, and the best `top_k` of those after reranking (blended
+    score) come back.
+    """
+    if RETRIEVAL_MODE == "multi":
+        return await retrieve_multi(cur, tenant_id, q, q_vec, top_k)
+    return await retrieve_fused(cur, tenant_id, q, q_vec, top_k)
+
+
+def _fts_any_query(q_param: str) -> str:
+    """
+    SQL for a tsquery matching any of the question's lexemes (`q_param` is its
+    placeholder): an OR of what to_tsvector makes of it, with the same parser
+    and dictionaries as content_tsv; NULL, which matches nothing, when the
+    question is all stop words. quote_literal is safe on these lexemes: the
+    default parser never leaves a backslash (its E'' form) in one.
+    """
+    return (
+        "CAST((SELECT string_agg(quote_literal(lexeme), ' | ') "
+        f"FROM unnest(to_tsvector('{FTS_CONFIG}', {q_param}))) AS tsquery)"
+    )
+
+
+# One statement per candidate generator, returning ids and scores only;
+# content is fetched afterwards for the fused top-k alone. "multi" runs them
+# in turn on one cursor, "parallel" each on its own pooled connection.
+_GENERATOR_SQL = {
+    # trigram word similarity; `<%` (cutoff: pg_trgm.word_similarity_threshold,
+    # set per session by db.SESSION_OPTIONS) is what lets the GIN index filter
+    "trigram": """
+        SELECT id, word_similarity(%s, content) AS score
+        FROM documents
+        WHERE tenant_id = %s AND deleted_at IS NULL AND %s <%% content
+        ORDER BY score DESC
+        LIMIT %s
+    """,
+    # dense ANN
+    "dense": """
+        SELECT id, embedding <-> %s::vector AS dist
+        FROM documents
+        WHERE tenant_id = %s AND deleted_at IS NULL
+        ORDER BY dist
+        LIMIT %s
+    """,
+    # full text: any of the question's lexemes, ranked by cover density
+    # normalized for document length
+    "fts": f"""
+        SELECT id, ts_rank_cd(content_tsv, query, 1) AS score
+        FROM documents, {_fts_any_query("%s")} query
+        WHERE tenant_id = %s AND deleted_at IS NULL AND content_tsv @@ query
+        ORDER BY score DESC
+        LIMIT %s
+    """,
+    # ILIKE exact-ish (RETRIEVAL_ILIKE; a scan of the tenant's rows for most questions)
+    "ilike": """
+        SELECT id
+        FROM documents
+        WHERE tenant_id = %s AND deleted_at IS NULL AND content ILIKE %s
+        LIMIT %s
+    """,
+    # numeric-aware ILIKE
+    "ilike_numeric": """
+        SELECT id
+        FROM documents
+        WHERE tenant_id = %s AND deleted_at IS NULL AND content ILIKE %s
+        LIMIT %s
+    """,
+}
+GENERATORS = ("trigram", "dense", "fts", *(("ilike", "ilike_numeric") if RETRIEVAL_ILIKE else ()))
+LEXICAL_GENERATORS = tuple(name for name in GENERATORS if name != "dense")   # don't need the query embedding
+
+_CONTENT_SQL = """
+    SELECT id, content, source_url
+    FROM documents
+    WHERE tenant_id = %s AND id = ANY(%s) AND deleted_at IS NULL
+"""
+
+
+def _generator_params(name: str, tenant_id: str, q: str, q_vec=None) -> tuple:
+    if name == "trigram":
+        return q, tenant_id, q, TRIGRAM_LIMIT
+    if name == "dense":
+        return q_vec, tenant_id, DENSE_LIMIT
+    if name == "fts":
+        return q, tenant_id, FTS_LIMIT
+    if name == "ilike":
+        return tenant_id, f"%{q.strip()}%", ILIKE_LIMIT
+    return tenant_id, f"%{numeric_like_query(q)}%", ILIKE_LIMIT
+
+
+def _fuse(hit_lists: List[list], top_k: int) -> List[Dict]:
+    with RETRIEVAL_FUSION_SECONDS.time():
+        return [{"id": rid, "score": score} for rid, score in rr_fusion_many(hit_lists, k=RRF_K)[:top_k]]
+
+
+def _pool_size(top_k: int) -> int:
+    """How many fused candidates to keep: the reranker's pool, or just the top-k."""
+    return max(RERANK_POOL, top_k) if get_scorer() is not None else top_k
+
+
+async def _with_content(cur, tenant_id: str, fused: List[Dict]) -> List[Dict]:
+    """One `id = ANY(...)` round trip for the fused top-k, back in fused order."""
+    if not fused:
+        return []
+    with RETRIEVAL_QUERY_SECONDS.time(generator="content"):
+        await cur.execute(_CONTENT_SQL, (tenant_id, [c["id"] for c in fused]))
+        rows = {rid: (text, source) for rid, text, source in await cur.fetchall()}
+    # a chunk tombstoned or purged between the two statements is simply dropped
+    return [
+        {**c, "content": rows[c["id"]][0], "source_url": rows[c["id"]][1]}
+        for c in fused if c["id"] in rows
+    ]
+
+
+async def _reranked(cur, tenant_id: str, q: str, q_vec, fused: List[Dict], top_k: int) -> Tuple[List[Dict], dict]:
+    """
+    The best `top_k` of the fused pool, with content: reranked when a scorer
+    is configured (fetching content for the whole pool first if it scores
+    text), otherwise in fused order. Also returns the rerank stats.
+    """
+    scorer = get_scorer()
+    if scorer is not None and scorer.inputs == "content" and fused and "content" not in fused[0]:
+        fused = await _with_content(cur, tenant_id, fused)
+    ranked, stats = await rerank(cur, tenant_id, q, q_vec, fused, top_k)
+    if ranked and "content" not in ranked[0]:
+        ranked = await _with_content(cur, tenant_id, ranked)
+    return ranked, stats
+
+
+async def retrieve_multi(cur, tenant_id: str, q: str, q_vec, top_k: int = TOP_K) -> List[Dict]:
+    hit_lists = []
+    for name in GENERATORS:
+        with RETRIEVAL_QUERY_SECONDS.time(generator=name):
+            await cur.execute(_GENERATOR_SQL[name], _generator_params(name, tenant_id, q, q_vec))
+            hit_lists.append(await cur.fetchall())
+    snippets, _ = await _reranked(cur, tenant_id, q, q_vec, _fuse(hit_lists, _pool_size(top_k)), top_k)
+    return snippets
+
+
+async def _run_generator(
+    name: str, tenant_id: str, q: str, q_emb, profile: Optional[str], timeout: float,
+) -> list:
+    async def query(cur, q_vec) -> list:
+        await cur.execute(_GENERATOR_SQL[name], _generator_params(name, tenant_id, q, q_vec))
+        return await cur.fetchall()
+
+    q_vec = None
+    # the pool wait (bounded by DB_POOL_TIMEOUT) isn't part of `timeout`: a busy
+    # pool shouldn't turn into a generator that timed out
+    async with connection() as conn, conn.cursor() as cur:
+        if name == "dense":
+            await apply_search_profile(conn, tenant_id, profile)
+            q_vec = to_db_vector(q_emb)
+        with RETRIEVAL_QUERY_SECONDS.time(generator=name):
+            return await asyncio.wait_for(query(cur, q_vec), timeout)
+
+
+async def retrieve_parallel(
+    tenant_id: str,
+    q: str,
+    q_emb: "asyncio.Future[List[float]]",
+    profile: Optional[str] = None,
+    top_k: int = TOP_K,
+    timeout: float = RETRIEVAL_GENERATOR_TIMEOUT_S,
+) -> Tuple[List[Dict], Dict[str, dict]]:
+    """
+    Every generator as its own task on its own pooled connection. The
+    lexical ones start at once, while `q_emb` (the query embedding, already
+    in flight) resolves; dense starts when the vector arrives. Each
+    statement gets `timeout` seconds once it has a connection, and fusion
+    runs on whatever came back; then one more
+    statement fetches content for the fused top-k (after reranking the
+    pool, if configured). Returns the snippets and per-stage stats: status
+    (ok|timeout|error, also partial for rerank), hits, ms.
+    """
+    stats: Dict[str, dict] = {}
+
+    async def run(name: str) -> list:
+        vec = None
+        if name == "dense":
+            try:
+                vec = await asyncio.shield(q_emb)
+            except Exception as e:
+                stats[name] = {"status": "error", "hits": 0, "ms": 0.0}
+                RETRIEVAL_GENERATOR_RESULTS.inc(generator=name, status="error")
+                print(f"[WARN] dense retrieval skipped, query embedding failed: {e}")
+                return []
+        t0 = time.perf_counter()
+        try:
+            hits = await _run_generator(name, tenant_id, q, vec, profile, timeout)
+            status = "ok"
+        except asyncio.TimeoutError:
+            hits, status = [], "timeout"
+        except Exception as e:
+            hits, status = [], "error"
+            print(f"[WARN] {name} retrieval failed: {e}")
+        stats[name] = {"status": status, "hits": len(hits), "ms": round((time.perf_counter() - t0) * 1000, 1)}
+        RETRIEVAL_GENERATOR_RESULTS.inc(generator=name, status=status)
+        return hits
+
+    names = (*LEXICAL_GENERATORS, "dense")
+    hit_lists = await asyncio.gather(*(run(name) for name in names))
+    fused = _fuse(list(hit_lists), _pool_size(top_k))
+    q_vec = None
+    if q_emb.done() and not q_emb.cancelled() and q_emb.exception() is None:
+        q_vec = to_db_vector(q_emb.result())
+
+    t0 = time.perf_counter()
+    snippets, rerank_stats = [], {}
+    if fused:
+        async with connection() as conn, conn.cursor() as cur:
+            snippets, rerank_stats = await _reranked(cur, tenant_id, q, q_vec, fused, top_k)
+    ms = (time.perf_counter() - t0) * 1000
+    if rerank_stats.get("status", "off") != "off":
+        stats["rerank"] = rerank_stats
+        ms -= rerank_stats["ms"]
+    stats["content"] = {"status": "ok", "hits": len(snippets), "ms": round(ms, 1)}
+    return snippets, {name: stats[name] for name in (*names, "rerank", "content") if name in stats}
+
+
+def format_stats(stats: Dict[str, dict]) -> str:
+    """X-Retrieval-Stats value: `trigram=ok:15:3.2ms,dense=timeout:0:2000.1ms,...`."""
+    return ",".join(f"{name}={s['status']}:{s['hits']}:{s['ms']}ms" for name, s in stats.items())
+
+
+# Each generator ranks its own capped candidate set (the inner ORDER BY/LIMIT
+# keeps index use); ranks are unioned and fused with RRF in the same statement,
+# and only the fused top-k (rerank pool) rows come back with content. The ILIKE CTEs get
+# LIMIT 0 unless RETRIEVAL_ILIKE, and a zero limit never runs its scan.
+_FUSED_CTES = f"""
+WITH trigram AS (
+    SELECT id, row_number() OVER (ORDER BY sim DESC) AS rnk
+    FROM (
+        SELECT id, word_similarity(%(q)s, content) AS sim
+        FROM documents
+        WHERE tenant_id = %(tenant_id)s AND deleted_at IS NULL AND %(q)s <%% content
+        ORDER BY sim DESC
+        LIMIT %(trigram_limit)s
+    ) t
+),
+dense AS (
+    SELECT id, row_number() OVER (ORDER BY dist) AS rnk
+    FROM (
+        SELECT id, embedding <-> %(q_vec)s::vector AS dist
+        FROM documents
+        WHERE tenant_id = %(tenant_id)s AND deleted_at IS NULL
+        ORDER BY dist
+        LIMIT %(dense_limit)s
+    ) t
+),
+fts AS (
+    SELECT id, row_number() OVER (ORDER BY rank DESC) AS rnk
+    FROM (
+        SELECT id, ts_rank_cd(content_tsv, query, 1) AS rank
+        FROM documents, {_fts_any_query("%(q)s")} query
+        WHERE tenant_id = %(tenant_id)s AND deleted_at IS NULL AND content_tsv @@ query
+        ORDER BY rank DESC
+        LIMIT %(fts_limit)s
+    ) t
+),
+like_exact AS (
+    SELECT id, row_number() OVER () AS rnk
+    FROM (
+        SELECT id FROM documents
+        WHERE tenant_id = %(tenant_id)s AND deleted_at IS NULL AND content ILIKE %(like_q)s
+        LIMIT %(ilike_limit)s
+    ) t
+),
+like_numeric AS (
+    SELECT id, row_number() OVER () AS rnk
+    FROM (
+        SELECT id FROM documents
+        WHERE tenant_id = %(tenant_id)s AND deleted_at IS NULL AND content ILIKE %(like_num_q)s
+        LIMIT %(ilike_limit)s
+    ) t
+),
+fused AS (
+    SELECT id, sum(1.0 / (%(rrf_k)s + rnk)) AS score, min(rnk) AS best
+    FROM (
+        SELECT id, rnk FROM trigram
+        UNION ALL SELECT id, rnk FROM dense
+        UNION ALL SELECT id, rnk FROM fts
+        UNION ALL SELECT id, rnk FROM like_exact
+        UNION ALL SELECT id, rnk FROM like_numeric
+    ) c
+    GROUP BY id
+    ORDER BY score DESC, best
+    LIMIT %(top_k)s
+)
+"""
+_FUSED_SQL = _FUSED_CTES + """
+SELECT d.id, d.content, d.source_url, f.score
+FROM fused f
+JOIN documents d ON d.id = f.id AND d.tenant_id = %(tenant_id)s AND d.deleted_at IS NULL
+ORDER BY f.score DESC, f.best
+"""
+# a scorer that doesn't read text only needs the pool's ids; content follows for the reranked top-k
+_FUSED_IDS_SQL = _FUSED_CTES + """
+SELECT id, score FROM fused ORDER BY score DESC, best
+"""
+
+
+async def retrieve_fused(cur, tenant_id: str, q: str, q_vec, top_k: int = TOP_K) -> List[Dict]:
+    scorer = get_scorer()
+    with_content = scorer is None or scorer.inputs == "content"
+    with RETRIEVAL_QUERY_SECONDS.time(generator="fused"):
+        await cur.execute(
+            _FUSED_SQL if with_content else _FUSED_IDS_SQL,
+            {
+                "tenant_id": tenant_id,
+                "q": q,
+                "q_vec": q_vec,
+                "like_q": f"%{q.strip()}%",
+                "like_num_q": f"%{numeric_like_query(q)}%",
+                "trigram_limit": TRIGRAM_LIMIT,
+                "dense_limit": DENSE_LIMIT,
+                "fts_limit": FTS_LIMIT,
+                "ilike_limit": ILIKE_LIMIT if RETRIEVAL_ILIKE else 0,
+                "rrf_k": RRF_K,
+                "top_k": _pool_size(top_k),
+            },
+        )
+        rows = await cur.fetchall()
+    if with_content:
+        fused = [
+            {"id": rid, "content": text, "source_url": source, "score": float(score)}
+            for rid, text, source, score in rows
+        ]
+    else:
+        fused = [{"id": rid, "score": float(score)} for rid, score in rows]
+    snippets, _ = await _reranked(cur, tenant_id, q, q_vec, fused, top_k)
+    return snippets
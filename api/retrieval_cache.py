@@ -0,0 +1,142 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from config import EMBED_MODEL, RETRIEVAL_CACHE_MAX_ENTRIES, RETRIEVAL_CACHE_TTL, RETRIEVAL_CACHE_SWR
+from db import corpus_generation
+from metrics import RETRIEVAL_CACHE_REQUESTS
+from utils import content_hash
+
+Snippets = List[Dict]
+
+
+class RetrievalCache:
+    """
+    Fused retrieval results (snippet ids and content) keyed on tenant, the
+    tenant's corpus generation, the retrieval variant (profile, mode, top_k)
+    and the normalized query. A hit costs no embedding call and no DB work.
+
+    An ingest bumps the generation, so results from before it are never
+    served; while generations can't be trusted (corpus listener down) every
+    call goes straight to `fetch`. Within a generation, entries are fresh
+    for `ttl`; with `swr` > 0 they are served for that much longer while
+    one background fetch refreshes them. LRU-bounded by entry count;
+    concurrent misses for the same key share one fetch. A fetch whose
+    `keep()` says False (a degraded result) is returned but not stored.
+    """
+
+    def __init__(self, max_entries: int, ttl: float, swr: float = 0.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.swr = swr
+        self._lru: "OrderedDict[tuple, tuple[float, Snippets]]" = OrderedDict()
+        self._inflight: Dict[tuple, asyncio.Task] = {}
+        self._refreshing: Dict[tuple, asyncio.Task] = {}
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.evictions = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "evictions": self.evictions,
+            "hit_rate": round((self.hits + self.stale_hits) / lookups, 3) if lookups else 0.0,
+            "entries": len(self._lru),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "swr": self.swr,
+        }
+
+    def _count(self, result: str):
+        setattr(self, result, getattr(self, result) + 1)
+        RETRIEVAL_CACHE_REQUESTS.inc(result=result)
+
+    def _put(self, key: tuple, snippets: Snippets):
+        self._lru[key] = (time.monotonic(), snippets)
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
+            self.evictions += 1
+
+    async def _fetch_and_store(
+        self, key: tuple, tenant_id: str, fetch: Callable[[], Awaitable[Snippets]], keep: Optional[Callable[[], bool]],
+    ) -> Snippets:
+        snippets = await fetch()
+        # a result fetched across an ingest belongs to no generation; don't keep it
+        if corpus_generation(tenant_id) == key[1] and (keep is None or keep()):
+            self._put(key, snippets)
+        return snippets
+
+    def _refresh(
+        self, key: tuple, tenant_id: str, fetch: Callable[[], Awaitable[Snippets]], keep: Optional[Callable[[], bool]],
+    ):
+        if key in self._refreshing:
+            return
+
+        async def run():
+            try:
+                await self._fetch_and_store(key, tenant_id, fetch, keep)
+            except Exception as e:
+                print(f"[WARN] retrieval cache refresh failed: {e}")
+            finally:
+                self._refreshing.pop(key, None)
+
+        self._refreshing[key] = asyncio.create_task(run())
+
+    async def get_or_retrieve(
+        self,
+        tenant_id: str,
+        q: str,
+        variant: tuple,
+        fetch: Callable[[], Awaitable[Snippets]],
+        keep: Optional[Callable[[], bool]] = None,
+    ) -> Snippets:
+        generation = corpus_generation(tenant_id)
+        if self.max_entries <= 0 or generation is None:
+            self._count("bypassed")
+            return await fetch()
+
+        key = (tenant_id, generation, variant, content_hash(q, EMBED_MODEL))
+        item = self._lru.get(key)
+        if item is not None:
+            stored_at, snippets = item
+            age = time.monotonic() - stored_at
+            if age <= self.ttl:
+                self._lru.move_to_end(key)
+                self._count("hits")
+                return snippets
+            if age <= self.ttl + self.swr:
+                self._lru.move_to_end(key)
+                self._count("stale_hits")
+                self._refresh(key, tenant_id, fetch, keep)
+                return snippets
+            del self._lru[key]
+
+        pending = self._inflight.get(key)
+        if pending is not None:
+            self._count("hits")
+            return await asyncio.shield(pending)
+
+        self._count("misses")
+        # a task of the cache's own: a chat that goes away mid-retrieval doesn't
+        # cancel the fetch for the others waiting on the same key
+        task = asyncio.create_task(self._fetch_and_store(key, tenant_id, fetch, keep))
+        self._inflight[key] = task
+        task.add_done_callback(lambda t: self._finished(key, t))
+        return await asyncio.shield(task)
+
+    def _finished(self, key: tuple, task: "asyncio.Task[Snippets]"):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # mark retrieved: every waiter may have gone before it failed
+
+
+retrieval_cache = RetrievalCache(RETRIEVAL_CACHE_MAX_ENTRIES, RETRIEVAL_CACHE_TTL, RETRIEVAL_CACHE_SWR)
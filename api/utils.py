@@ -1,7 +1,9 @@
+import numpy as np
 import tiktoken
+from array import array
 from config import EMBED_MODEL, MAX_TOKENS_PER_ITEM
-from typing import List, Dict, Iterable, Tuple
-import re, unicodedata, hashlib
+from typing import List, Dict, Iterable, Optional, Tuple
+import hashlib, re, unicodedata
 
 # Use embedding model’s encoder
 _encoder = tiktoken.encoding_for_model(EMBED_MODEL) if hasattr(tiktoken, "encoding_for_model") \
@@ -15,6 +17,10 @@ def _normalize_ws(s: str) -> str:
     s = re.sub(r"\n{3,}", "\n\n", s)
     return s.strip()
 
+def content_hash(text: str, model: str = EMBED_MODEL) -> bytes:
+    """sha256 of model + whitespace-normalized text; identical chunks embed identically."""
+    return hashlib.sha256(f"{model}\x00{_normalize_ws(text)}".encode("utf-8")).digest()
+
 _GARBAGE_SUBSTR = [
     "cookie", "privacy policy", "subscribe", "site navigation", "newsletter",
     "all rights reserved", "related posts", "breadcrumbs", "follow us",
@@ -35,27 +41,15 @@ def safe_truncate(text: str, max_tokens: int = MAX_TOKENS_PER_ITEM) -> str:
     toks = toks[:max_tokens]
     return _encoder.decode(toks)
 
-def build_context_snippets(snippets: List[Dict], max_chars: int = 12000) -> str:
-    """
-    Pack retrieved snippets into a bounded context string.
-    Accepts list of dicts like {"id": ..., "content": "..."} or raw strings.
-    Truncates to ~max_chars and numbers them [1], [2], ...
-    """
-    ctx_parts = []
-    total = 0
-    i = 0
-    for snip in snippets:
-        i += 1
-        # Support either dicts with content or plain strings
-        text = snip.get("content") if isinstance(snip, dict) else str(snip)
-        if not text:
-            continue
-        chunk = f"[{i}] {text.strip()}\n"
-        if total + len(chunk) > max_chars:
-            break
-        ctx_parts.append(chunk)
-        total += len(chunk)
-    return "".join(ctx_parts)
+def truncate_many(texts: List[str], max_tokens: int = MAX_TOKENS_PER_ITEM) -> List[Tuple[str, int]]:
+    """[(text truncated to max_tokens, its token count)] with one batched encode."""
+    out = []
+    for text, toks in zip(texts, _encoder.encode_ordinary_batch(texts)):
+        if len(toks) > max_tokens:
+            toks = toks[:max_tokens]
+            text = _encoder.decode(toks)
+        out.append((text, len(toks)))
+    return out
 
 def clean_text(text: str) -> str:
     """Aggressive cleaner for header/footer/nav noise; keeps content & headings."""
@@ -111,27 +105,122 @@ def simple_chunk_words(text: str, max_tokens: int = 280, overlap: int = 40) -> l
     return chunks
 
 # --- lightweight near-duplicate filter (SimHash)
-def _simhash64(s: str) -> int:
-    v = [0]*64
-    for tok in re.findall(r"\w+", (s or "").lower()):
-        h = int(hashlib.md5(tok.encode("utf-8")).hexdigest(), 16)
-        for i in range(64):
-            v[i] += 1 if (h >> i) & 1 else -1
-    out = 0
-    for i in range(64):
-        if v[i] >= 0:
-            out |= (1 << i)
+_WORD_RE = re.compile(r"\w+")
+_FNV_OFFSET = np.uint64(0xCBF29CE484222325)
+_FNV_PRIME = np.uint64(0x100000001B3)
+_POP8 = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+def _hash_tokens(tokens: List[str]) -> np.ndarray:
+    """64-bit FNV-1a of every token at once, column by column over a padded byte matrix,
+    then a splitmix64 finalizer so every output bit depends on every input byte."""
+    raw = [t.encode("utf-8") for t in tokens]
+    lens = np.fromiter((len(b) for b in raw), dtype=np.int64, count=len(raw))
+    flat = np.frombuffer(b"".join(raw), dtype=np.uint8)
+    width = int(lens.max())
+    cols = np.arange(width)
+    mask = cols[None, :] < lens[:, None]
+    idx = np.minimum((np.cumsum(lens) - lens)[:, None] + cols[None, :], len(flat) - 1)
+    mat = np.where(mask, flat[idx], 0).astype(np.uint64)
+
+    h = np.full(len(raw), _FNV_OFFSET, dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        for j in range(width):
+            h = np.where(mask[:, j], (h ^ mat[:, j]) * _FNV_PRIME, h)
+        h ^= h >> np.uint64(30)
+        h *= np.uint64(0xBF58476D1CE4E5B9)
+        h ^= h >> np.uint64(27)
+        h *= np.uint64(0x94D049BB133111EB)
+        h ^= h >> np.uint64(31)
+    return h
+
+def _simhash_block(texts: List[str]) -> np.ndarray:
+    vocab: Dict[str, int] = {}
+    rows, ids = [], []
+    for i, t in enumerate(texts):
+        for w in _WORD_RE.findall((t or "").lower()):
+            rows.append(i)
+            ids.append(vocab.setdefault(w, len(vocab)))
+    n, V = len(texts), len(vocab)
+    if not V:
+        return np.full(n, np.uint64(0xFFFFFFFFFFFFFFFF))  # no tokens -> all bits set
+    # token counts per text (n x V) times +/-1 bit signs per token (V x 64)
+    counts = np.bincount(np.asarray(rows) * V + np.asarray(ids), minlength=n * V)
+    counts = counts.reshape(n, V).astype(np.float32)
+    bits = np.unpackbits(_hash_tokens(list(vocab)).astype("<u8").view(np.uint8).reshape(-1, 8), axis=1, bitorder="little")
+    v = counts @ (bits.astype(np.float32) * 2 - 1)
+    return np.packbits((v >= 0).astype(np.uint8), axis=1, bitorder="little").view("<u8").ravel()
+
+def simhash64_many(texts: List[str], block: int = 128) -> np.ndarray:
+    """SimHash (64-bit, uint64) for each text; each token is hashed once per block of texts."""
+    texts = list(texts)
+    out = np.empty(len(texts), dtype=np.uint64)
+    for i in range(0, len(texts), block):
+        out[i:i + block] = _simhash_block(texts[i:i + block])
     return out
 
-def dedupe_nearby(chunks: Iterable[str], hamming_thresh: int = 5, lookback: int = 1500) -> list[str]:
-    keep, seen = [], []
-    for c in chunks:
-        sh = _simhash64(c)
-        if any(bin(sh ^ sh2).count("1") <= hamming_thresh for sh2 in seen[-lookback:]):
-            continue
-        keep.append(c)
-        seen.append(sh)
-    return keep
+def _simhash64(s: str) -> int:
+    return int(simhash64_many([s])[0])
+
+def popcount64(x: np.ndarray) -> np.ndarray:
+    return _POP8[np.ascontiguousarray(x, dtype=np.uint64).view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+class SimHashIndex:
+    """
+    Banded LSH over 64-bit simhashes. The hash is cut into `bands` slices and
+    each slice keys a bucket, so a lookup only compares against hashes that
+    match exactly on at least one band. Any pair within bands-1 bits is
+    guaranteed to share a band, so the default of hamming_thresh+1 bands
+    (6 of 10-11 bits for the usual 5) finds every near-duplicate the exact
+    pairwise check would; fewer, wider bands trade recall for smaller buckets.
+    """
+
+    def __init__(self, hamming_thresh: int = 5, bands: Optional[int] = None):
+        self.hamming_thresh = hamming_thresh
+        bands = min(bands or hamming_thresh + 1, 64)
+        widths = [64 // bands + (1 if i < 64 % bands else 0) for i in range(bands)]
+        shifts = np.cumsum([0] + widths[:-1])
+        self._bands = [(int(sh), (1 << w) - 1) for sh, w in zip(shifts, widths)]
+        self._buckets: List[Dict[int, array]] = [{} for _ in self._bands]
+        self.size = 0
+
+    def _keys(self, h: int):
+        return [(h >> sh) & mask for sh, mask in self._bands]
+
+    def is_near_dup(self, h: int) -> bool:
+        for bucket, key in zip(self._buckets, self._keys(h)):
+            cands = bucket.get(key)
+            if cands is None:
+                continue
+            if len(cands) > 32:
+                if (popcount64(np.frombuffer(cands, dtype=np.uint64) ^ np.uint64(h)) <= self.hamming_thresh).any():
+                    return True
+            elif any((h ^ c).bit_count() <= self.hamming_thresh for c in cands):
+                return True
+        return False
+
+    def add(self, h: int):
+        for bucket, key in zip(self._buckets, self._keys(h)):
+            bucket.setdefault(key, array("Q")).append(h)
+        self.size += 1
+
+    def add_if_new(self, h: int) -> bool:
+        if self.is_near_dup(h):
+            return False
+        self.add(h)
+        return True
+
+def dedupe_hashed(chunks: list, hashes: Iterable[int], index: SimHashIndex) -> list:
+    """dedupe_nearby for chunks whose simhashes were already computed (e.g. in a worker process).
+    Items are kept as-is, so chunks can carry metadata, e.g. (text, source) pairs."""
+    return [c for c, sh in zip(chunks, hashes) if index.add_if_new(int(sh))]
+
+def dedupe_nearby(chunks: Iterable[str], hamming_thresh: int = 5, index: Optional[SimHashIndex] = None) -> list[str]:
+    """Drop chunks whose simhash is within hamming_thresh of one already kept.
+    Pass a shared `index` to dedupe across calls (e.g. a whole ingest)."""
+    chunks = list(chunks)
+    if index is None:
+        index = SimHashIndex(hamming_thresh)
+    return dedupe_hashed(chunks, simhash64_many(chunks).tolist(), index)
 
 def normalize_numbers(s: str) -> str:
     if not s: return s
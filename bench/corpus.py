@@ -0,0 +1,127 @@
+"""
+Deterministic synthetic corpus and fake embeddings shared by the benches.
+
+write_kizen_csv() streams a Kizen crawl export of any size (one page per
+row, markdown with sections, tables and pricing lines) for ingest benches.
+
+Documents are drawn from topic vocabularies (plus filler words and the
+pricing/plan numbers the full-text generator matches on); queries are
+a handful of words taken from one source document, so each query has a
+known relevant document. fake_embed() is a seeded bag-of-words: every token
+maps to a fixed random unit vector and a text embeds to the normalized sum,
+so texts that share words are close, and the same text always gets the
+same vector in any process.
+"""
+import csv
+import hashlib
+import random
+import re
+from functools import lru_cache
+from typing import List, Tuple
+
+import numpy as np
+
+_TOKEN = re.compile(r"[a-z0-9$]+")
+
+_FILLER = (
+    "the a of to and in for with on is are by this that from at as be can will your our "
+    "customers team data account settings support update report users access service"
+).split()
+
+
+@lru_cache(maxsize=200_000)
+def _token_vector(token: str, dim: int) -> np.ndarray:
+    seed = int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+    v = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return v / np.linalg.norm(v)
+
+
+def fake_embed(text: str, dim: int = 1536) -> np.ndarray:
+    tokens = _TOKEN.findall(text.lower()) or ["<empty>"]
+    v = np.sum([_token_vector(t, dim) for t in tokens], axis=0)
+    return (v / (np.linalg.norm(v) or 1.0)).astype(np.float32)
+
+
+def fake_embed_many(texts: List[str], dim: int = 1536) -> np.ndarray:
+    return np.stack([fake_embed(t, dim) for t in texts]) if texts else np.zeros((0, dim), np.float32)
+
+
+def _word(rng: np.random.Generator, n: int = 7) -> str:
+    return "".join(rng.choice(list("abcdefghijklmnopqrstuvwxyz"), size=int(rng.integers(4, n + 1))))
+
+
+def make_corpus(n_docs: int, n_topics: int = 50, seed: int = 0) -> Tuple[List[str], List[int]]:
+    """`n_docs` markdown-ish chunks and the topic each was drawn from."""
+    rng = np.random.default_rng(seed)
+    topics = [[_word(rng) for _ in range(30)] for _ in range(n_topics)]
+    docs, labels = [], []
+    for i in range(n_docs):
+        t = int(rng.integers(n_topics))
+        vocab = topics[t]
+        title = " ".join(rng.choice(vocab, size=3))
+        sentences = []
+        for _ in range(int(rng.integers(3, 8))):
+            words = [
+                str(rng.choice(vocab)) if rng.random() < 0.6 else str(rng.choice(_FILLER))
+                for _ in range(int(rng.integers(8, 16)))
+            ]
+            sentences.append(" ".join(words).capitalize() + ".")
+        if rng.random() < 0.3:
+            sentences.append(f"Plan {int(rng.integers(1, 9))} costs ${int(rng.integers(5, 500))} per month.")
+        docs.append(f"## {title.title()} ({i})\n" + " ".join(sentences))
+        labels.append(t)
+    return docs, labels
+
+
+def make_queries(docs: List[str], n_queries: int, seed: int = 1) -> List[Tuple[str, int]]:
+    """(query text, index of the document it was drawn from)."""
+    rng = np.random.default_rng(seed)
+    out = []
+    for _ in range(n_queries):
+        src = int(rng.integers(len(docs)))
+        words = [w for w in _TOKEN.findall(docs[src].lower()) if w not in _FILLER]
+        price = re.search(r"Plan \d+ costs \$\d+", docs[src])
+        if price is not None and rng.random() < 0.5:
+            q = price.group(0)
+        else:
+            q = " ".join(rng.choice(words, size=min(len(words), int(rng.integers(3, 7))), replace=False))
+        out.append((q, src))
+    return out
+
+
+KIZEN_HEADER = ["crawl/loadedUrl", "url", "metadata/title", "markdown", "text"]
+
+
+def iter_kizen_rows(n_rows: int, n_topics: int = 200, seed: int = 0):
+    """Kizen crawl rows: each page is a few markdown sections drawn from one topic."""
+    rnd = random.Random(seed)
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    topics = [
+        ["".join(rnd.choices(letters, k=rnd.randint(4, 9))) for _ in range(40)] for _ in range(n_topics)
+    ]
+    for i in range(n_rows):
+        vocab = topics[rnd.randrange(n_topics)]
+        title = " ".join(rnd.choices(vocab, k=3)).title()
+        parts = [f"# {title}"]
+        for _ in range(rnd.randint(2, 5)):
+            parts.append(f"## {' '.join(rnd.choices(vocab, k=2)).title()}")
+            for _ in range(rnd.randint(1, 3)):
+                words = [w if rnd.random() < 0.6 else rnd.choice(_FILLER) for w in rnd.choices(vocab, k=rnd.randint(20, 60))]
+                parts.append(" ".join(words).capitalize() + ".")
+            if rnd.random() < 0.3:
+                parts.append(f"- Plan {rnd.randint(1, 9)} costs ${rnd.randint(5, 500)}/mo")
+            if rnd.random() < 0.2:
+                parts.append("| Plan | Price | Seats |\n|---|---|---|\n" + "\n".join(
+                    f"| {rnd.choice(vocab).title()} | ${rnd.randint(5, 500)} | {rnd.randint(1, 100)} seats |"
+                    for _ in range(rnd.randint(2, 4))
+                ))
+        url = f"https://example.com/{seed}/{i}"
+        yield [url, url, title, "\n\n".join(parts), ""]
+
+
+def write_kizen_csv(path: str, n_rows: int, seed: int = 0) -> str:
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(KIZEN_HEADER)
+        w.writerows(iter_kizen_rows(n_rows, seed=seed))
+    return path
@@ -0,0 +1,94 @@
+"""
+Local stand-in for the OpenAI embeddings endpoint, for ingest benches.
+
+POST /v1/embeddings returns one deterministic unit vector per input (seeded
+from the text, so re-ingests see identical vectors), as float lists or as
+base64 float32 when the client asks for encoding_format=base64 (the openai
+client does by default). Latency is simulated per request and per item so
+runs can model the real API's cost; every response carries the
+x-ratelimit-* headers the batcher reads.
+
+    python bench/fake_openai.py --port 18080 [--dim 1536] [--latency-ms 0] [--ms-per-item 0]
+
+Point the API at it with OPENAI_BASE_URL=http://127.0.0.1:18080/v1.
+"""
+import argparse
+import base64
+import hashlib
+import json
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+
+def vector(text: str, dim: int) -> np.ndarray:
+    seed = int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+    v = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return v / np.linalg.norm(v)
+
+
+def make_handler(dim: int, latency_s: float, s_per_item: float):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"   # keep-alive, like the real API
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status: int, body: dict):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.send_header("x-ratelimit-remaining-tokens", "1000000")
+            self.send_header("x-ratelimit-reset-tokens", "60ms")
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if self.path.rstrip("/") != "/v1/embeddings":
+                self._send(404, {"error": {"message": f"no route {self.path}", "type": "invalid_request_error"}})
+                return
+            inputs = body.get("input")
+            if isinstance(inputs, str):
+                inputs = [inputs]
+            if not inputs:
+                self._send(400, {"error": {"message": "input is empty", "type": "invalid_request_error"}})
+                return
+            time.sleep(latency_s + s_per_item * len(inputs))
+            b64 = body.get("encoding_format") == "base64"
+            data = []
+            for i, text in enumerate(inputs):
+                v = vector(text if isinstance(text, str) else json.dumps(text), dim)
+                data.append({
+                    "object": "embedding", "index": i,
+                    "embedding": base64.b64encode(v.tobytes()).decode("ascii") if b64 else v.tolist(),
+                })
+            tokens = sum(len(t) // 4 + 1 for t in inputs if isinstance(t, str))
+            self._send(200, {
+                "object": "list", "model": body.get("model"), "data": data,
+                "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+            })
+
+    return Handler
+
+
+def serve(port: int, dim: int = 1536, latency_ms: float = 0.0, ms_per_item: float = 0.0):
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(dim, latency_ms / 1000, ms_per_item / 1000))
+    server.daemon_threads = True
+    server.serve_forever()
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--port", type=int, default=18080)
+    ap.add_argument("--dim", type=int, default=1536)
+    ap.add_argument("--latency-ms", type=float, default=0.0, help="fixed latency per request")
+    ap.add_argument("--ms-per-item", type=float, default=0.0, help="extra latency per input text")
+    args = ap.parse_args()
+    serve(args.port, args.dim, args.latency_ms, args.ms_per_item)
+
+
+if __name__ == "__main__":
+    main()
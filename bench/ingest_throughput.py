@@ -0,0 +1,254 @@
+"""
+End-to-end ingest throughput benchmark.
+
+Generates Kizen-format CSVs (bench/corpus.py), starts the fake OpenAI
+embeddings server (bench/fake_openai.py) and the API under uvicorn against a
+local Postgres, then drives POST /api/ingest/stream with each file. Every run
+reports rows/s, chunks/s, time to the first SSE event, peak RSS (the API
+process, and its chunking workers together) and the per-stage seconds from
+the load event: parse, chunk, dedupe, embed, insert, finish. Stages run
+concurrently, so compare each against wall time rather than summing them.
+
+Any API setting can be swept, and each combination gets a fresh API process:
+
+    python bench/ingest_throughput.py --dsn postgresql://... --rows 10000,100000 \\
+        --sweep EMBED_CONCURRENCY=2,4,8 --sweep PANDAS_CHUNKSIZE=400,2000 --sweep EMBED_BATCH=64,128 \\
+        [--set CHUNK_WORKERS=2] [--embed-latency-ms 150] [--workdir /tmp/ingest-bench] [--json] [--out runs.json]
+"""
+import argparse
+import glob
+import itertools
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import uuid
+
+import httpx
+
+from corpus import write_kizen_csv
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+API_DIR = os.path.join(HERE, "..", "api")
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_http(url: str, proc: subprocess.Popen, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"{proc.args[:3]} exited with {proc.returncode}")
+        try:
+            httpx.get(url, timeout=1.0)
+            return
+        except httpx.TransportError:
+            time.sleep(0.2)
+    raise TimeoutError(f"{url} not up after {timeout}s")
+
+
+def _kv(items) -> dict:
+    out = {}
+    for item in items or ():
+        key, sep, value = item.partition("=")
+        if not sep:
+            raise SystemExit(f"expected KEY=VALUE, got {item!r}")
+        out[key] = value
+    return out
+
+
+def _children(pid: int) -> list:
+    out = []
+    for path in glob.glob(f"/proc/{pid}/task/*/children"):
+        try:
+            with open(path) as f:
+                kids = [int(p) for p in f.read().split()]
+        except OSError:
+            continue
+        for kid in kids:
+            out += [kid, *_children(kid)]
+    return out
+
+
+def _peak_rss_mb(pid: int):
+    """VmHWM (peak resident set) from /proc; None where there is no procfs."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def _db_env(dsn: str) -> dict:
+    from psycopg.conninfo import conninfo_to_dict
+
+    c = conninfo_to_dict(dsn)
+    return {
+        "POSTGRES_HOST": c.get("host", "localhost"),
+        "POSTGRES_PORT": str(c.get("port", "5432")),
+        "POSTGRES_DB": c.get("dbname", "postgres"),
+        "POSTGRES_USER": c.get("user", "postgres"),
+        "POSTGRES_PASSWORD": c.get("password", ""),
+    }
+
+
+def ingest(base_url: str, path: str, tenant_id: str) -> dict:
+    """One streamed upload; returns client-side timings plus the server's load event."""
+    first, load, errors, events = None, None, [], 0
+    t0 = time.perf_counter()
+    with httpx.Client(timeout=None) as client, open(path, "rb") as f:
+        with client.stream(
+            "POST", f"{base_url}/api/ingest/stream",
+            data={"tenant_id": tenant_id}, files={"file": (os.path.basename(path), f, "text/csv")},
+        ) as r:
+            r.raise_for_status()
+            for line in r.iter_lines():
+                if not line.startswith("data: "):
+                    continue
+                if first is None:
+                    first = time.perf_counter() - t0
+                events += 1
+                ev = json.loads(line[6:])
+                if ev.get("phase") == "load":
+                    load = ev
+                elif ev.get("status") == "error":
+                    errors.append(ev.get("detail"))
+    return {"wall_s": time.perf_counter() - t0, "ttfe_s": first, "events": events, "load": load, "errors": errors}
+
+
+def run_one(args, rows: int, settings: dict, embed_url: str, db_env: dict) -> dict:
+    path = os.path.join(args.workdir, f"kizen_{rows}_{args.seed}.csv")
+    if not os.path.exists(path):
+        print(f"generating {path}", file=sys.stderr)
+        write_kizen_csv(path + ".tmp", rows, seed=args.seed)
+        os.replace(path + ".tmp", path)
+
+    port = _free_port()
+    env = {
+        **os.environ,
+        "OPENAI_API_KEY": "bench",
+        "OPENAI_BASE_URL": embed_url,
+        "VACUUM_INTERVAL_S": "0",
+        **db_env,
+        **settings,
+    }
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=API_DIR, env=env,
+    )
+    tenant_id = f"bench-{uuid.uuid4().hex[:8]}"
+    try:
+        base_url = f"http://127.0.0.1:{port}"
+        _wait_http(f"{base_url}/health", server)
+        res = ingest(base_url, path, tenant_id)
+        workers = [_peak_rss_mb(pid) for pid in _children(server.pid)]
+        rss, workers_rss = _peak_rss_mb(server.pid), round(sum(w for w in workers if w), 1) if workers else None
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        if not args.keep:
+            import psycopg
+
+            with psycopg.connect(args.dsn) as conn:
+                conn.execute("DELETE FROM documents WHERE tenant_id = %s", (tenant_id,))
+
+    load = res["load"] or {}
+    chunks = load.get("rows", 0) + load.get("reused", 0)
+    wall = res["wall_s"]
+    return {
+        "rows": rows,
+        "settings": settings,
+        "wall_s": round(wall, 3),
+        "rows_per_s": round(rows / wall, 1),
+        "chunks": chunks,
+        "chunks_per_s": round(chunks / wall, 1),
+        "ttfe_s": round(res["ttfe_s"], 3) if res["ttfe_s"] is not None else None,
+        "peak_rss_mb": rss,
+        "workers_peak_rss_mb": workers_rss,
+        "stage_s": load.get("stage_s"),
+        "events": res["events"],
+        "errors": res["errors"][:5],
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--dsn", required=True, help="Postgres+pgvector with the docker/postgres/init schema")
+    ap.add_argument("--rows", default="10000", help="comma-separated CSV sizes, e.g. 10000,100000,1000000")
+    ap.add_argument("--sweep", action="append", default=[], metavar="KEY=V1,V2",
+                    help="API setting to sweep (EMBED_CONCURRENCY, PANDAS_CHUNKSIZE, EMBED_BATCH, ...)")
+    ap.add_argument("--set", action="append", default=[], metavar="KEY=V", help="API setting fixed for every run")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--dim", type=int, default=1536, help="fake embedding size; must match the documents column")
+    ap.add_argument("--embed-latency-ms", type=float, default=0.0, help="fake embeddings latency per request")
+    ap.add_argument("--embed-ms-per-item", type=float, default=0.0, help="fake embeddings latency per input")
+    ap.add_argument("--workdir", default="/tmp/ingest-bench", help="generated CSVs are cached here")
+    ap.add_argument("--keep", action="store_true", help="keep the ingested rows (default: delete each bench tenant)")
+    ap.add_argument("--json", action="store_true", help="emit one JSON object instead of a table")
+    ap.add_argument("--out", default=None, help="also write the JSON result to this file")
+    args = ap.parse_args()
+    os.makedirs(args.workdir, exist_ok=True)
+
+    fixed = _kv(args.set)
+    sweep = {k: v.split(",") for k, v in _kv(args.sweep).items()}
+    combos = [dict(zip(sweep, values)) for values in itertools.product(*sweep.values())] or [{}]
+    sizes = [int(r) for r in args.rows.split(",")]
+
+    embed_port = _free_port()
+    fake = subprocess.Popen([
+        sys.executable, os.path.join(HERE, "fake_openai.py"), "--port", str(embed_port), "--dim", str(args.dim),
+        "--latency-ms", str(args.embed_latency_ms), "--ms-per-item", str(args.embed_ms_per_item),
+    ])
+    runs = []
+    try:
+        embed_url = f"http://127.0.0.1:{embed_port}/v1"
+        _wait_http(f"http://127.0.0.1:{embed_port}/", fake)
+        db_env = _db_env(args.dsn)
+        for rows in sizes:
+            for combo in combos:
+                r = run_one(args, rows, {**fixed, **combo}, embed_url, db_env)
+                runs.append(r)
+                print(f"{rows} rows {combo or ''}: {r['rows_per_s']} rows/s", file=sys.stderr)
+    finally:
+        fake.terminate()
+        fake.wait()
+
+    result = {
+        "params": {
+            "rows": sizes, "sweep": sweep, "set": fixed, "seed": args.seed,
+            "embed_latency_ms": args.embed_latency_ms, "embed_ms_per_item": args.embed_ms_per_item,
+        },
+        "runs": runs,
+    }
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2)
+    if args.json:
+        print(json.dumps(result))
+        return
+    stages = sorted({s for r in runs for s in (r["stage_s"] or {})})
+    print(f"{'rows':>8} {'settings':<40} {'wall_s':>8} {'rows/s':>8} {'chunks/s':>9} {'ttfe_s':>7} "
+          f"{'rss_mb':>7} {'wrk_mb':>7}  " + " ".join(f"{s:>7}" for s in stages))
+    for r in runs:
+        label = ",".join(f"{k}={v}" for k, v in r["settings"].items()) or "-"
+        print(f"{r['rows']:>8} {label:<40} {r['wall_s']:>8} {r['rows_per_s']:>8} {r['chunks_per_s']:>9} "
+              f"{r['ttfe_s']!s:>7} {r['peak_rss_mb']!s:>7} {r['workers_peak_rss_mb']!s:>7}  "
+              + " ".join(f"{(r['stage_s'] or {}).get(s, '-')!s:>7}" for s in stages))
+        for e in r["errors"]:
+            print(f"         error: {e}")
+
+
+if __name__ == "__main__":
+    main()
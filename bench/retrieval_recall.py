@@ -0,0 +1,378 @@
+"""
+Recall/latency benchmark for the hybrid retriever.
+
+Loads a deterministic synthetic corpus (bench/corpus.py, fake bag-of-words
+embeddings) into its own schema on a local Postgres+pgvector, then runs each
+query through the calls chat.py makes (indexes.apply_search_profile, then
+retrieval.retrieve; retrieval.retrieve_parallel on a small pool of its own
+for --mode parallel) and reports:
+
+  latency    p50/p95/p99 of that step, and per-statement timings
+  recall     dense@DENSE_LIMIT: the ANN generator vs an exact numpy scan
+             fused@TOP_K: retrieve() vs the same call with index scans off
+             (parallel: vs "multi" with index scans off, the same generators
+             and fusion on one connection; plans can order tied candidates
+             differently)
+  quality    hit@TOP_K and MRR of the document each query was drawn from
+
+--rerank scores a fused pool of --rerank-pool with a rerank.py scorer before
+the top-k cut. The candidate sizes and k can be overridden to sweep them. --json/--out write
+one object to diff between commits; --compare prints deltas against one.
+
+    python bench/retrieval_recall.py --dsn postgresql://... [--docs 5000] [--queries 200]
+        [--mode fused|multi|parallel] [--index hnsw|ivfflat|none] [--profile balanced]
+        [--dense-limit 15] [--trigram-limit 15] [--fts-limit 20] [--ilike-limit 20] [--rrf-k 40] [--top-k 12]
+        [--rerank cosine|onnx] [--rerank-pool 50]
+        [--skip-load] [--json] [--out run.json] [--compare base.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+# db.py imports config, which insists on these being set
+for k in ("OPENAI_API_KEY", "POSTGRES_HOST", "POSTGRES_PORT", "POSTGRES_DB", "POSTGRES_USER", "POSTGRES_PASSWORD"):
+    os.environ.setdefault(k, "bench")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "api"))
+
+import db  # noqa: E402
+import indexes  # noqa: E402
+import rerank  # noqa: E402
+import retrieval  # noqa: E402
+from db import SESSION_OPTIONS, to_db_vector, to_db_vectors  # noqa: E402
+from corpus import fake_embed, fake_embed_many, make_corpus, make_queries  # noqa: E402
+
+SCHEMA = "bench_retrieval"
+TENANT = "bench"
+STAGES = {
+    "fused": ["fused"],
+    "multi": [*retrieval.GENERATORS, "content"],
+    # retrieve_parallel()'s own per-stage stats; no cursor to time
+    "parallel": [*retrieval.LEXICAL_GENERATORS, "dense", "rerank", "content"],
+}
+# index scans off: every generator falls back to an exact (sequential) scan
+_EXACT = ("enable_indexscan", "enable_bitmapscan", "enable_indexonlyscan")
+
+
+class _TimedCursor:
+    """Cursor proxy timing each execute() through its fetchall(), by statement order."""
+
+    def __init__(self, cur, names):
+        self._cur = cur
+        self._names = names
+        self._t0 = 0.0
+        self.timings = {}
+
+    async def execute(self, *args, **kwargs):
+        self._t0 = time.perf_counter()
+        return await self._cur.execute(*args, **kwargs)
+
+    async def fetchall(self):
+        rows = await self._cur.fetchall()
+        i = len(self.timings)
+        self.timings[self._names[i] if i < len(self._names) else f"stmt{i}"] = time.perf_counter() - self._t0
+        return rows
+
+
+def _stage_names(mode: str) -> list:
+    scorer = rerank.get_scorer()
+    names = list(STAGES[mode])
+    if scorer is None or mode == "parallel":
+        return names
+    # content scorers need the pool's text before they run; the cosine one fetches content after
+    if scorer.inputs == "content":
+        return [*names, "rerank"]
+    if mode == "fused":
+        return [*names, "rerank", "content"]
+    return [*names[:-1], "rerank", names[-1]]
+
+
+async def load(conn, docs, vecs, method: str) -> dict:
+    """Fresh bench schema: the documents columns retrieval reads, the repo's indexes, the corpus."""
+    await conn.execute("CREATE EXTENSION IF NOT EXISTS vector")
+    try:
+        async with conn.transaction():
+            await conn.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        trgm = True
+    except Exception as e:
+        print(f"[WARN] pg_trgm unavailable ({str(e).splitlines()[0]}); the trigram generator needs word_similarity() and <%", file=sys.stderr)
+        trgm = False
+    await conn.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+    await conn.execute(f"CREATE SCHEMA {SCHEMA}")
+    await conn.execute(
+        f"""
+        CREATE TABLE {SCHEMA}.documents (
+            id BIGINT PRIMARY KEY, tenant_id TEXT NOT NULL, content TEXT NOT NULL,
+            embedding vector({vecs.shape[1]}), content_hash BYTEA, source_url TEXT,
+            loaded_url TEXT, doc_version BIGINT, deleted_at TIMESTAMPTZ,
+            content_tsv tsvector GENERATED ALWAYS AS (to_tsvector('{retrieval.FTS_CONFIG}', content)) STORED
+        )
+        """
+    )
+    t0 = time.perf_counter()
+    rows = [(i + 1, TENANT, doc, v) for i, (doc, v) in enumerate(zip(docs, to_db_vectors(vecs)))]
+    async with conn.cursor() as cur:
+        for i in range(0, len(rows), 1000):
+            await cur.executemany(
+                f"INSERT INTO {SCHEMA}.documents (id, tenant_id, content, embedding) VALUES (%s, %s, %s, %s::vector)",
+                rows[i:i + 1000],
+            )
+    await conn.execute(f"CREATE INDEX ON {SCHEMA}.documents (tenant_id)")
+    await conn.execute(f"CREATE INDEX ON {SCHEMA}.documents USING gin (content_tsv)")
+    if trgm:
+        await conn.execute(f"CREATE INDEX ON {SCHEMA}.documents USING gin (content gin_trgm_ops)")
+    load_s = time.perf_counter() - t0
+
+    index = {"method": method}
+    if method != "none":
+        t0 = time.perf_counter()
+        await indexes.create_ann_index(conn, "documents", method)
+        index["build_s"] = round(time.perf_counter() - t0, 3)
+        found = await indexes.ann_indexes(conn, "documents")
+        index.update({k: v for k, v in found[0].items() if k not in ("name", "table", "valid")})
+    await conn.execute(f"ANALYZE {SCHEMA}.documents")
+    await conn.commit()
+    return {"rows": len(docs), "load_s": round(load_s, 3), "index": index}
+
+
+async def _retrieve(conn, q, q_vec, profile, top_k, names, exact=False, multi=False):
+    async with conn.transaction():
+        t0 = time.perf_counter()
+        settings = await indexes.apply_search_profile(conn, TENANT, profile)
+        t1 = time.perf_counter()
+        if exact:
+            for guc in _EXACT:
+                await conn.execute(f"SET LOCAL {guc} = off")
+        async with conn.cursor() as raw:
+            cur = _TimedCursor(raw, names)
+            fn = retrieval.retrieve_multi if multi else retrieval.retrieve
+            snippets = await fn(cur, TENANT, q, q_vec, top_k)
+        t2 = time.perf_counter()
+    stages = {"search_profile": t1 - t0, **cur.timings}
+    return [s["id"] for s in snippets], t2 - t0, stages, settings
+
+
+async def _retrieve_parallel(q, q_emb, profile, top_k):
+    # the embedding is already there: this measures the generators, not the overlap with the API call
+    emb = asyncio.get_running_loop().create_future()
+    emb.set_result(q_emb)
+    t0 = time.perf_counter()
+    snippets, stats = await retrieval.retrieve_parallel(TENANT, q, emb, profile, top_k)
+    elapsed = time.perf_counter() - t0
+    failed = {name: s["status"] for name, s in stats.items() if s["status"] != "ok"}
+    if failed:
+        print(f"[WARN] parallel retrieval degraded: {failed}", file=sys.stderr)
+    return [s["id"] for s in snippets], elapsed, {name: s["ms"] / 1000 for name, s in stats.items()}
+
+
+async def _open_pool(dsn: str, options: str):
+    """retrieve_parallel() takes its connections from db.pool; give it one on the bench schema."""
+    from psycopg_pool import AsyncConnectionPool
+
+    n = len(STAGES["parallel"])
+    db.pool = AsyncConnectionPool(
+        dsn, kwargs={"options": options}, min_size=n, max_size=n,
+        configure=db._configure if db.VECTOR_TRANSPORT == "binary" else None, open=False,
+    )
+    await db.pool.open(wait=True)
+
+
+async def _dense_ids(conn, q_vec, profile, limit):
+    async with conn.transaction():
+        await indexes.apply_search_profile(conn, TENANT, profile)
+        cur = await conn.execute(
+            "SELECT id FROM documents WHERE tenant_id = %s AND deleted_at IS NULL "
+            "ORDER BY embedding <-> %s::vector LIMIT %s",
+            (TENANT, q_vec, limit),
+        )
+        return [r[0] for r in await cur.fetchall()]
+
+
+def _pct(xs, scale=1000.0) -> dict:
+    a = np.asarray(xs) * scale
+    return {
+        "p50": round(float(np.percentile(a, 50)), 3),
+        "p95": round(float(np.percentile(a, 95)), 3),
+        "p99": round(float(np.percentile(a, 99)), 3),
+        "mean": round(float(a.mean()), 3),
+    }
+
+
+def _git_rev():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args) -> dict:
+    from pgvector.psycopg import register_vector_async
+    from psycopg import AsyncConnection
+
+    retrieval.RETRIEVAL_MODE = args.mode
+    retrieval.DENSE_LIMIT = indexes.DENSE_LIMIT = args.dense_limit
+    retrieval.TRIGRAM_LIMIT = args.trigram_limit
+    retrieval.FTS_LIMIT = args.fts_limit
+    retrieval.ILIKE_LIMIT = args.ilike_limit
+    retrieval.RRF_K = args.rrf_k
+    rerank.RERANKER = args.rerank
+    retrieval.RERANK_POOL = args.rerank_pool
+
+    docs, _ = make_corpus(args.docs, n_topics=args.topics, seed=args.seed)
+    vecs = fake_embed_many(docs, args.dim)
+    queries = make_queries(docs, args.queries, seed=args.seed + 1)
+
+    # the repo's SQL says `documents`; the search_path points it at the bench schema
+    options = f"-c search_path={SCHEMA},public {SESSION_OPTIONS}"
+    parallel = args.mode == "parallel"
+    async with await AsyncConnection.connect(args.dsn, options=options) as conn:
+        await register_vector_async(conn)
+        await conn.commit()
+        loaded = None if args.skip_load else await load(conn, docs, vecs, args.index)
+        if parallel:
+            await _open_pool(args.dsn, options)
+
+        names = _stage_names(args.mode)
+
+        async def retrieve_ids(q, q_emb, q_vec):
+            if not parallel:
+                return await _retrieve(conn, q, q_vec, args.profile, args.top_k, names)
+            ids, elapsed, st = await _retrieve_parallel(q, q_emb, args.profile, args.top_k)
+            return ids, elapsed, st, settings
+
+        settings = {}
+        if parallel:
+            # what the dense generator's connection gets SET LOCAL; reported, not timed
+            async with conn.transaction():
+                settings = await indexes.apply_search_profile(conn, TENANT, args.profile)
+        for q, _ in queries[:args.warmup]:
+            q_emb = fake_embed(q, args.dim)
+            await retrieve_ids(q, q_emb, to_db_vector(q_emb))
+
+        latencies, stages, dense_recall, fused_recall, hits, rr = [], {}, [], [], [], []
+        for q, src in queries:
+            q_emb = fake_embed(q, args.dim)
+            q_vec = to_db_vector(q_emb)
+            ids, elapsed, st, settings = await retrieve_ids(q, q_emb, q_vec)
+            latencies.append(elapsed)
+            for name, t in st.items():
+                stages.setdefault(name, []).append(t)
+
+            exact_ids, *_ = await _retrieve(
+                conn, q, q_vec, args.profile, args.top_k, _stage_names("multi") if parallel else names,
+                exact=True, multi=parallel,
+            )
+            if exact_ids:
+                fused_recall.append(len(set(ids) & set(exact_ids)) / len(exact_ids))
+
+            ann = await _dense_ids(conn, q_vec, args.profile, args.dense_limit)
+            exact_dense = np.argsort(np.linalg.norm(vecs - q_emb, axis=1))[:args.dense_limit] + 1
+            dense_recall.append(len(set(ann) & set(exact_dense.tolist())) / len(exact_dense))
+
+            rank = ids.index(src + 1) + 1 if src + 1 in ids else None
+            hits.append(rank is not None)
+            rr.append(1.0 / rank if rank else 0.0)
+        if parallel:
+            await db.pool.close()
+
+    return {
+        "commit": _git_rev(),
+        "params": {
+            "docs": args.docs, "topics": args.topics, "queries": args.queries, "dim": args.dim, "seed": args.seed,
+            "mode": args.mode, "index": args.index, "profile": args.profile,
+            "dense_limit": args.dense_limit, "trigram_limit": args.trigram_limit,
+            "fts_limit": args.fts_limit, "ilike_limit": args.ilike_limit, "rrf_k": args.rrf_k, "top_k": args.top_k,
+            "rerank": args.rerank or None, "rerank_pool": args.rerank_pool if args.rerank else None,
+        },
+        "load": loaded,
+        "search": settings,
+        "latency_ms": _pct(latencies),
+        "stages_ms": {name: _pct(ts) for name, ts in stages.items()},
+        "recall": {
+            f"dense@{args.dense_limit}": round(float(np.mean(dense_recall)), 4),
+            f"fused@{args.top_k}": round(float(np.mean(fused_recall)), 4) if fused_recall else None,
+        },
+        "quality": {
+            f"hit@{args.top_k}": round(float(np.mean(hits)), 4),
+            "mrr": round(float(np.mean(rr)), 4),
+        },
+    }
+
+
+def _flatten(result: dict) -> dict:
+    out = {}
+    for section in ("latency_ms", "recall", "quality"):
+        for k, v in (result.get(section) or {}).items():
+            out[f"{section}.{k}"] = v
+    for name, p in (result.get("stages_ms") or {}).items():
+        out[f"stages_ms.{name}.p50"] = p["p50"]
+    return out
+
+
+def compare(base: dict, new: dict):
+    b, n = _flatten(base), _flatten(new)
+    print(f"{'metric':<34} {base.get('commit') or 'base':>10} {new.get('commit') or 'new':>10} {'delta':>9}")
+    for key in sorted(set(b) | set(n)):
+        old, cur = b.get(key), n.get(key)
+        delta = f"{(cur - old) / old:+.1%}" if isinstance(old, (int, float)) and isinstance(cur, (int, float)) and old else "-"
+        print(f"{key:<34} {str(old):>10} {str(cur):>10} {delta:>9}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--dsn", required=True, help="Postgres+pgvector DSN (the bench uses its own schema)")
+    ap.add_argument("--docs", type=int, default=5000)
+    ap.add_argument("--topics", type=int, default=50)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--warmup", type=int, default=20)
+    ap.add_argument("--dim", type=int, default=1536)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--mode", choices=sorted(STAGES), default="fused")
+    ap.add_argument("--index", choices=("hnsw", "ivfflat", "none"), default="hnsw")
+    ap.add_argument("--profile", choices=sorted(indexes.SEARCH_PROFILES), default="balanced")
+    ap.add_argument("--dense-limit", type=int, default=retrieval.DENSE_LIMIT)
+    ap.add_argument("--trigram-limit", type=int, default=retrieval.TRIGRAM_LIMIT)
+    ap.add_argument("--fts-limit", type=int, default=retrieval.FTS_LIMIT)
+    ap.add_argument("--ilike-limit", type=int, default=retrieval.ILIKE_LIMIT, help="with RETRIEVAL_ILIKE=1")
+    ap.add_argument("--rrf-k", type=int, default=retrieval.RRF_K)
+    ap.add_argument("--top-k", type=int, default=retrieval.TOP_K)
+    ap.add_argument("--rerank", choices=sorted(rerank.SCORERS), default="", help="rerank the fused pool (default: off)")
+    ap.add_argument("--rerank-pool", type=int, default=retrieval.RERANK_POOL)
+    ap.add_argument("--skip-load", action="store_true", help="reuse the corpus from the last run (same --docs/--seed)")
+    ap.add_argument("--json", action="store_true", help="emit one JSON object instead of a table")
+    ap.add_argument("--out", default=None, help="also write the JSON result to this file")
+    ap.add_argument("--compare", default=None, help="JSON result of an earlier run to diff against")
+    args = ap.parse_args()
+
+    result = asyncio.run(run(args))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), result)
+        return
+    if args.json:
+        print(json.dumps(result))
+        return
+    p = result["params"]
+    print(f"{p['docs']} docs, {p['queries']} queries, mode={p['mode']} index={p['index']} profile={p['profile']} {result['search']}")
+    if result["load"]:
+        print(f"load: {result['load']}")
+    print(f"{'stage':<16} {'p50_ms':>9} {'p95_ms':>9} {'p99_ms':>9}")
+    for name, s in [("retrieve", result["latency_ms"]), *result["stages_ms"].items()]:
+        print(f"{name:<16} {s['p50']:>9} {s['p95']:>9} {s['p99']:>9}")
+    print("recall: " + ", ".join(f"{k}={v}" for k, v in result["recall"].items()))
+    print("quality: " + ", ".join(f"{k}={v}" for k, v in result["quality"].items()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Microbenchmark: pgvector text literals vs binary float32 parameters.
+
+Measures client-side CPU to encode a batch of embeddings and the bytes each
+format puts on the wire. With --dsn it also times inserting the batch into
+a temp table, which includes Postgres parsing the text literals.
+
+    python bench/vector_transport.py --n 2000 --dim 1536 [--dsn postgresql://...] [--json]
+"""
+import argparse
+import json
+import os
+import struct
+import sys
+import time
+
+import numpy as np
+
+# db.py imports config, which insists on these being set
+for k in ("OPENAI_API_KEY", "POSTGRES_HOST", "POSTGRES_PORT", "POSTGRES_DB", "POSTGRES_USER", "POSTGRES_PASSWORD"):
+    os.environ.setdefault(k, "bench")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "api"))
+
+from db import _vec_literal  # noqa: E402
+
+
+def _pgvector_binary(arr: np.ndarray) -> bytes:
+    # pgvector's binary send format: int16 dim, int16 unused, float32[dim] big-endian
+    return struct.pack(">HH", arr.shape[0], 0) + arr.astype(">f4", copy=False).tobytes()
+
+
+def bench_text(vectors):
+    t0 = time.process_time()
+    lits = [_vec_literal(v) for v in vectors]
+    cpu = time.process_time() - t0
+    return lits, cpu, sum(len(s.encode("ascii")) for s in lits)
+
+
+def bench_binary(vectors):
+    t0 = time.process_time()
+    mat = np.asarray(vectors, dtype=np.float32)
+    bufs = [_pgvector_binary(row) for row in mat]
+    cpu = time.process_time() - t0
+    return list(mat), cpu, sum(len(b) for b in bufs)
+
+
+def bench_roundtrip(dsn, params):
+    """Insert every vector into a temp table the way db.insert_documents_on_conn does."""
+    import psycopg
+    from pgvector.psycopg import register_vector
+
+    with psycopg.connect(dsn) as conn:
+        register_vector(conn)
+        conn.execute("CREATE TEMP TABLE bench_vec (e vector)")
+        with conn.cursor() as cur:
+            t0 = time.perf_counter()
+            cur.executemany("INSERT INTO bench_vec (e) VALUES (%s::vector)", [(p,) for p in params])
+            elapsed = time.perf_counter() - t0
+        conn.rollback()
+        return elapsed
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--n", type=int, default=2000, help="vectors per batch")
+    ap.add_argument("--dim", type=int, default=1536)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--dsn", default=None, help="optional Postgres+pgvector DSN for a round-trip timing")
+    ap.add_argument("--json", action="store_true", help="emit one JSON object instead of a table")
+    args = ap.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    # embeddings come back from the OpenAI client as lists of Python floats
+    vectors = rng.standard_normal((args.n, args.dim)).astype(np.float32).tolist()
+
+    lits, text_cpu, text_bytes = bench_text(vectors)
+    arrs, bin_cpu, bin_bytes = bench_binary(vectors)
+    result = {
+        "n": args.n,
+        "dim": args.dim,
+        "text": {"cpu_s": round(text_cpu, 4), "bytes": text_bytes, "bytes_per_vector": text_bytes // args.n},
+        "binary": {"cpu_s": round(bin_cpu, 4), "bytes": bin_bytes, "bytes_per_vector": bin_bytes // args.n},
+        "bytes_ratio": round(text_bytes / bin_bytes, 2),
+        "cpu_ratio": round(text_cpu / bin_cpu, 2) if bin_cpu else None,
+    }
+    if args.dsn:
+        result["text"]["roundtrip_s"] = round(bench_roundtrip(args.dsn, lits), 4)
+        result["binary"]["roundtrip_s"] = round(bench_roundtrip(args.dsn, arrs), 4)
+
+    if args.json:
+        print(json.dumps(result))
+        return
+    print(f"{args.n} x {args.dim}-dim vectors")
+    print(f"{'format':<8} {'cpu_s':>8} {'bytes/vec':>10} {'roundtrip_s':>12}")
+    for fmt in ("text", "binary"):
+        r = result[fmt]
+        print(f"{fmt:<8} {r['cpu_s']:>8} {r['bytes_per_vector']:>10} {r.get('roundtrip_s', '-'):>12}")
+    print(f"text/binary: {result['bytes_ratio']}x bytes, {result['cpu_ratio']}x cpu")
+
+
+if __name__ == "__main__":
+    main()
@@ -23,14 +23,19 @@ CREATE INDEX IF NOT EXISTS idx_documents_content_trgm
 CREATE INDEX IF NOT EXISTS idx_documents_tenant
   ON documents (tenant_id);
 
--- ANN index only if vector is present and column exists
+-- ANN index only if vector is present and column exists.
+-- HNSW needs no training rows, so it can be built on the empty table. An
+-- ivfflat index built here would train its centroids on nothing; on
+-- pgvector < 0.5 the app builds one (lists sized from the row count) once
+-- the table has data: see api/indexes.py.
 DO $$
 BEGIN
-  IF EXISTS (SELECT 1 FROM pg_extension WHERE extname='vector') THEN
+  IF EXISTS (SELECT 1 FROM pg_extension WHERE extname='vector'
+             AND string_to_array(extversion, '.')::int[] >= '{0,5}') THEN
     IF NOT EXISTS (SELECT 1 FROM pg_indexes WHERE indexname='idx_documents_embedding') THEN
       EXECUTE 'CREATE INDEX idx_documents_embedding
-               ON documents USING ivfflat (embedding vector_l2_ops)
-               WITH (lists = 50)';
+               ON documents USING hnsw (embedding vector_l2_ops)
+               WITH (m = 16, ef_construction = 64)';
     END IF;
   END IF;
 END $$;
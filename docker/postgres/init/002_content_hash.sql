@@ -0,0 +1,9 @@
+-- Content-addressed chunks: sha256(embed model + normalized text), per tenant.
+-- Re-ingesting unchanged content finds the hash and skips the embedding call.
+-- Rows loaded before this migration keep a NULL hash and are never matched.
+-- (initdb only runs scripts on an empty volume; apply by hand on existing DBs.)
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS content_hash BYTEA;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_documents_tenant_content_hash
+  ON documents (tenant_id, content_hash)
+  WHERE content_hash IS NOT NULL;
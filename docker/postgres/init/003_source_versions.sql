@@ -0,0 +1,21 @@
+-- Per-source versioning for incremental re-ingest.
+--   source_url   canonical page URL the chunk came from (NULL for generic CSV rows)
+--   loaded_url   crawl/loadedUrl as fetched
+--   doc_version  ingest run that last wrote the chunk (documents_version_seq)
+--   deleted_at   tombstone: set when a re-crawl no longer produces the chunk;
+--                hidden from retrieval at once, purged by the API's vacuum loop
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS source_url TEXT;
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS loaded_url TEXT;
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS doc_version BIGINT;
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS deleted_at TIMESTAMPTZ;
+
+CREATE SEQUENCE IF NOT EXISTS documents_version_seq;
+
+CREATE INDEX IF NOT EXISTS idx_documents_tenant_source
+  ON documents (tenant_id, source_url)
+  WHERE deleted_at IS NULL;
+
+-- small: only tombstones are indexed
+CREATE INDEX IF NOT EXISTS idx_documents_deleted_at
+  ON documents (deleted_at)
+  WHERE deleted_at IS NOT NULL;
@@ -0,0 +1,10 @@
+-- Full-text search for the ranked "fts" candidate generator (api/retrieval.py).
+--   content_tsv  stored tsvector Postgres keeps in step with content on every
+--                INSERT / COPY / upsert; the text search config must match
+--                FTS_CONFIG in api/retrieval.py
+-- On an existing table the ADD COLUMN rewrites every row (and its indexes) once.
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS content_tsv tsvector
+  GENERATED ALWAYS AS (to_tsvector('english', content)) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_documents_content_tsv
+  ON documents USING gin (content_tsv);
@@ -0,0 +1,16 @@
+import os
+import sys
+
+# api/ modules import each other flat (the container runs from api/); config reads these at import
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "api"))
+for key, value in {
+    "OPENAI_API_KEY": "sk-test",
+    "POSTGRES_HOST": "localhost",
+    "POSTGRES_PORT": "5432",
+    "POSTGRES_DB": "kizen",
+    "POSTGRES_USER": "postgres",
+    "POSTGRES_PASSWORD": "postgres",
+    "CLOUDWATCH_METRICS": "false",
+    "CHUNK_WORKERS": "0",
+}.items():
+    os.environ.setdefault(key, value)
@@ -0,0 +1,42 @@
+"""
+The single-pass chunker against the output of the original per-pattern one.
+chunking_corpus.golden.json was produced by api/chunking.py as of the commit
+before user-008 from chunking_corpus.csv (headings, capped bullets and table
+rows, number normalization, long paragraphs split into overlapping windows,
+text/loadedUrl fallbacks). Regenerate it only for an intended output change.
+"""
+import json
+import os
+
+import pandas as pd
+
+from chunking import _iter_kizen_chunks_from_df, chunk_kizen_batch
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def _corpus() -> pd.DataFrame:
+    return pd.read_csv(os.path.join(FIXTURES, "chunking_corpus.csv"), encoding="utf-8")
+
+
+def _golden() -> list:
+    with open(os.path.join(FIXTURES, "chunking_corpus.golden.json"), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_chunks_match_golden_byte_for_byte():
+    chunks, _ = _iter_kizen_chunks_from_df(_corpus())
+    golden = _golden()
+    assert len(chunks) == len(golden)
+    for i, (got, want) in enumerate(zip(chunks, golden)):
+        assert got.encode("utf-8") == want.encode("utf-8"), f"chunk {i} differs"
+
+
+def test_batches_concatenate_to_the_same_chunks():
+    df = _corpus()
+    chunks = []
+    for start in range(0, len(df), 4):
+        part, hashes, sources = chunk_kizen_batch(df.iloc[start:start + 4])
+        assert len(hashes) == len(part) == len(sources)
+        chunks.extend(part)
+    assert chunks == _golden()